@@ -0,0 +1,50 @@
+import numpy as np
+
+TEXT_KIND = 'text'
+NUMERIC_KIND = 'numeric'
+DATASET_KINDS = [TEXT_KIND, NUMERIC_KIND]
+
+GENERATION_CHUNK_SIZE = 10000  # rows
+
+
+def write_text_dataset(path, rows, classes=2, vocabulary_size=10000, words_per_document=50, seed=0):
+    # half of the words of a document are drawn from the whole vocabulary, half from a slice of it specific to the
+    # class, so that classifiers have something to learn
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f'w{i}' for i in range(vocabulary_size)])
+    class_words = max(1, vocabulary_size // classes)
+    common_words = words_per_document // 2
+    with open(path, mode='wt', encoding='utf-8') as outputfile:
+        outputfile.write('label,text\n')
+        for start in range(0, rows, GENERATION_CHUNK_SIZE):
+            size = min(GENERATION_CHUNK_SIZE, rows - start)
+            labels = rng.integers(classes, size=size)
+            words = np.concatenate([rng.integers(vocabulary_size, size=(size, common_words)),
+                                    labels[:, None] * class_words +
+                                    rng.integers(class_words, size=(size, words_per_document - common_words))],
+                                   axis=1) % vocabulary_size
+            outputfile.writelines(f'class{label},{" ".join(vocabulary[document])}\n'
+                                  for label, document in zip(labels, words))
+
+
+def write_numeric_dataset(path, rows, classes=2, features=20, seed=0):
+    # features are normally distributed around a mean that depends on the class
+    rng = np.random.default_rng(seed)
+    class_means = rng.normal(scale=0.5, size=(classes, features))
+    with open(path, mode='wt', encoding='utf-8') as outputfile:
+        outputfile.write(','.join(['label'] + [f'f{i}' for i in range(features)]) + '\n')
+        for start in range(0, rows, GENERATION_CHUNK_SIZE):
+            size = min(GENERATION_CHUNK_SIZE, rows - start)
+            labels = rng.integers(classes, size=size)
+            values = class_means[labels] + rng.normal(size=(size, features))
+            np.savetxt(outputfile, np.column_stack([labels, values]), fmt=['%d'] + ['%.6g'] * features,
+                       delimiter=',')
+
+
+def write_dataset(path, kind, rows, classes=2, seed=0):
+    if kind == TEXT_KIND:
+        write_text_dataset(path, rows, classes, seed=seed)
+    elif kind == NUMERIC_KIND:
+        write_numeric_dataset(path, rows, classes, seed=seed)
+    else:
+        raise ValueError(f'Unknown dataset kind {kind}, available: {", ".join(DATASET_KINDS)}')
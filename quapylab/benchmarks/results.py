@@ -0,0 +1,61 @@
+import datetime
+import json
+import os
+import platform
+import time
+
+import quapylab
+
+# the name of a metric tells whether lower or higher values are better
+LOWER_IS_BETTER_SUFFIX = '_seconds'
+HIGHER_IS_BETTER_SUFFIX = '_per_second'
+
+REGRESSION_THRESHOLD = 0.1  # relative change
+
+
+def best_time(f, repeat=3):
+    # the fastest of the runs is the least affected by other activity on the machine
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def environment():
+    return {'quapylab': quapylab.__version__, 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count()}
+
+
+def save_results(path, metrics, config):
+    with open(path, mode='wt', encoding='utf-8') as outputfile:
+        json.dump({'created': datetime.datetime.now().isoformat(timespec='seconds'), 'environment': environment(),
+                   'config': config, 'metrics': metrics}, outputfile, indent=2)
+
+
+def load_results(path):
+    with open(path, mode='rt', encoding='utf-8') as inputfile:
+        return json.load(inputfile)
+
+
+def compare_results(metrics, baseline_metrics, threshold=REGRESSION_THRESHOLD):
+    # returns (name, baseline value, value, relative change, regression) for the metrics found in both, the change
+    # is positive when the value got worse
+    comparison = list()
+    for name in sorted(set(metrics) & set(baseline_metrics)):
+        value = metrics[name]
+        baseline_value = baseline_metrics[name]
+        if name.endswith(HIGHER_IS_BETTER_SUFFIX):
+            change = (baseline_value - value) / baseline_value if baseline_value else 0.0
+        elif name.endswith(LOWER_IS_BETTER_SUFFIX):
+            change = (value - baseline_value) / baseline_value if baseline_value else 0.0
+        else:
+            continue
+        comparison.append((name, baseline_value, value, change, change > threshold))
+    return comparison
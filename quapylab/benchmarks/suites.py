@@ -0,0 +1,196 @@
+import io
+import re
+import sys
+import time
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from wsgiref.util import setup_testing_defaults
+
+import numpy as np
+
+from quapylab.benchmarks.data import write_dataset, NUMERIC_KIND
+from quapylab.benchmarks.results import best_time, percentile
+from quapylab.db import open_db, SQLITE_SCHEME
+from quapylab.db.scheduling import Scheduler, FIFO_POLICY, FAIR_POLICY
+from quapylab.util.resources import start_job_accounting, stop_job_accounting
+
+FILE_BACKEND = 'file'
+SQLITE_BACKEND = 'sqlite'
+BACKENDS = [FILE_BACKEND, SQLITE_BACKEND]
+
+DEFAULT_CONFIG = {
+    'backends': BACKENDS,
+    'kinds': ['text', 'numeric'],
+    'classes': 2,
+    'repeat': 3,
+    # dataset write and read
+    'rows': 100000,
+    # job queue
+    'jobs': [10000, 100000],
+    'job_info_samples': 1000,
+    'pops': 20,
+    # web list endpoints
+    'web_jobs': 1000,
+    'web_datasets': 100,
+    'web_requests': 100,
+    # training
+    'training_rows': 5000,
+    'n_jobs': 1,
+}
+
+
+def _connection_string(backend, path):
+    path.mkdir(parents=True, exist_ok=True)
+    return f'{SQLITE_SCHEME}{path}' if backend == SQLITE_BACKEND else str(path)
+
+
+def _upload(db, name, path):
+    with open(path, mode='rb') as inputfile:
+        # as the file part of a request
+        db.set_dataset_from_file(name, SimpleNamespace(file=inputfile), True)
+
+
+def _log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def benchmark_datasets(config, work_dir):
+    metrics = dict()
+    for kind in config['kinds']:
+        path = work_dir / f'{kind}.csv'
+        write_dataset(path, kind, config['rows'], config['classes'])
+        size = path.stat().st_size
+        for backend in config['backends']:
+            _log(f'Datasets: {kind}, {backend}')
+            with open_db(_connection_string(backend, work_dir / f'datasets_{backend}')) as db:
+                seconds = best_time(lambda: _upload(db, kind, path), config['repeat'])
+                prefix = f'dataset.{backend}.{kind}'
+                metrics[f'{prefix}.write_rows_per_second'] = config['rows'] / seconds
+                metrics[f'{prefix}.write_mb_per_second'] = size / 1024 ** 2 / seconds
+                seconds = best_time(lambda: db.get_dataset(kind), config['repeat'])
+                metrics[f'{prefix}.read_rows_per_second'] = config['rows'] / seconds
+    return metrics
+
+
+def _create_jobs(db, count):
+    for i in range(count):
+        db.create_job('train_quantifier', {'name': f'dataset{i % 100}', 'overwrite': True}, i % 3, f'user{i % 10}')
+
+
+def _mean_time(f, arguments):
+    start = time.perf_counter()
+    for argument in arguments:
+        f(argument)
+    return (time.perf_counter() - start) / len(arguments)
+
+
+def benchmark_jobs(config, work_dir):
+    metrics = dict()
+    rng = np.random.default_rng(0)
+    for backend in config['backends']:
+        for count in config['jobs']:
+            _log(f'Jobs: {count}, {backend}')
+            with open_db(_connection_string(backend, work_dir / f'jobs_{backend}_{count}')) as db:
+                prefix = f'jobs.{backend}.{count}'
+                start = time.perf_counter()
+                _create_jobs(db, count)
+                metrics[f'{prefix}.create_per_second'] = count / (time.perf_counter() - start)
+
+                job_ids = db.get_job_ids()
+                sample = rng.choice(job_ids, min(config['job_info_samples'], len(job_ids)), replace=False)
+                metrics[f'{prefix}.get_job_info_seconds'] = _mean_time(db.get_job_info, sample)
+
+                pops = min(config['pops'], count // 2)
+                for policy in [FIFO_POLICY, FAIR_POLICY]:
+                    scheduler = Scheduler(policy)
+                    metrics[f'{prefix}.pop_{policy}_seconds'] = _mean_time(
+                        lambda _: db.pop_pending_job(scheduler, 'benchmark'), range(pops))
+    return metrics
+
+
+def _wsgi_get(application, path, query=''):
+    environ = {'PATH_INFO': path, 'QUERY_STRING': query, 'REQUEST_METHOD': 'GET'}
+    setup_testing_defaults(environ)
+    status = list()
+    body = b''.join(application(environ, lambda response_status, headers, exc_info=None: status.append(
+        response_status)))
+    if not status[0].startswith('200'):
+        raise RuntimeError(f'GET {path}?{query} failed: {status[0]}')
+    return body
+
+
+def benchmark_web(config, work_dir):
+    # requests are served by calling the WSGI application of CherryPy, without a server, so that the time measured
+    # is the one of the handlers, the database and the JSON encoding
+    import cherrypy
+    from quapylab.web import QuaPyLab
+    from quapylab.web.auth import enable_controller_service
+
+    enable_controller_service()
+    cherrypy.config.update({'log.screen': False})
+    metrics = dict()
+    dataset_path = work_dir / 'web_dataset.csv'
+    write_dataset(dataset_path, NUMERIC_KIND, 100, config['classes'])
+    for backend in config['backends']:
+        _log(f'Web: {backend}')
+        with open_db(_connection_string(backend, work_dir / f'web_{backend}')) as db, \
+                QuaPyLab('benchmark', db) as main_app:
+            _create_jobs(db, config['web_jobs'])
+            for i in range(config['web_datasets']):
+                _upload(db, f'dataset{i}', dataset_path)
+            application = cherrypy.tree.mount(main_app, f'/{backend}',
+                                              config={**main_app.get_config(), '/': {'log.screen': False}})
+            try:
+                last_job_page = max(0, (config['web_jobs'] - 1) // 20)
+                for name, path, query in [('get_job_list_first', 'get_job_list', 'page=0&page_size=20'),
+                                          ('get_job_list_last', 'get_job_list', f'page={last_job_page}&page_size=20'),
+                                          ('get_dataset_list', 'get_dataset_list', 'page=0&page_size=20')]:
+                    times = list()
+                    for _ in range(config['web_requests']):
+                        start = time.perf_counter()
+                        _wsgi_get(application, f'/{backend}/{path}', query)
+                        times.append(time.perf_counter() - start)
+                    metrics[f'web.{backend}.{name}_median_seconds'] = percentile(times, 0.5)
+                    metrics[f'web.{backend}.{name}_p95_seconds'] = percentile(times, 0.95)
+            finally:
+                del cherrypy.tree.apps[f'/{backend}']
+    return metrics
+
+
+def benchmark_training(config, work_dir):
+    # imports the machine learning libraries
+    from quapylab.services.experiments import train_quantifier
+
+    metrics = dict()
+    with open_db(_connection_string(FILE_BACKEND, work_dir / 'training')) as db:
+        for kind in config['kinds']:
+            _log(f'Training: {kind}')
+            path = work_dir / f'training_{kind}.csv'
+            write_dataset(path, kind, config['training_rows'], config['classes'])
+            _upload(db, kind, path)
+            start_job_accounting()
+            with redirect_stdout(io.StringIO()):
+                train_quantifier(db, 'benchmark', kind, overwrite=True, n_jobs=config['n_jobs'])
+            stats = stop_job_accounting()
+            metrics[f'training.{kind}.total_seconds'] = stats['wall_time']
+            for phase in stats['phases']:
+                metrics[f'training.{kind}.{re.sub(r"[^0-9A-Za-z]+", "_", phase["name"]).strip("_")}_seconds'] = \
+                    phase['wall_time']
+    return metrics
+
+
+BENCHMARKS = {
+    'datasets': benchmark_datasets,
+    'jobs': benchmark_jobs,
+    'web': benchmark_web,
+    'training': benchmark_training,
+}
+
+
+def run_benchmarks(names, config, work_dir):
+    metrics = dict()
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f'Unknown benchmark {name}, available: {", ".join(BENCHMARKS)}')
+        metrics.update(BENCHMARKS[name](config, work_dir))
+    return metrics
@@ -0,0 +1,15 @@
+from quapylab.db.quapydb import QuaPyDB
+
+SQLITE_SCHEME = 'sqlite://'
+FILE_SCHEME = 'file://'
+
+
+def open_db(connection_string, **kwargs) -> QuaPyDB:
+    connection_string = str(connection_string)
+    if connection_string.startswith(SQLITE_SCHEME):
+        from quapylab.db.sqlitedb import SQLiteDB
+        return SQLiteDB(connection_string[len(SQLITE_SCHEME):], **kwargs)
+    if connection_string.startswith(FILE_SCHEME):
+        connection_string = connection_string[len(FILE_SCHEME):]
+    from quapylab.db.filedb import FileDB
+    return FileDB(connection_string, **kwargs)
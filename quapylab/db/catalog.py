@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import threading
+
+DATASET_FIELDS = ['created', 'size', 'description', 'quantifier']
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        self._path = str(path)
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        # connections must not be shared with forked processes
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self._path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local.connection = None
+
+
+class DatasetCatalog(SQLiteStore):
+    def __init__(self, path):
+        super().__init__(path)
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS datasets ('
+                               'name TEXT PRIMARY KEY, '
+                               'created TEXT, '
+                               'size INTEGER, '
+                               'description TEXT, '
+                               'quantifier TEXT)')
+
+    def set(self, name, **fields):
+        for field in fields:
+            if field not in DATASET_FIELDS:
+                raise KeyError(f'Unknown dataset field {field}')
+        columns = ['name'] + list(fields)
+        updates = ', '.join(f'{field} = excluded.{field}' for field in fields)
+        query = f'INSERT INTO datasets ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+        if updates:
+            query += f' ON CONFLICT(name) DO UPDATE SET {updates}'
+        else:
+            query += ' ON CONFLICT(name) DO NOTHING'
+        with self._connection() as connection:
+            connection.execute(query, [name] + list(fields.values()))
+
+    def update(self, name, **fields):
+        for field in fields:
+            if field not in DATASET_FIELDS:
+                raise KeyError(f'Unknown dataset field {field}')
+        updates = ', '.join(f'{field} = ?' for field in fields)
+        with self._connection() as connection:
+            connection.execute(f'UPDATE datasets SET {updates} WHERE name = ?', list(fields.values()) + [name])
+
+    def add_if_missing(self, name, **fields):
+        columns = ['name'] + list(fields)
+        with self._connection() as connection:
+            connection.execute(f'INSERT OR IGNORE INTO datasets ({", ".join(columns)}) '
+                               f'VALUES ({", ".join("?" * len(columns))})', [name] + list(fields.values()))
+
+    def get(self, name):
+        row = self._connection().execute('SELECT * FROM datasets WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        return dict(row)
+
+    def delete(self, name):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM datasets WHERE name = ?', (name,))
+
+    def names(self):
+        return [row['name'] for row in self._connection().execute('SELECT name FROM datasets ORDER BY name')]
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM datasets').fetchone()[0]
+
+    def page(self, offset, limit):
+        rows = self._connection().execute('SELECT *, COUNT(*) OVER () AS total FROM datasets '
+                                          'ORDER BY name LIMIT ? OFFSET ?', (limit, offset)).fetchall()
+        if len(rows) == 0:
+            return list(), self.count()
+        total = rows[0]['total']
+        return [{key: row[key] for key in row.keys() if key != 'total'} for row in rows], total
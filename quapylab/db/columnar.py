@@ -0,0 +1,252 @@
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+
+COLUMNS_FILENAME = 'columns.json'
+VALUES_EXTENSION = '.values'
+OFFSETS_EXTENSION = '.offsets'
+STRINGS_EXTENSION = '.strings'
+
+NUMERIC_KIND = 'numeric'
+STRING_KIND = 'string'
+
+OFFSET_DTYPE = np.dtype('int64')
+
+# numeric dtypes in promotion order, a column is widened when a later chunk needs a larger type
+NUMERIC_DTYPES = ['bool', 'int64', 'float64']
+PROMOTION_BLOCK_SIZE = 1 << 20
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def _combine_hashes(*digests):
+    combined = hashlib.sha256()
+    for digest in digests:
+        combined.update(digest.encode('utf-8') if isinstance(digest, str) else digest)
+    return combined.hexdigest()
+
+
+def _hash_file(path):
+    file_hash = hashlib.sha256()
+    if path.exists():
+        with open(path, mode='rb') as inputfile:
+            for block in iter(lambda: inputfile.read(HASH_BLOCK_SIZE), b''):
+                file_hash.update(block)
+    return file_hash
+
+
+def _column_kind(series):
+    if series.dtype.kind in 'iub':
+        return NUMERIC_KIND, 'int64' if series.dtype.kind != 'b' else 'bool'
+    if series.dtype.kind == 'f':
+        return NUMERIC_KIND, 'float64'
+    return STRING_KIND, None
+
+
+class ColumnarWriter:
+    def __init__(self, path):
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._columns = None
+        self._files = list()
+        self._hashes = list()
+        self._offsets = list()
+        self._rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(exc_type is None)
+        return False
+
+    @property
+    def rows(self):
+        return self._rows
+
+    def _open(self, df):
+        self._columns = list()
+        for i, name in enumerate(df.columns):
+            kind, dtype = _column_kind(df[name])
+            self._columns.append({'name': str(name), 'kind': kind, 'dtype': dtype})
+            if kind == NUMERIC_KIND:
+                self._files.append((open(self._path / f'{i}{VALUES_EXTENSION}', mode='wb'), None))
+                self._hashes.append((hashlib.sha256(), None))
+            else:
+                self._files.append(None)
+                self._hashes.append(None)
+                self._open_strings(i)
+            self._offsets.append(0)
+
+    def _open_strings(self, i):
+        self._files[i] = (open(self._path / f'{i}{STRINGS_EXTENSION}', mode='wb'),
+                          open(self._path / f'{i}{OFFSETS_EXTENSION}', mode='wb'))
+        self._hashes[i] = (hashlib.sha256(), hashlib.sha256())
+        first_offset = np.zeros(1, dtype=OFFSET_DTYPE).tobytes()
+        self._files[i][1].write(first_offset)
+        self._hashes[i][1].update(first_offset)
+
+    def _write_strings(self, i, strings):
+        strings_file, offsets_file = self._files[i]
+        strings_hash, offsets_hash = self._hashes[i]
+        encoded = [value.encode('utf-8') for value in strings]
+        lengths = np.fromiter((len(value) for value in encoded), dtype=OFFSET_DTYPE, count=len(encoded))
+        offsets = self._offsets[i] + np.cumsum(lengths)
+        values = b''.join(encoded)
+        strings_file.write(values)
+        strings_hash.update(values)
+        offsets_bytes = offsets.tobytes()
+        offsets_file.write(offsets_bytes)
+        offsets_hash.update(offsets_bytes)
+        if len(offsets) > 0:
+            self._offsets[i] = int(offsets[-1])
+
+    @property
+    def columns(self):
+        return self._columns
+
+    def _promote(self, i, dtype):
+        column = self._columns[i]
+        values_file, _ = self._files[i]
+        values_file.close()
+        path = self._path / f'{i}{VALUES_EXTENSION}'
+        promoted_path = self._path / f'{i}{VALUES_EXTENSION}.promoted'
+        values_hash = hashlib.sha256()
+        with open(promoted_path, mode='wb') as outputfile:
+            if self._rows > 0:
+                values = np.memmap(path, dtype=column['dtype'], mode='r', shape=(self._rows,))
+                for start in range(0, self._rows, PROMOTION_BLOCK_SIZE):
+                    block = values[start:start + PROMOTION_BLOCK_SIZE].astype(dtype).tobytes()
+                    outputfile.write(block)
+                    values_hash.update(block)
+                del values
+        promoted_path.replace(path)
+        column['dtype'] = dtype
+        self._files[i] = (open(path, mode='ab'), None)
+        self._hashes[i] = (values_hash, None)
+
+    def _demote(self, i):
+        # a numeric column becomes a string one when a later chunk contains strings, its values are rewritten as the
+        # strings pandas would have read, nulls being empty strings as in string columns
+        column = self._columns[i]
+        values_file, _ = self._files[i]
+        values_file.close()
+        path = self._path / f'{i}{VALUES_EXTENSION}'
+        self._open_strings(i)
+        if self._rows > 0:
+            values = np.memmap(path, dtype=column['dtype'], mode='r', shape=(self._rows,))
+            for start in range(0, self._rows, PROMOTION_BLOCK_SIZE):
+                self._write_strings(i, ['' if value != value else str(value) for value in
+                                        values[start:start + PROMOTION_BLOCK_SIZE].tolist()])
+            del values
+        path.unlink()
+        column['kind'] = STRING_KIND
+        column['dtype'] = None
+
+    def append(self, df):
+        if self._columns is None:
+            self._open(df)
+        elif len(df.columns) != len(self._columns):
+            raise ValueError(f'Found {len(df.columns)} columns after row {self._rows}, expected {len(self._columns)}')
+        for i, column in enumerate(self._columns):
+            series = df.iloc[:, i]
+            if column['kind'] == NUMERIC_KIND:
+                kind, dtype = _column_kind(series)
+                if kind != NUMERIC_KIND:
+                    self._demote(i)
+                elif NUMERIC_DTYPES.index(dtype) > NUMERIC_DTYPES.index(column['dtype']):
+                    self._promote(i, dtype)
+            if column['kind'] == NUMERIC_KIND:
+                values_file, _ = self._files[i]
+                values_hash, _ = self._hashes[i]
+                values = series.to_numpy(dtype=column['dtype']).tobytes()
+                values_file.write(values)
+                values_hash.update(values)
+            else:
+                self._write_strings(i, series.fillna('').astype(str))
+        self._rows += len(df)
+
+    def close(self, commit=True):
+        for values_file, offsets_file in self._files:
+            values_file.close()
+            if offsets_file is not None:
+                offsets_file.close()
+        self._files = list()
+        for column, (values_hash, offsets_hash) in zip(self._columns or list(), self._hashes):
+            if offsets_hash is None:
+                column['sha256'] = _combine_hashes(column['dtype'], values_hash.digest())
+            else:
+                column['sha256'] = _combine_hashes(values_hash.digest(), offsets_hash.digest())
+        if commit:
+            with open(self._path / COLUMNS_FILENAME, mode='wt', encoding='utf-8') as outputfile:
+                json.dump({'rows': self._rows, 'columns': self._columns or list()}, outputfile)
+
+
+def write_dataframe(path, df):
+    with ColumnarWriter(path) as writer:
+        writer.append(df)
+
+
+class ColumnarReader:
+    def __init__(self, path):
+        self._path = Path(path)
+        with open(self._path / COLUMNS_FILENAME, mode='rt', encoding='utf-8') as inputfile:
+            meta = json.load(inputfile)
+        self._rows = meta['rows']
+        self._columns = meta['columns']
+        self._index = {column['name']: i for i, column in enumerate(self._columns)}
+
+    @property
+    def rows(self):
+        return self._rows
+
+    @property
+    def column_names(self):
+        return [column['name'] for column in self._columns]
+
+    def column_hash(self, name):
+        i = self._index[name]
+        column = self._columns[i]
+        if 'sha256' not in column:
+            # datasets stored before hashes were computed at ingest
+            if column['kind'] == NUMERIC_KIND:
+                column['sha256'] = _combine_hashes(column['dtype'],
+                                                   _hash_file(self._path / f'{i}{VALUES_EXTENSION}').digest())
+            else:
+                column['sha256'] = _combine_hashes(_hash_file(self._path / f'{i}{STRINGS_EXTENSION}').digest(),
+                                                   _hash_file(self._path / f'{i}{OFFSETS_EXTENSION}').digest())
+        return column['sha256']
+
+    def _memmap(self, filename, dtype, length):
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._path / filename, dtype=dtype, mode='r', shape=(length,))
+
+    def read_column(self, name, rows=None):
+        i = self._index[name]
+        column = self._columns[i]
+        if rows is None:
+            rows = slice(0, self._rows)
+        start, stop, _ = rows.indices(self._rows)
+        stop = max(start, stop)
+        if column['kind'] == NUMERIC_KIND:
+            return self._memmap(f'{i}{VALUES_EXTENSION}', column['dtype'], self._rows)[start:stop]
+        offsets = self._memmap(f'{i}{OFFSETS_EXTENSION}', OFFSET_DTYPE, self._rows + 1)[start:stop + 1].tolist()
+        if len(offsets) < 2:
+            return np.empty(0, dtype=object)
+        strings = self._memmap(f'{i}{STRINGS_EXTENSION}', np.uint8, offsets[-1])[offsets[0]:offsets[-1]].tobytes()
+        base = offsets[0]
+        values = np.empty(len(offsets) - 1, dtype=object)
+        values[:] = [strings[begin - base:end - base].decode('utf-8') for begin, end in zip(offsets[:-1], offsets[1:])]
+        return values
+
+    def read(self, columns=None, rows=None):
+        import pandas as pd
+
+        if columns is None:
+            columns = self.column_names
+        for name in columns:
+            if name not in self._index:
+                raise KeyError(f'Unknown column {name}')
+        return pd.DataFrame({name: self.read_column(name, rows) for name in columns}, columns=columns, copy=False)
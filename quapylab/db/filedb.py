@@ -1,19 +1,28 @@
 import datetime
+import hashlib
 import json
+import os
 import shutil
+import time
 from pathlib import Path
 
 import dill
-import pandas as pd
 import shortuuid
 
-from quapylab.db.quapydb import QuaPyDB, JobStatus, get_label_column_name, get_text_column_name, get_data_column_names
-from quapylab.util import datetime_now_to_filename
+from quapylab.db.catalog import DatasetCatalog
+from quapylab.db.columnar import ColumnarReader, ColumnarWriter, NUMERIC_KIND
+from quapylab.db.quapydb import QuaPyDB, JobStatus, JOB_LEASE_DURATION, get_job_metadata, get_label_column_name, get_text_column_name, get_data_column_names
+from quapylab.db.scheduling import Scheduler, FIFO_POLICY, FAIR_POLICY
+from quapylab.util import datetime_now_to_filename, datetime_from_filename
 
 DATASET_EXTENSION = '.dataset'
 DATASET_INFO_EXTENSION = '.dataset_info'
 QUANTIFIER_EXTENSION = '.quantifier'
 LOG_EXTENSION = '.log'
+JOB_INFO_EXTENSION = '.json'
+
+DATASET_CHUNK_SIZE = 10000  # rows
+LOG_READ_SIZE = 1024 * 1024  # bytes
 
 
 def check_name(name):
@@ -23,10 +32,42 @@ def check_name(name):
             raise ValueError(f'Dataset name cannot contain {blocked}')
 
 
+def _job_id_from_filename(filename):
+    return filename[:filename.find('.', filename.find('.') + 1)]
+
+
+class SizeLimitedFile:
+    def __init__(self, file, max_size):
+        self._file = file
+        self._max_size = max_size
+        self._read = 0
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self._read += len(data)
+        if self._max_size is not None and self._read > self._max_size:
+            raise ValueError(f'Dataset file is larger than the maximum allowed size of {self._max_size} bytes')
+        return data
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self._file.readline()
+        if not line:
+            raise StopIteration
+        self._read += len(line)
+        if self._max_size is not None and self._read > self._max_size:
+            raise ValueError(f'Dataset file is larger than the maximum allowed size of {self._max_size} bytes')
+        return line
+
+
 class FileDB(QuaPyDB):
+    _catalog_filename = 'catalog.sqlite'
 
-    def __init__(self, path):
+    def __init__(self, path, max_dataset_size=None):
         self._path = Path(path)
+        self._max_dataset_size = max_dataset_size
         if not self._path.exists():
             self._path.mkdir(parents=True, exist_ok=True)
 
@@ -42,6 +83,10 @@ class FileDB(QuaPyDB):
         if not self._job_dir.exists():
             self._job_dir.mkdir(parents=True, exist_ok=True)
 
+        self._job_info_dir = self._path / 'job_info'
+        if not self._job_info_dir.exists():
+            self._job_info_dir.mkdir(parents=True, exist_ok=True)
+
         self._log_dir = self._path / 'logs'
         if not self._log_dir.exists():
             self._log_dir.mkdir(parents=True, exist_ok=True)
@@ -50,6 +95,29 @@ class FileDB(QuaPyDB):
         if not self._report_dir.exists():
             self._report_dir.mkdir(parents=True, exist_ok=True)
 
+        self._cache_dir = self._path / 'cache'
+        if not self._cache_dir.exists():
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self._cancel_dir = self._path / 'cancel'
+        if not self._cancel_dir.exists():
+            self._cancel_dir.mkdir(parents=True, exist_ok=True)
+
+        self._stats_dir = self._path / 'job_stats'
+        if not self._stats_dir.exists():
+            self._stats_dir.mkdir(parents=True, exist_ok=True)
+
+        # a lease file contains its owner, and its modification time, set by the file server, is the last renewal
+        self._lease_dir = self._path / 'leases'
+        if not self._lease_dir.exists():
+            self._lease_dir.mkdir(parents=True, exist_ok=True)
+
+        catalog_file = self._path / self._catalog_filename
+        import_legacy_info = not catalog_file.exists()
+        self._catalog = DatasetCatalog(catalog_file)
+        if import_legacy_info:
+            self._import_legacy_dataset_info()
+
         users_file = self._path / 'user.json'
         if not users_file.exists() or users_file.stat().st_size == 0:
             with open(users_file, mode='wt', encoding='utf-8') as outputfile:
@@ -62,8 +130,23 @@ class FileDB(QuaPyDB):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        self._catalog.close()
         return False
 
+    def _import_legacy_dataset_info(self):
+        for filename in self._dataset_dir.glob('*' + DATASET_EXTENSION):
+            if filename.name.startswith('.'):
+                continue
+            name = filename.name[:-len(DATASET_EXTENSION)]
+            info_filename = self._dataset_dir / (name + DATASET_INFO_EXTENSION)
+            info = dict()
+            if info_filename.exists():
+                with open(info_filename, mode='rb') as inputfile:
+                    info = dill.load(inputfile)
+            created = datetime.datetime.fromtimestamp(filename.stat().st_ctime).strftime('%Y-%m-%d %H:%M:%S')
+            self._catalog.add_if_missing(name, created=created, size=info.get('size'),
+                                         description=info.get('description'), quantifier=info.get('quantifier'))
+
     def validate(self, username: str, password: str) -> bool:
         try:
             return self._users[username] == password
@@ -76,72 +159,126 @@ class FileDB(QuaPyDB):
         if fullpath.exists() and not overwrite:
             raise FileExistsError(f'A dataset with name {name} already exists.')
 
-        with open(fullpath, 'wb') as outfile:
-            shutil.copyfileobj(file.file, outfile)
-
-        df = self.get_dataset(name)
+        tmp_path = self._dataset_dir / f'.{name}.{shortuuid.uuid()}.tmp'
         try:
-            label_column_name = get_label_column_name(df)
-            text_column_name = get_text_column_name(df)
-            if text_column_name is not None:
-                description = f'Text dataset, label_column = {label_column_name}, text_column = {text_column_name}'
-            else:
-                data_column_names = get_data_column_names(df)
-                description = f'Numeric dataset, label_column = {label_column_name}, data_columns = [{", ".join(data_column_names)}]'
-            self._set_dataset_info(name, 'description', description)
+            description, size = self._write_dataset(SizeLimitedFile(file.file, self._max_dataset_size), tmp_path)
+            self._replace_dataset_dir(tmp_path, fullpath)
         except:
-            self.delete_dataset(name)
+            shutil.rmtree(tmp_path, ignore_errors=True)
             raise
-        self._set_dataset_info(name, 'size', len(df))
+        self._catalog.set(name, created=datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), size=size,
+                          description=description)
+
+    def _write_dataset(self, source, path):
+        # imported here, so that the web server does not load pandas until a dataset is uploaded
+        import pandas as pd
+
+        description = None
+        with ColumnarWriter(path) as writer:
+            for chunk in pd.read_csv(source, chunksize=DATASET_CHUNK_SIZE):
+                if description is None:
+                    label_column_name = get_label_column_name(chunk)
+                    text_column_name = get_text_column_name(chunk)
+                    if text_column_name is not None:
+                        description = f'Text dataset, label_column = {label_column_name}, text_column = {text_column_name}'
+                    else:
+                        data_column_names = get_data_column_names(chunk)
+                        description = f'Numeric dataset, label_column = {label_column_name}, data_columns = [{", ".join(data_column_names)}]'
+                if chunk[label_column_name].isna().any():
+                    raise ValueError(f'Missing values in label column {label_column_name} after row {writer.rows}')
+                writer.append(chunk)
+            if description is None:
+                raise ValueError('Empty dataset file')
+            # a data column can turn into a string one at any chunk, the dataset is rejected before being committed
+            if text_column_name is None:
+                for column in writer.columns:
+                    if column['name'] in data_column_names and column['kind'] != NUMERIC_KIND:
+                        raise ValueError(f'Data column {column["name"]} of a numeric dataset is not numeric')
+        return description, writer.rows
+
+    def _replace_dataset_dir(self, tmp_path, fullpath):
+        if fullpath.is_dir():
+            old_path = fullpath.with_name(f'.{fullpath.name}.{shortuuid.uuid()}.old')
+            fullpath.rename(old_path)
+            tmp_path.rename(fullpath)
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            fullpath.unlink(missing_ok=True)
+            tmp_path.rename(fullpath)
 
-    def get_dataset(self, name):
+    def _get_dataset_reader(self, name):
         check_name(name)
         fullpath = self._dataset_dir / (name + DATASET_EXTENSION)
-        return pd.read_csv(fullpath)
+        if fullpath.is_file():
+            # dataset uploaded before the columnar format, converted on first access
+            tmp_path = self._dataset_dir / f'.{name}.{shortuuid.uuid()}.tmp'
+            try:
+                with open(fullpath, mode='rb') as inputfile:
+                    self._write_dataset(inputfile, tmp_path)
+                self._replace_dataset_dir(tmp_path, fullpath)
+            except:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+        return ColumnarReader(fullpath)
+
+    def get_dataset(self, name, columns=None):
+        return self._get_dataset_reader(name).read(columns)
+
+    def get_dataset_chunks(self, name, columns=None, chunk_size=DATASET_CHUNK_SIZE):
+        reader = self._get_dataset_reader(name)
+        for start in range(0, reader.rows, chunk_size):
+            yield reader.read(columns, slice(start, start + chunk_size))
+
+    def get_dataset_row_count(self, name):
+        return self._get_dataset_reader(name).rows
+
+    def get_dataset_column_names(self, name):
+        return self._get_dataset_reader(name).column_names
+
+    def get_dataset_hash(self, name, columns):
+        reader = self._get_dataset_reader(name)
+        dataset_hash = hashlib.sha256()
+        for column in columns:
+            dataset_hash.update(f'{column}:{reader.column_hash(column)}\n'.encode('utf-8'))
+        return dataset_hash.hexdigest()
 
     def delete_dataset(self, name):
         check_name(name)
         fullpath = self._dataset_dir / (name + DATASET_EXTENSION)
+        if fullpath.is_dir():
+            shutil.rmtree(fullpath, ignore_errors=True)
+        else:
+            fullpath.unlink(missing_ok=True)
+        fullpath = self._dataset_dir / (name + DATASET_INFO_EXTENSION)
         fullpath.unlink(missing_ok=True)
+        self._catalog.delete(name)
         self.delete_quantifier(name)
 
     def get_dataset_names(self):
-        dataset_names = list()
-        for filename in self._dataset_dir.glob('*' + DATASET_EXTENSION):
-            dataset_names.append(filename.name[:-len(DATASET_EXTENSION)])
-        return dataset_names
-
-    def _set_dataset_info(self, name, field, value):
-        check_name(name)
-        fullpath = self._dataset_dir / (name + DATASET_INFO_EXTENSION)
-        # TODO lock for concurrent updates
-        if fullpath.exists():
-            with open(fullpath, mode='rb') as inputfile:
-                info = dill.load(inputfile)
-        else:
-            info = dict()
-        info[field] = value
-        with open(fullpath, mode='wb') as outputfile:
-            dill.dump(info, outputfile)
+        return self._catalog.names()
 
     def get_dataset_info(self, name):
         check_name(name)
-        fullpath = self._dataset_dir / (name + DATASET_EXTENSION)
-        created = datetime.datetime.fromtimestamp(fullpath.stat().st_ctime).strftime('%Y-%m-%d %H:%M:%S')
-        fullpath = self._dataset_dir / (name + DATASET_INFO_EXTENSION)
-        with open(fullpath, mode='rb') as inputfile:
-            info = dill.load(inputfile)
+        info = self._catalog.get(name)
+        if info is None:
+            raise FileNotFoundError(f'A dataset with name {name} does not exist.')
+        return self._format_dataset_info(info)
 
+    def _format_dataset_info(self, info):
         return {
-            'name': name,
-            'created': created,
-            'size': info.get('size', 'n/a'),
-            'description': info.get('description', 'n/a'),
-            'quantifier': info.get('quantifier', 'n/a')
+            'name': info['name'],
+            'created': info['created'] or 'n/a',
+            'size': info['size'] if info['size'] is not None else 'n/a',
+            'description': info['description'] or 'n/a',
+            'quantifier': info['quantifier'] or 'n/a'
         }
 
+    def get_dataset_list(self, page, page_size):
+        infos, count = self._catalog.page(page * page_size, page_size)
+        return [self._format_dataset_info(info) for info in infos], count
+
     def get_dataset_count(self):
-        return len(list(self._dataset_dir.iterdir()))
+        return self._catalog.count()
 
     def set_quantifier(self, name, quantifier, overwrite=False):
         check_name(name)
@@ -149,9 +286,12 @@ class FileDB(QuaPyDB):
         if fullpath.exists() and not overwrite:
             raise FileExistsError(f'A quantifier with name "{name}" already exists.')
 
-        with open(fullpath, mode='wb') as outputfile:
+        # replaced atomically, as it can be loaded by the web application at any time
+        tmp_path = self._quantifier_dir / f'.{name}.{shortuuid.uuid()}.tmp'
+        with open(tmp_path, mode='wb') as outputfile:
             dill.dump(quantifier, outputfile)
-        self._set_dataset_info(name, 'quantifier', str(quantifier))
+        tmp_path.replace(fullpath)
+        self._catalog.update(name, quantifier=str(quantifier))
 
     def delete_quantifier(self, name):
         check_name(name)
@@ -165,6 +305,14 @@ class FileDB(QuaPyDB):
                 return dill.load(inputfile)
         return None
 
+    def get_quantifier_version(self, name):
+        check_name(name)
+        fullpath = self._quantifier_dir / (name + QUANTIFIER_EXTENSION)
+        try:
+            return fullpath.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
     def get_quantifier_names(self):
         quantifier_names = list()
         for filename in self._quantifier_dir.glob('*' + QUANTIFIER_EXTENSION):
@@ -174,44 +322,195 @@ class FileDB(QuaPyDB):
     def get_quantifier_count(self):
         return len(list(self._quantifier_dir.iterdir()))
 
-    def create_job(self, function, kwargs):
+    def create_job(self, function, kwargs, priority=0, username=None):
         job_id = f'{datetime_now_to_filename()}.{shortuuid.uuid()}'
 
+        with open(self._job_info_dir / f'{job_id}{JOB_INFO_EXTENSION}', mode='wt', encoding='utf-8') as outputfile:
+            json.dump(get_job_metadata(function, kwargs, priority, username), outputfile)
+
         jobfile = self._job_dir / (f'{job_id}.{JobStatus.creating.value}')
         with open(jobfile, mode='wb') as outputfile:
             dill.dump((function, kwargs), outputfile)
         jobfile.rename(self._job_dir / (f'{job_id}.{JobStatus.pending.value}'))
-
-    def pop_pending_job(self):
-        try:
-            job_filename = next(self._job_dir.glob(f'*.{JobStatus.pending.value}'))
-            if job_filename is not None:
-                job_id = job_filename.name[:-len(JobStatus.pending.value) - 1]
-                new_filename = self._job_dir / f'{job_id}.{datetime_now_to_filename()}.{JobStatus.running.value}'
+        self._notify_job_listeners()
+
+    def _estimate_job_cost(self, job_info):
+        info = self._catalog.get(job_info['dataset']) if job_info.get('dataset') is not None else None
+        if info is None:
+            return 0
+        return info['size'] or 0
+
+    def _scheduling_info(self, job_filename):
+        # only the fields the schedulers use, without the stats of the job
+        job_id = _job_id_from_filename(job_filename.name)
+        return {**self._get_job_metadata(job_id, job_filename), 'job_id': job_id,
+                'created': job_filename.name.split('.')[0]}
+
+    def _scheduling_order(self, scheduler, pending, running):
+        # pending and running are job filenames, returns the ids of the pending jobs in the order they are to be run
+        if scheduler.policy == FIFO_POLICY:
+            # job ids start with their creation time, no metadata is needed to sort them
+            return sorted(_job_id_from_filename(job_filename.name) for job_filename in pending)
+        infos = {JobStatus.pending: list(), JobStatus.running: list()}
+        for status, job_filenames in [(JobStatus.pending, pending), (JobStatus.running, running)]:
+            for job_filename in job_filenames:
+                try:
+                    infos[status].append(self._scheduling_info(job_filename))
+                except FileNotFoundError:
+                    # deleted meanwhile
+                    continue
+        # the cost of a job is the size of its dataset, looked up once per dataset
+        costs = dict()
+
+        def cost(job_info):
+            if job_info.get('dataset') not in costs:
+                costs[job_info.get('dataset')] = self._estimate_job_cost(job_info)
+            return costs[job_info.get('dataset')]
+
+        return [job_info['job_id'] for job_info in
+                scheduler.order(infos[JobStatus.pending], infos[JobStatus.running], cost)]
+
+    def pop_pending_job(self, scheduler=None, owner=None):
+        if scheduler is None:
+            scheduler = Scheduler(FIFO_POLICY)
+        pending = list()
+        running = list()
+        for job_filename in self._job_dir.iterdir():
+            status = job_filename.name.split('.')[-1]
+            if status == JobStatus.pending.value:
+                pending.append(job_filename)
+            elif status == JobStatus.running.value and scheduler.policy == FAIR_POLICY:
+                # only the fair policy looks at the running jobs
+                running.append(job_filename)
+        for job_id in self._scheduling_order(scheduler, pending, running):
+            job_filename = self._job_dir / f'{job_id}.{JobStatus.pending.value}'
+            new_filename = self._job_dir / f'{job_id}.{datetime_now_to_filename()}.{JobStatus.running.value}'
+            try:
                 job_filename.rename(new_filename)
-                with open(new_filename, mode='rb') as inputfile:
-                    function, kwargs = dill.load(inputfile)
-                return job_id, function, kwargs
-            return None, None, None
-        except StopIteration:
-            return None, None, None
+            except FileNotFoundError:
+                # taken by another processor, or deleted
+                continue
+            if owner is not None:
+                self._write_lease(job_id, owner)
+            with open(new_filename, mode='rb') as inputfile:
+                function, kwargs = dill.load(inputfile)
+            return job_id, function, kwargs
+        return None, None, None
 
     def set_job_done(self, job_id):
-        job_filename = self._job_dir / next(self._job_dir.glob(f'{job_id}*'))
-        new_filename = self._job_dir / f'{job_filename.name[:job_filename.name.rfind(".")]}.{datetime_now_to_filename()}.{JobStatus.done.value}'
-        job_filename.rename(new_filename)
+        self.set_job_completed(job_id, JobStatus.done)
 
     def set_job_failed(self, job_id):
+        self.set_job_completed(job_id, JobStatus.error)
+
+    def set_job_completed(self, job_id, status, owner=None):
+        if owner is not None and self._read_lease(job_id) != owner:
+            # the lease has expired and the job has been requeued
+            return
         job_filename = self._job_dir / next(self._job_dir.glob(f'{job_id}*'))
-        new_filename = self._job_dir / f'{job_filename.name[:job_filename.name.rfind(".")]}.{datetime_now_to_filename()}.{JobStatus.error.value}'
+        new_filename = self._job_dir / f'{job_filename.name[:job_filename.name.rfind(".")]}.{datetime_now_to_filename()}.{status.value}'
         job_filename.rename(new_filename)
+        (self._cancel_dir / job_id).unlink(missing_ok=True)
+        (self._lease_dir / job_id).unlink(missing_ok=True)
+
+    def set_job_stats(self, job_id, stats):
+        stats_file = self._stats_dir / f'{job_id}{JOB_INFO_EXTENSION}'
+        tmp_file = self._stats_dir / f'.{job_id}.{shortuuid.uuid()}.tmp'
+        with open(tmp_file, mode='wt', encoding='utf-8') as outputfile:
+            json.dump(stats, outputfile)
+        tmp_file.replace(stats_file)
+
+    def _get_job_stats(self, job_id):
+        try:
+            with open(self._stats_dir / f'{job_id}{JOB_INFO_EXTENSION}', mode='rt', encoding='utf-8') as inputfile:
+                return json.load(inputfile)
+        except FileNotFoundError:
+            return None
+
+    def _write_lease(self, job_id, owner):
+        tmp_lease_file = self._lease_dir / f'.{job_id}.{shortuuid.uuid()}.tmp'
+        tmp_lease_file.write_text(owner, encoding='utf-8')
+        tmp_lease_file.replace(self._lease_dir / job_id)
+
+    def _read_lease(self, job_id):
+        try:
+            return (self._lease_dir / job_id).read_text(encoding='utf-8')
+        except FileNotFoundError:
+            return None
+
+    def renew_job_leases(self, owner, job_ids):
+        renewed = set()
+        for job_id in job_ids:
+            if self._read_lease(job_id) != owner:
+                continue
+            try:
+                os.utime(self._lease_dir / job_id)
+            except FileNotFoundError:
+                continue
+            renewed.add(job_id)
+        return renewed
+
+    def requeue_expired_jobs(self, is_owner_alive=None):
+        now = time.time()
+        requeued = list()
+        for job_filename in list(self._job_dir.glob(f'*.{JobStatus.running.value}')):
+            job_id = _job_id_from_filename(job_filename.name)
+            lease_file = self._lease_dir / job_id
+            try:
+                owner = lease_file.read_text(encoding='utf-8')
+                expires = lease_file.stat().st_mtime + JOB_LEASE_DURATION
+            except FileNotFoundError:
+                # claimed by a version without leases, or the lease is being written
+                owner = None
+                try:
+                    expires = datetime_from_filename(job_filename.name.split('.')[2]).timestamp() + JOB_LEASE_DURATION
+                except (IndexError, ValueError):
+                    expires = 0
+            if expires > now and (owner is None or is_owner_alive is None or is_owner_alive(owner)):
+                continue
+            if owner is not None:
+                # removing the lease first makes the owner lose it, only one of the processors requeuing the job
+                # succeeds in renaming it
+                tombstone = self._lease_dir / f'.{job_id}.{shortuuid.uuid()}.expired'
+                try:
+                    lease_file.rename(tombstone)
+                except FileNotFoundError:
+                    continue
+                tombstone.unlink(missing_ok=True)
+            try:
+                job_filename.rename(self._job_dir / f'{job_id}.{JobStatus.pending.value}')
+            except FileNotFoundError:
+                # completed meanwhile
+                continue
+            requeued.append(job_id)
+        if len(requeued) > 0:
+            self._notify_job_listeners()
+        return requeued
+
+    def cancel_job(self, job_id):
+        now = datetime_now_to_filename()
+        try:
+            (self._job_dir / f'{job_id}.{JobStatus.pending.value}').rename(
+                self._job_dir / f'{job_id}.{now}.{now}.{JobStatus.cancelled.value}')
+            return
+        except FileNotFoundError:
+            pass
+        if next(self._job_dir.glob(f'{job_id}.*.{JobStatus.running.value}'), None) is None:
+            raise ValueError(f'Job {job_id} is not pending or running')
+        (self._cancel_dir / job_id).touch()
+        self._notify_job_listeners()
+
+    def get_cancel_requests(self):
+        return {request.name for request in self._cancel_dir.iterdir()}
 
     def get_job_ids(self):
-        return [job_file.name[:job_file.name.find('.', job_file.name.find('.') + 1)] for job_file in
-                self._job_dir.iterdir()]
+        return sorted(_job_id_from_filename(job_file.name) for job_file in self._job_dir.iterdir())
 
     def get_job_info(self, job_id):
-        job_filename = self._job_dir / next(self._job_dir.glob(f'{job_id}*'))
+        return self._job_info_from_filename(next(self._job_dir.glob(f'{job_id}*')))
+
+    def _job_info_from_filename(self, job_filename):
+        job_id = _job_id_from_filename(job_filename.name)
         fields = job_filename.name.split('.')
         status = fields[-1]
         created = fields[0]
@@ -223,39 +522,102 @@ class FileDB(QuaPyDB):
             completed = fields[3]
         else:
             completed = 'n/a'
-        with open(job_filename, mode='rb') as inputfile:
-            function, kwargs = dill.load(inputfile)
-        return {'job_id': job_id, 'function': function.__name__, 'arguments': str(kwargs), 'status': status,
-                'created': created, 'started': started, 'completed': completed}
+        return {**self._get_job_metadata(job_id, job_filename), 'job_id': job_id, 'status': status,
+                'created': created, 'started': started, 'completed': completed, 'stats': self._get_job_stats(job_id)}
+
+    def _get_job_metadata(self, job_id, job_filename):
+        info_file = self._job_info_dir / f'{job_id}{JOB_INFO_EXTENSION}'
+        try:
+            with open(info_file, mode='rt', encoding='utf-8') as inputfile:
+                return json.load(inputfile)
+        except FileNotFoundError:
+            # job created before metadata was stored separately
+            with open(job_filename, mode='rb') as inputfile:
+                function, kwargs = dill.load(inputfile)
+            metadata = get_job_metadata(function, kwargs)
+            with open(info_file, mode='wt', encoding='utf-8') as outputfile:
+                json.dump(metadata, outputfile)
+            return metadata
+
+    def get_job_list(self, page, page_size):
+        job_filenames = sorted(self._job_dir.iterdir(), key=lambda job_file: job_file.name)
+        return [self._job_info_from_filename(job_filename) for job_filename in
+                job_filenames[page * page_size:(page + 1) * page_size]]
 
     def get_job_count(self):
         return len(list(self._job_dir.iterdir()))
 
+    def get_job_status_counts(self):
+        counts = {status: 0 for status in JobStatus}
+        for job_filename in self._job_dir.iterdir():
+            try:
+                counts[JobStatus(job_filename.name.split('.')[-1])] += 1
+            except ValueError:
+                # temporary file
+                continue
+        return counts
+
     def delete_job(self, job_id):
         filename = next(self._job_dir.glob(f'{job_id}*'))
         filename.unlink(missing_ok=True)
+        info_file = self._job_info_dir / f'{job_id}{JOB_INFO_EXTENSION}'
+        info_file.unlink(missing_ok=True)
         log_file = self._log_dir / f'{job_id}{LOG_EXTENSION}'
         log_file.unlink(missing_ok=True)
+        (self._cancel_dir / job_id).unlink(missing_ok=True)
+        (self._lease_dir / job_id).unlink(missing_ok=True)
+        (self._stats_dir / f'{job_id}{JOB_INFO_EXTENSION}').unlink(missing_ok=True)
+
+    def delete_jobs(self, status=None):
+        for job_filename in list(self._job_dir.iterdir()):
+            if status is None or job_filename.name.endswith(f'.{status.value}'):
+                job_filename.unlink(missing_ok=True)
+                job_id = _job_id_from_filename(job_filename.name)
+                info_file = self._job_info_dir / f'{job_id}{JOB_INFO_EXTENSION}'
+                info_file.unlink(missing_ok=True)
+                log_file = self._log_dir / f'{job_id}{LOG_EXTENSION}'
+                log_file.unlink(missing_ok=True)
+                (self._cancel_dir / job_id).unlink(missing_ok=True)
+                (self._lease_dir / job_id).unlink(missing_ok=True)
+                (self._stats_dir / f'{job_id}{JOB_INFO_EXTENSION}').unlink(missing_ok=True)
 
     def rerun_job(self, job_id):
         filename = next(self._job_dir.glob(f'{job_id}*'))
-        job_filename = filename.name[:filename.name.find('.', filename.name.find('.') + 1)]
+        job_filename = _job_id_from_filename(filename.name)
         pending_filename = f'{job_filename}.{JobStatus.pending.value}'
         log_file = self._log_dir / f'{job_filename}{LOG_EXTENSION}'
         log_file.unlink(missing_ok=True)
+        (self._cancel_dir / job_filename).unlink(missing_ok=True)
+        (self._lease_dir / job_filename).unlink(missing_ok=True)
+        (self._stats_dir / f'{job_filename}{JOB_INFO_EXTENSION}').unlink(missing_ok=True)
         filename.rename(self._job_dir / pending_filename)
+        self._notify_job_listeners()
 
     def get_job_log_stream(self, job_id):
         log_file = self._log_dir / f'{job_id}{LOG_EXTENSION}'
-        return open(log_file, mode='wt', encoding='utf-8')
+        # line buffered, so that readers see each line as soon as it is printed
+        return open(log_file, mode='wt', encoding='utf-8', buffering=1)
 
-    def get_job_log_content(self, job_id):
+    def get_job_log_content(self, job_id, offset=0):
         log_file = self._log_dir / f'{job_id}{LOG_EXTENSION}'
-        if not log_file.exists():
-            return ''
-        else:
-            with open(log_file, mode='rt', encoding='utf-8') as inputfile:
-                return inputfile.read()
+        try:
+            with open(log_file, mode='rb') as inputfile:
+                size = inputfile.seek(0, 2)
+                if offset > size:
+                    # the log has been rewritten by a rerun of the job
+                    offset = 0
+                inputfile.seek(offset)
+                content = inputfile.read(LOG_READ_SIZE)
+        except FileNotFoundError:
+            return '', 0
+        # only complete lines are returned, the rest is read on the next call
+        end = content.rfind(b'\n') + 1
+        if end == 0 and len(content) == LOG_READ_SIZE:
+            end = len(content)
+        return content[:end].decode('utf-8', errors='replace'), offset + end
 
     def get_report_dir(self):
-        return self._report_dir
\ No newline at end of file
+        return self._report_dir
+
+    def get_cache_dir(self):
+        return self._cache_dir
\ No newline at end of file
@@ -1,7 +1,9 @@
 from abc import ABC, abstractmethod
 from enum import Enum
+from typing import TYPE_CHECKING, Iterator
 
-from pandas import DataFrame
+if TYPE_CHECKING:
+    from pandas import DataFrame
 
 
 class JobStatus(Enum):
@@ -10,16 +12,32 @@ class JobStatus(Enum):
     running = 'running'
     done = 'done'
     error = 'error'
+    cancelled = 'cancelled'
+    timeout = 'timeout'
+    out_of_memory = 'out_of_memory'
+
+
+# a running job is claimed by a processor for this time, the processor renews the claim while the job runs, when it
+# does not, e.g., it has crashed, the job is run again
+JOB_LEASE_DURATION = 60  # seconds
+
+# statuses of jobs that are not going to run anymore, unless rerun
+COMPLETED_JOB_STATUSES = [JobStatus.done, JobStatus.error, JobStatus.cancelled, JobStatus.timeout,
+                          JobStatus.out_of_memory]
 
 
 LABEL_COLUMN_NAMES = ['label', 'class']
 TEXT_COLUMN_NAMES = ['text', 'document', 'content']
 
 
-def get_label_column_name(df: DataFrame):
+def _column_names(df):
+    return getattr(df, 'columns', df)
+
+
+def get_label_column_name(df: 'DataFrame'):
     label_column_name = None
     for name in LABEL_COLUMN_NAMES:
-        if name in df.columns:
+        if name in _column_names(df):
             label_column_name = name
             break
 
@@ -30,27 +48,44 @@ def get_label_column_name(df: DataFrame):
     return label_column_name
 
 
-def get_text_column_name(df: DataFrame):
+def get_text_column_name(df: 'DataFrame'):
     text_column_name = None
     for name in TEXT_COLUMN_NAMES:
-        if name in df.columns:
+        if name in _column_names(df):
             text_column_name = name
             break
 
     return text_column_name
 
 
-def get_data_column_names(df: DataFrame):
+def get_data_column_names(df: 'DataFrame'):
     data_column_names = list()
-    for name in df.columns:
+    for name in _column_names(df):
         if name not in LABEL_COLUMN_NAMES and name not in TEXT_COLUMN_NAMES:
             data_column_names.append(name)
 
     return data_column_names
 
 
+def get_job_metadata(function, kwargs, priority=0, username=None):
+    return {'function': function if isinstance(function, str) else function.__name__,
+            'arguments': str(kwargs),
+            'dataset': kwargs.get('name'),
+            'priority': priority,
+            'username': username}
+
+
 class QuaPyDB(ABC):
 
+    def add_job_listener(self, listener):
+        if not hasattr(self, '_job_listeners'):
+            self._job_listeners = list()
+        self._job_listeners.append(listener)
+
+    def _notify_job_listeners(self):
+        for listener in getattr(self, '_job_listeners', list()):
+            listener()
+
     @abstractmethod
     def validate(self, username: str, password: str) -> bool:
         pass
@@ -60,7 +95,23 @@ class QuaPyDB(ABC):
         pass
 
     @abstractmethod
-    def get_dataset(self, name) -> DataFrame:
+    def get_dataset(self, name, columns=None) -> 'DataFrame':
+        pass
+
+    @abstractmethod
+    def get_dataset_chunks(self, name, columns=None, chunk_size=10000) -> Iterator['DataFrame']:
+        pass
+
+    @abstractmethod
+    def get_dataset_row_count(self, name):
+        pass
+
+    @abstractmethod
+    def get_dataset_column_names(self, name):
+        pass
+
+    @abstractmethod
+    def get_dataset_hash(self, name, columns):
         pass
 
     @abstractmethod
@@ -75,6 +126,10 @@ class QuaPyDB(ABC):
     def get_dataset_names(self):
         pass
 
+    @abstractmethod
+    def get_dataset_list(self, page, page_size):
+        pass
+
     @abstractmethod
     def get_dataset_count(self):
         pass
@@ -91,6 +146,10 @@ class QuaPyDB(ABC):
     def get_quantifier(self, name):
         pass
 
+    @abstractmethod
+    def get_quantifier_version(self, name):
+        pass
+
     @abstractmethod
     def get_quantifier_names(self):
         pass
@@ -100,11 +159,23 @@ class QuaPyDB(ABC):
         pass
 
     @abstractmethod
-    def create_job(self, function, kwargs):
+    def create_job(self, function, kwargs, priority=0, username=None):
         pass
 
     @abstractmethod
-    def pop_pending_job(self):
+    def pop_pending_job(self, scheduler=None, owner=None):
+        # the scheduler chooses among the pending jobs, by default the oldest one is returned, the job is leased to
+        # owner
+        pass
+
+    @abstractmethod
+    def renew_job_leases(self, owner, job_ids):
+        # returns the jobs whose lease is still held by owner
+        pass
+
+    @abstractmethod
+    def requeue_expired_jobs(self, is_owner_alive=None):
+        # running jobs whose lease has expired, or whose owner is not alive, become pending again
         pass
 
     @abstractmethod
@@ -115,6 +186,25 @@ class QuaPyDB(ABC):
     def set_job_failed(self, job_id):
         pass
 
+    @abstractmethod
+    def set_job_completed(self, job_id, status, owner=None):
+        # when owner is given, the job is updated only if it still holds the lease on it
+        pass
+
+    @abstractmethod
+    def set_job_stats(self, job_id, stats):
+        # resources used by the job, returned by get_job_info as its stats
+        pass
+
+    @abstractmethod
+    def cancel_job(self, job_id):
+        # a pending job is cancelled immediately, a running one is stopped by the processor running it
+        pass
+
+    @abstractmethod
+    def get_cancel_requests(self):
+        pass
+
     @abstractmethod
     def get_job_ids(self):
         pass
@@ -123,14 +213,27 @@ class QuaPyDB(ABC):
     def get_job_info(self, job_id):
         pass
 
+    @abstractmethod
+    def get_job_list(self, page, page_size):
+        pass
+
     @abstractmethod
     def get_job_count(self):
         pass
 
+    @abstractmethod
+    def get_job_status_counts(self):
+        # number of jobs in each status, as a dict from JobStatus to count
+        pass
+
     @abstractmethod
     def delete_job(self, job_id):
         pass
 
+    @abstractmethod
+    def delete_jobs(self, status=None):
+        pass
+
     @abstractmethod
     def rerun_job(self, job_id):
         pass
@@ -140,13 +243,18 @@ class QuaPyDB(ABC):
         pass
 
     @abstractmethod
-    def get_job_log_content(self, job_id):
+    def get_job_log_content(self, job_id, offset=0):
+        # returns the complete lines of the log written after offset, and the offset to read from on the next call
         pass
 
     @abstractmethod
     def get_report_dir(self):
         pass
 
+    @abstractmethod
+    def get_cache_dir(self):
+        pass
+
 
     # def get_aggregative_algorithm_names(self):
     #     return [m.__name__ for m in method.AGGREGATIVE_METHODS]
@@ -0,0 +1,58 @@
+import datetime
+
+from quapylab.util import datetime_from_filename
+
+FIFO_POLICY = 'fifo'
+PRIORITY_POLICY = 'priority'
+SJF_POLICY = 'sjf'
+FAIR_POLICY = 'fair'
+SCHEDULING_POLICIES = [FIFO_POLICY, PRIORITY_POLICY, SJF_POLICY, FAIR_POLICY]
+
+# a pending job gains one priority level, and has its estimated cost halved, every aging interval it waits
+AGING_INTERVAL = 600  # seconds
+MAX_COST_AGING = 64
+
+
+def _waiting_time(job, now):
+    try:
+        created = datetime_from_filename(job['created'])
+    except (KeyError, TypeError, ValueError):
+        return 0
+    return max(0.0, (now - created).total_seconds())
+
+
+class Scheduler:
+    # chooses the order in which pending jobs are run:
+    #  fifo: by creation time
+    #  priority: by explicit priority, then by creation time
+    #  sjf: by explicit priority, then by estimated cost, i.e., the size of the dataset, shortest first
+    #  fair: as sjf, but first the jobs of the users with fewer running jobs
+    # aging raises the priority and lowers the estimated cost of waiting jobs, so that no job starves
+    def __init__(self, policy=FAIR_POLICY, aging_interval=AGING_INTERVAL):
+        if policy not in SCHEDULING_POLICIES:
+            raise ValueError(f'Unknown scheduling policy {policy}, available: {", ".join(SCHEDULING_POLICIES)}')
+        self.policy = policy
+        self.aging_interval = aging_interval
+
+    def order(self, pending, running=(), cost=None, now=None):
+        # pending and running are lists of job info dicts, cost maps a job info to its estimated cost
+        if now is None:
+            now = datetime.datetime.now()
+        if self.policy == FIFO_POLICY:
+            return sorted(pending, key=lambda job: (job['created'], job['job_id']))
+
+        running_per_user = dict()
+        for job in running:
+            running_per_user[job.get('username')] = running_per_user.get(job.get('username'), 0) + 1
+
+        def key(job):
+            age = _waiting_time(job, now) / self.aging_interval
+            priority = -(job.get('priority') or 0) - int(age)
+            if self.policy == PRIORITY_POLICY:
+                return priority, job['created'], job['job_id']
+            estimated_cost = (cost(job) if cost is not None else 0) / 2 ** min(age, MAX_COST_AGING)
+            if self.policy == SJF_POLICY:
+                return priority, estimated_cost, job['created'], job['job_id']
+            return running_per_user.get(job.get('username'), 0), priority, estimated_cost, job['created'], job['job_id']
+
+        return sorted(pending, key=key)
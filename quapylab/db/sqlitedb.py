@@ -0,0 +1,291 @@
+import json
+import time
+
+import dill
+import shortuuid
+
+from quapylab.db.catalog import SQLiteStore
+from quapylab.db.filedb import FileDB, QUANTIFIER_EXTENSION, LOG_EXTENSION, JOB_INFO_EXTENSION, \
+    _job_id_from_filename
+from quapylab.db.quapydb import JobStatus, JOB_LEASE_DURATION, get_job_metadata
+from quapylab.db.scheduling import FIFO_POLICY
+from quapylab.util import datetime_now_to_filename, datetime_from_filename
+
+SQLITE_FILENAME = 'quapylab.sqlite'
+
+JOB_METADATA_COLUMNS = {'function': 'TEXT', 'arguments': 'TEXT', 'dataset': 'TEXT',
+                        'priority': 'INTEGER NOT NULL DEFAULT 0', 'username': 'TEXT'}
+# columns added to the jobs table after its first version
+JOB_ADDED_COLUMNS = {**JOB_METADATA_COLUMNS, 'cancel_requested': 'INTEGER NOT NULL DEFAULT 0', 'owner': 'TEXT',
+                     'lease_expires': 'REAL', 'stats': 'TEXT'}
+JOB_INFO_COLUMNS = ', '.join(['job_id', 'status', 'created', 'started', 'completed', 'stats'] +
+                             list(JOB_METADATA_COLUMNS))
+
+
+class JobStore(SQLiteStore):
+    def __init__(self, path):
+        super().__init__(path)
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                               'job_id TEXT PRIMARY KEY, '
+                               'status TEXT NOT NULL, '
+                               'created TEXT NOT NULL, '
+                               'started TEXT, '
+                               'completed TEXT, '
+                               'function TEXT, '
+                               'arguments TEXT, '
+                               'dataset TEXT, '
+                               'priority INTEGER NOT NULL DEFAULT 0, '
+                               'username TEXT, '
+                               'cancel_requested INTEGER NOT NULL DEFAULT 0, '
+                               'owner TEXT, '
+                               'lease_expires REAL, '
+                               'stats TEXT, '
+                               'payload BLOB NOT NULL)')
+            columns = [row['name'] for row in connection.execute('PRAGMA table_info(jobs)')]
+            for column, column_type in JOB_ADDED_COLUMNS.items():
+                if column not in columns:
+                    connection.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+            for row in connection.execute('SELECT job_id, payload FROM jobs WHERE function IS NULL').fetchall():
+                metadata = get_job_metadata(*dill.loads(row['payload']))
+                connection.execute('UPDATE jobs SET function = ?, arguments = ?, dataset = ? WHERE job_id = ?',
+                                   (metadata['function'], metadata['arguments'], metadata['dataset'], row['job_id']))
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created, job_id)')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created, job_id)')
+            connection.execute('CREATE TABLE IF NOT EXISTS quantifiers ('
+                               'name TEXT PRIMARY KEY, '
+                               'created TEXT NOT NULL, '
+                               'description TEXT)')
+
+
+# datasets, quantifiers and jobs are indexed in SQLite tables, while dataset columns, quantifier models, logs
+# and reports are kept in the same directory layout used by FileDB
+class SQLiteDB(FileDB):
+    _catalog_filename = SQLITE_FILENAME
+
+    def __init__(self, path, max_dataset_size=None):
+        super().__init__(path, max_dataset_size)
+        self._store = JobStore(self._path / SQLITE_FILENAME)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._store.close()
+        return super().__exit__(exc_type, exc_value, traceback)
+
+    def _execute(self, query, parameters=()):
+        with self._store._connection() as connection:
+            return connection.execute(query, parameters).fetchall()
+
+    def set_quantifier(self, name, quantifier, overwrite=False):
+        super().set_quantifier(name, quantifier, overwrite)
+        self._execute('INSERT INTO quantifiers (name, created, description) VALUES (?, ?, ?) '
+                      'ON CONFLICT(name) DO UPDATE SET created = excluded.created, description = excluded.description',
+                      (name, datetime_now_to_filename(), str(quantifier)))
+
+    def delete_quantifier(self, name):
+        super().delete_quantifier(name)
+        self._execute('DELETE FROM quantifiers WHERE name = ?', (name,))
+
+    def get_quantifier_names(self):
+        return [row['name'] for row in self._execute('SELECT name FROM quantifiers ORDER BY name')]
+
+    def get_quantifier_count(self):
+        return self._execute('SELECT COUNT(*) FROM quantifiers')[0][0]
+
+    def create_job(self, function, kwargs, priority=0, username=None):
+        job_id = f'{datetime_now_to_filename()}.{shortuuid.uuid()}'
+        metadata = get_job_metadata(function, kwargs, priority, username)
+        self._execute('INSERT INTO jobs (job_id, status, created, function, arguments, dataset, priority, username, '
+                      'payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                      (job_id, JobStatus.pending.value, job_id.split('.')[0], metadata['function'],
+                       metadata['arguments'], metadata['dataset'], metadata['priority'], metadata['username'],
+                       dill.dumps((function, kwargs))))
+        self._notify_job_listeners()
+
+    def pop_pending_job(self, scheduler=None, owner=None):
+        lease_expires = time.time() + JOB_LEASE_DURATION if owner is not None else None
+        if scheduler is None or scheduler.policy == FIFO_POLICY:
+            rows = self._execute('UPDATE jobs SET status = ?, started = ?, owner = ?, lease_expires = ? WHERE job_id = '
+                                 '(SELECT job_id FROM jobs WHERE status = ? ORDER BY created, job_id LIMIT 1) '
+                                 'RETURNING job_id, payload',
+                                 (JobStatus.running.value, datetime_now_to_filename(), owner, lease_expires,
+                                  JobStatus.pending.value))
+        else:
+            jobs = [self._job_info_from_row(row) for row in
+                    self._execute(f'SELECT {JOB_INFO_COLUMNS} FROM jobs WHERE status IN (?, ?)',
+                                  (JobStatus.pending.value, JobStatus.running.value))]
+            pending = [job for job in jobs if job['status'] == JobStatus.pending.value]
+            running = [job for job in jobs if job['status'] == JobStatus.running.value]
+            rows = list()
+            for job in scheduler.order(pending, running, self._estimate_job_cost):
+                # the status check fails if another processor has taken the job meanwhile
+                rows = self._execute('UPDATE jobs SET status = ?, started = ?, owner = ?, lease_expires = ? '
+                                     'WHERE job_id = ? AND status = ? RETURNING job_id, payload',
+                                     (JobStatus.running.value, datetime_now_to_filename(), owner, lease_expires,
+                                      job['job_id'], JobStatus.pending.value))
+                if len(rows) > 0:
+                    break
+        if len(rows) == 0:
+            return None, None, None
+        function, kwargs = dill.loads(rows[0]['payload'])
+        return rows[0]['job_id'], function, kwargs
+
+    def set_job_completed(self, job_id, status, owner=None):
+        self._execute('UPDATE jobs SET status = ?, completed = ?, cancel_requested = 0, owner = NULL, '
+                      'lease_expires = NULL WHERE job_id = ? AND (? IS NULL OR owner = ?)',
+                      (status.value, datetime_now_to_filename(), job_id, owner, owner))
+
+    def set_job_stats(self, job_id, stats):
+        self._execute('UPDATE jobs SET stats = ? WHERE job_id = ?', (json.dumps(stats), job_id))
+
+    def renew_job_leases(self, owner, job_ids):
+        job_ids = list(job_ids)
+        if len(job_ids) == 0:
+            return set()
+        rows = self._execute(f'UPDATE jobs SET lease_expires = ? WHERE owner = ? AND status = ? '
+                             f'AND job_id IN ({", ".join("?" * len(job_ids))}) RETURNING job_id',
+                             [time.time() + JOB_LEASE_DURATION, owner, JobStatus.running.value] + job_ids)
+        return {row['job_id'] for row in rows}
+
+    def requeue_expired_jobs(self, is_owner_alive=None):
+        now = time.time()
+        requeued = list()
+        for row in self._execute('SELECT job_id, started, owner, lease_expires FROM jobs WHERE status = ?',
+                                 (JobStatus.running.value,)):
+            expires = row['lease_expires']
+            if expires is None:
+                # claimed by a version without leases
+                try:
+                    expires = datetime_from_filename(row['started']).timestamp() + JOB_LEASE_DURATION
+                except (TypeError, ValueError):
+                    expires = 0
+            owner = row['owner']
+            if expires > now and (owner is None or is_owner_alive is None or is_owner_alive(owner)):
+                continue
+            # the conditions on the owner and on the lease fail if the lease has been renewed, or the job requeued,
+            # meanwhile
+            rows = self._execute('UPDATE jobs SET status = ?, started = NULL, owner = NULL, lease_expires = NULL '
+                                 'WHERE job_id = ? AND status = ? AND owner IS ? AND lease_expires IS ? '
+                                 'RETURNING job_id',
+                                 (JobStatus.pending.value, row['job_id'], JobStatus.running.value, owner,
+                                  row['lease_expires']))
+            requeued.extend(requeued_row['job_id'] for requeued_row in rows)
+        if len(requeued) > 0:
+            self._notify_job_listeners()
+        return requeued
+
+    def set_job_done(self, job_id):
+        self.set_job_completed(job_id, JobStatus.done)
+
+    def set_job_failed(self, job_id):
+        self.set_job_completed(job_id, JobStatus.error)
+
+    def cancel_job(self, job_id):
+        now = datetime_now_to_filename()
+        rows = self._execute('UPDATE jobs SET status = ?, started = ?, completed = ? WHERE job_id = ? AND status = ? '
+                             'RETURNING job_id', (JobStatus.cancelled.value, now, now, job_id, JobStatus.pending.value))
+        if len(rows) > 0:
+            return
+        rows = self._execute('UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status = ? RETURNING job_id',
+                             (job_id, JobStatus.running.value))
+        if len(rows) == 0:
+            raise ValueError(f'Job {job_id} is not pending or running')
+        self._notify_job_listeners()
+
+    def get_cancel_requests(self):
+        rows = self._execute('SELECT job_id FROM jobs WHERE cancel_requested = 1 AND status = ?',
+                             (JobStatus.running.value,))
+        return {row['job_id'] for row in rows}
+
+    def get_job_ids(self):
+        return [row['job_id'] for row in self._execute('SELECT job_id FROM jobs ORDER BY created, job_id')]
+
+    def _job_info_from_row(self, row):
+        return {'job_id': row['job_id'], 'function': row['function'], 'arguments': row['arguments'],
+                'dataset': row['dataset'], 'priority': row['priority'], 'username': row['username'],
+                'status': row['status'], 'created': row['created'],
+                'started': row['started'] or 'n/a', 'completed': row['completed'] or 'n/a',
+                'stats': json.loads(row['stats']) if row['stats'] is not None else None}
+
+    def get_job_info(self, job_id):
+        rows = self._execute(f'SELECT {JOB_INFO_COLUMNS} FROM jobs WHERE job_id = ?', (job_id,))
+        if len(rows) == 0:
+            raise KeyError(f'Unknown job {job_id}')
+        return self._job_info_from_row(rows[0])
+
+    def get_job_list(self, page, page_size):
+        rows = self._execute(f'SELECT {JOB_INFO_COLUMNS} FROM jobs ORDER BY created, job_id LIMIT ? OFFSET ?',
+                             (page_size, page * page_size))
+        return [self._job_info_from_row(row) for row in rows]
+
+    def get_job_count(self):
+        return self._execute('SELECT COUNT(*) FROM jobs')[0][0]
+
+    def get_job_status_counts(self):
+        counts = {status: 0 for status in JobStatus}
+        for row in self._execute('SELECT status, COUNT(*) AS count FROM jobs GROUP BY status'):
+            counts[JobStatus(row['status'])] = row['count']
+        return counts
+
+    def delete_job(self, job_id):
+        self._execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+        log_file = self._log_dir / f'{job_id}{LOG_EXTENSION}'
+        log_file.unlink(missing_ok=True)
+
+    def delete_jobs(self, status=None):
+        if status is None:
+            rows = self._execute('DELETE FROM jobs RETURNING job_id')
+        else:
+            rows = self._execute('DELETE FROM jobs WHERE status = ? RETURNING job_id', (status.value,))
+        for row in rows:
+            log_file = self._log_dir / f'{row["job_id"]}{LOG_EXTENSION}'
+            log_file.unlink(missing_ok=True)
+
+    def rerun_job(self, job_id):
+        log_file = self._log_dir / f'{job_id}{LOG_EXTENSION}'
+        log_file.unlink(missing_ok=True)
+        self._execute('UPDATE jobs SET status = ?, started = NULL, completed = NULL, cancel_requested = 0, '
+                      'owner = NULL, lease_expires = NULL, stats = NULL WHERE job_id = ?',
+                      (JobStatus.pending.value, job_id))
+        self._notify_job_listeners()
+
+
+def migrate_from_filedb(path):
+    with FileDB(path) as filedb, SQLiteDB(path) as sqlitedb:
+        for name in filedb.get_dataset_names():
+            info = filedb._catalog.get(name)
+            sqlitedb._catalog.set(name, **{field: value for field, value in info.items() if field != 'name'})
+
+        for quantifier_filename in filedb._quantifier_dir.glob('*' + QUANTIFIER_EXTENSION):
+            name = quantifier_filename.name[:-len(QUANTIFIER_EXTENSION)]
+            info = filedb._catalog.get(name)
+            sqlitedb._execute('INSERT OR IGNORE INTO quantifiers (name, created, description) VALUES (?, ?, ?)',
+                              (name, datetime_now_to_filename(), info['quantifier'] if info is not None else None))
+
+        migrated = 0
+        for job_filename in sorted(filedb._job_dir.iterdir()):
+            fields = job_filename.name.split('.')
+            status = fields[-1]
+            if status == JobStatus.creating.value:
+                continue
+            if status == JobStatus.running.value:
+                # the process running it is gone, it will be run again
+                status = JobStatus.pending.value
+                started = None
+            else:
+                started = fields[2] if len(fields) > 3 else None
+            completed = fields[3] if len(fields) > 4 else None
+            job_id = _job_id_from_filename(job_filename.name)
+            metadata = filedb._get_job_metadata(job_id, job_filename)
+            stats = filedb._get_job_stats(job_id)
+            sqlitedb._execute('INSERT OR IGNORE INTO jobs (job_id, status, created, started, completed, function, '
+                              'arguments, dataset, priority, username, stats, payload) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (job_id, status, fields[0], started, completed, metadata['function'],
+                               metadata['arguments'], metadata['dataset'], metadata.get('priority', 0),
+                               metadata.get('username'), json.dumps(stats) if stats is not None else None,
+                               job_filename.read_bytes()))
+            job_filename.unlink()
+            (filedb._job_info_dir / f'{job_id}{JOB_INFO_EXTENSION}').unlink(missing_ok=True)
+            (filedb._stats_dir / f'{job_id}{JOB_INFO_EXTENSION}').unlink(missing_ok=True)
+            migrated += 1
+        return migrated
@@ -0,0 +1,97 @@
+import logging
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+from configargparse import ArgParser
+
+from quapylab.benchmarks.data import DATASET_KINDS
+from quapylab.benchmarks.results import save_results, load_results, compare_results, REGRESSION_THRESHOLD
+from quapylab.benchmarks.suites import BENCHMARKS, BACKENDS, DEFAULT_CONFIG, run_benchmarks
+
+
+def report_comparison(metrics, baseline_metrics, threshold):
+    comparison = compare_results(metrics, baseline_metrics, threshold)
+    regressions = 0
+    for name, baseline_value, value, change, regression in comparison:
+        difference = (value - baseline_value) / baseline_value if baseline_value else 0.0
+        logging.info(f'{"REGRESSION " if regression else ""}{name}: {baseline_value:.6g} -> {value:.6g} '
+                     f'({difference:+.1%})')
+        regressions += regression
+    logging.info(f'{len(comparison)} metrics compared, {regressions} regressions over {threshold:.0%}')
+    return regressions
+
+
+def main():
+    logging.basicConfig(encoding='utf-8', stream=sys.stderr, level=logging.INFO, format='%(message)s')
+    parser = ArgParser(description='Measures datasets storage, the job queue, the web list endpoints and training '
+                                   'on synthetic data, saving the results as JSON and comparing them to a baseline')
+    parser.add_argument('--benchmarks', help='benchmarks to run', nargs='+', choices=list(BENCHMARKS),
+                        default=list(BENCHMARKS))
+    parser.add_argument('--backends', help='database backends to measure', nargs='+', choices=BACKENDS,
+                        default=DEFAULT_CONFIG['backends'])
+    parser.add_argument('--kinds', help='kinds of synthetic datasets', nargs='+', choices=DATASET_KINDS,
+                        default=DEFAULT_CONFIG['kinds'])
+    parser.add_argument('--rows', help='rows of the datasets written and read', type=int,
+                        default=DEFAULT_CONFIG['rows'])
+    parser.add_argument('--classes', help='classes of the datasets', type=int, default=DEFAULT_CONFIG['classes'])
+    parser.add_argument('--jobs', help='sizes of the job queue', nargs='+', type=int, default=DEFAULT_CONFIG['jobs'])
+    parser.add_argument('--job_info_samples', help='jobs whose info is read from each queue', type=int,
+                        default=DEFAULT_CONFIG['job_info_samples'])
+    parser.add_argument('--pops', help='jobs popped from each queue', type=int, default=DEFAULT_CONFIG['pops'])
+    parser.add_argument('--web_jobs', help='jobs listed by the web benchmark', type=int,
+                        default=DEFAULT_CONFIG['web_jobs'])
+    parser.add_argument('--web_datasets', help='datasets listed by the web benchmark', type=int,
+                        default=DEFAULT_CONFIG['web_datasets'])
+    parser.add_argument('--web_requests', help='requests to each web endpoint', type=int,
+                        default=DEFAULT_CONFIG['web_requests'])
+    parser.add_argument('--training_rows', help='rows of the datasets trained on', type=int,
+                        default=DEFAULT_CONFIG['training_rows'])
+    parser.add_argument('--n_jobs', help='parallel processes used by training', type=int,
+                        default=DEFAULT_CONFIG['n_jobs'])
+    parser.add_argument('--repeat', help='runs of each measure, the fastest is kept', type=int,
+                        default=DEFAULT_CONFIG['repeat'])
+    parser.add_argument('--work_dir', help='directory for the data of the benchmarks (default: a temporary one, '
+                                           'removed at the end)', type=str, default=None)
+    parser.add_argument('--output', help='path of the JSON file with the results', type=str,
+                        default='benchmark.json')
+    parser.add_argument('--baseline', help='JSON file with the results to compare to', type=str, default=None)
+    parser.add_argument('--threshold', help='relative change flagged as a regression', type=float,
+                        default=REGRESSION_THRESHOLD)
+    parser.add_argument('--compare', help='JSON file with results to compare to the baseline, without running '
+                                          'the benchmarks', type=str, default=None)
+    args = parser.parse_args(sys.argv[1:])
+
+    if args.compare is not None:
+        if args.baseline is None:
+            parser.error('--compare requires --baseline')
+        regressions = report_comparison(load_results(args.compare)['metrics'], load_results(args.baseline)['metrics'],
+                                        args.threshold)
+        return 1 if regressions > 0 else 0
+
+    config = {name: getattr(args, name) for name in DEFAULT_CONFIG}
+    if args.work_dir is not None:
+        work_dir = Path(args.work_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+    else:
+        work_dir = Path(tempfile.mkdtemp(prefix='quapylab_benchmark_'))
+    try:
+        metrics = run_benchmarks(args.benchmarks, config, work_dir)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    save_results(args.output, metrics, {**config, 'benchmarks': args.benchmarks})
+    for name, value in metrics.items():
+        logging.info(f'{name}: {value:.6g}')
+    logging.info(f'Saved {len(metrics)} metrics to {args.output}')
+
+    if args.baseline is not None:
+        regressions = report_comparison(metrics, load_results(args.baseline)['metrics'], args.threshold)
+        return 1 if regressions > 0 else 0
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
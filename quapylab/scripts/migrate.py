@@ -0,0 +1,24 @@
+import logging
+import sys
+
+from configargparse import ArgParser
+
+from quapylab.db.sqlitedb import migrate_from_filedb
+from quapylab.util import get_quapylab_home
+
+
+def main():
+    logging.basicConfig(encoding='utf-8', stream=sys.stderr, level=logging.INFO)
+    parser = ArgParser(description='Migrates the datasets, quantifiers and jobs of a FileDB data directory to the '
+                                   'SQLite backend, to be used with --db sqlite://<data_dir>')
+    parser.add_argument('--data_dir', help='path to the directory with QuaPyLab data', type=str,
+                        default=get_quapylab_home())
+    args = parser.parse_args(sys.argv[1:])
+
+    migrated = migrate_from_filedb(args.data_dir)
+    logging.info(f'Migrated {migrated} jobs from {args.data_dir}')
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,43 @@
+import logging
+import sys
+from pathlib import Path
+
+from configargparse import ArgParser
+
+from quapylab.db import open_db
+from quapylab.util import get_quapylab_home
+
+
+def main():
+    logging.basicConfig(encoding='utf-8', stream=sys.stderr, level=logging.INFO)
+    parser = ArgParser(description='Creates a job that applies the quantifier trained on a dataset to a CSV file, '
+                                   'which is read in chunks and can be larger than memory')
+    parser.add_argument('--data_dir', help='path to the directory with QuaPyLab data', type=str,
+                        default=get_quapylab_home())
+    parser.add_argument('--db', help='connection string of the QuaPyLab database (default: files in data_dir)',
+                        type=str, default=None)
+    parser.add_argument('--name', help='name of the dataset the quantifier has been trained on', type=str,
+                        required=True)
+    parser.add_argument('--output', help='path of the JSON file with the prevalences (default: in the reports)',
+                        type=str, default=None)
+    parser.add_argument('--priority', help='priority of the job, higher values run first', type=int, default=0)
+    parser.add_argument('--chunk_size', help='number of rows read at a time (default: 10000)', type=int, default=None)
+    parser.add_argument('input', help='path of the CSV file to quantify, it must be readable by the server', type=str)
+    args = parser.parse_args(sys.argv[1:])
+
+    db_connection_string = args.db if args.db is not None else str(args.data_dir)
+    output = str(Path(args.output).absolute()) if args.output is not None else None
+    with open_db(db_connection_string) as db:
+        if args.name not in db.get_quantifier_names():
+            logging.error(f'No quantifier for dataset {args.name}')
+            return 1
+        kwargs = {'name': args.name, 'path': str(Path(args.input).absolute()), 'output_path': output}
+        if args.chunk_size is not None:
+            kwargs['chunk_size'] = args.chunk_size
+        db.create_job('quantify_file', kwargs, args.priority)
+    logging.info(f'Created quantification job for {args.input}')
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
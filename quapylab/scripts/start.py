@@ -1,19 +1,21 @@
-import json
+import argparse
 import json
 import logging
 import os
+import subprocess
 import sys
 
 import cherrypy
-import quapy
 from cherrypy.process.plugins import SignalHandler
 from configargparse import ArgParser
 
-from quapylab.db.filedb import FileDB
+from quapylab.db import open_db
+from quapylab.db.scheduling import SCHEDULING_POLICIES, FAIR_POLICY
 from quapylab.services.background_processor import BackgroundProcessor, setup_background_processor_log
-from quapylab.util import get_quapylab_home
+from quapylab.util import get_quapylab_home, environ
 from quapylab.web import QuaPyLab
 from quapylab.web.auth import any_of, redirect, logged_in, enable_controller_service
+from quapylab.web.monitoring import enable_request_metrics
 
 
 def jsonify_error(status, message, traceback, version):
@@ -27,25 +29,114 @@ def jsonify_error(status, message, traceback, version):
     }})
 
 
+def setup_workers(svmperf_dir):
+    setup_background_processor_log()
+    # only the workers running the jobs import quapy
+    import quapy
+    quapy.environ['SVMPERF_HOME'] = svmperf_dir
+
+
+def profile_imports(top=20):
+    # imports the application in a fresh interpreter, timing each imported module
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import quapylab.scripts.start, quapylab.db.filedb, quapylab.db.sqlitedb'],
+                            stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        logging.error(result.stderr)
+        return result.returncode
+    timings = list()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative_time, module = line[len('import time:'):].split('|')
+        timings.append((int(cumulative_time), int(self_time), module.rstrip()))
+    total_time = sum(cumulative_time for cumulative_time, _, module in timings if not module.startswith('  '))
+    logging.info(f'Startup imports: {len(timings)} modules, {total_time / 1e6:.3f}s')
+    logging.info('Slowest imports (cumulative, self, module):')
+    for cumulative_time, self_time, module in sorted(timings, reverse=True)[:top]:
+        logging.info(f'{cumulative_time / 1e6:8.3f}s {self_time / 1e6:8.3f}s {module}')
+    return 0
+
+
 def main():
     logging.basicConfig(encoding='utf-8', stream=sys.stderr, level=logging.INFO)
     parser = ArgParser()
     parser.add_argument('--name', help='name of the application instance', type=str, default='QuaPyLab')
     parser.add_argument('--host', help='host server address', type=str, default='127.0.0.1')
     parser.add_argument('--port', help='host server port', type=int, default=8080)
+    parser.add_argument('--server_threads', help='number of threads serving requests, each open job log holds one',
+                        type=int, default=30)
     parser.add_argument('--main_app_path', help='server path of the web client app', type=str, default='/')
     parser.add_argument('--data_dir', help='path to the directory with QuaPyLab data', type=str,
                         default=get_quapylab_home())
+    parser.add_argument('--db', help='connection string of the QuaPyLab database, e.g., sqlite:///path/to/dir '
+                                     '(default: files in data_dir)', type=str, default=None)
+    parser.add_argument('--max_upload_size', help='maximum size of an uploaded dataset file, in MB (0 = no limit)',
+                        type=int, default=0)
+    parser.add_argument('--feature_cache_size', help='maximum disk space used to cache feature matrices, in MB',
+                        type=int, default=environ['FEATURE_CACHE_SIZE'] // (1024 * 1024))
+    parser.add_argument('--streaming_text_rows', help='number of rows from which text datasets are vectorized out of '
+                                                      'core, by hashing, in chunks (0 = never)',
+                        type=int, default=environ['STREAMING_TEXT_ROWS'])
+    parser.add_argument('--streaming_idf', help='weight the features of text vectorized out of core by idf, computed '
+                                                'in a first pass over the text',
+                        action=argparse.BooleanOptionalAction, default=environ['STREAMING_IDF'])
+    parser.add_argument('--quantifier_cache_size', help='number of quantifiers kept loaded to serve quantify requests',
+                        type=int, default=8)
+    parser.add_argument('--parameter_grids', help='JSON file mapping method names to the grids of hyperparameters '
+                                                  'searched when tuning is requested (default: the built-in ones)',
+                        type=str, default=None)
     parser.add_argument('--svmperf_dir', help='path to SVMPerf executable', type=str, default=get_quapylab_home())
+    parser.add_argument('--preload_workers', help='import the job libraries once, before starting the workers',
+                        action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument('--worker_max_jobs', help='number of jobs after which a worker is replaced (0 = never)',
+                        type=int, default=0)
+    parser.add_argument('--worker_max_rss', help='memory in MB over which a worker is replaced after a job '
+                                                 '(0 = no limit)', type=int, default=0)
+    parser.add_argument('--workers', help='number of jobs run together (0 = half of the processors)', type=int,
+                        default=0)
+    parser.add_argument('--job_processes', help='number of processes a training job fits and evaluates methods with '
+                                                '(0 = the processors divided by the workers)', type=int, default=0)
+    parser.add_argument('--job_timeout', help='seconds after which a running job is stopped (0 = no limit)',
+                        type=int, default=0)
+    parser.add_argument('--job_max_memory', help='memory in MB each process of a job can allocate, jobs going over it '
+                                                 'are stopped (0 = no limit)', type=int, default=0)
+    parser.add_argument('--scheduling_policy', help='order in which pending jobs are run', type=str,
+                        choices=SCHEDULING_POLICIES, default=FAIR_POLICY)
+    parser.add_argument('--profile-imports', help='report the time spent importing modules at startup and exit',
+                        action='store_true')
     args = parser.parse_args(sys.argv[1:])
 
-    quapy.environ['SVMPERF_HOME'] = args.svmperf_dir
-
-    with FileDB(args.data_dir) as db, \
-            QuaPyLab(args.name, db) as main_app, \
-            BackgroundProcessor(args.data_dir, os.cpu_count() // 2, initializer=setup_background_processor_log) as bp:
+    if args.profile_imports:
+        return profile_imports()
+
+    environ['FEATURE_CACHE_SIZE'] = args.feature_cache_size * 1024 * 1024
+    environ['STREAMING_TEXT_ROWS'] = args.streaming_text_rows
+    environ['STREAMING_IDF'] = args.streaming_idf
+    # by default the jobs running together share the processors, each one trains its methods on its share of them
+    pool_size = args.workers or max(1, os.cpu_count() // 2)
+    environ['N_JOBS'] = args.job_processes or max(1, os.cpu_count() // pool_size)
+    if args.parameter_grids is not None:
+        with open(args.parameter_grids, mode='rt', encoding='utf-8') as inputfile:
+            environ['PARAMETER_GRIDS'] = json.load(inputfile)
+
+    db_connection_string = args.db if args.db is not None else str(args.data_dir)
+    max_dataset_size = args.max_upload_size * 1024 * 1024 if args.max_upload_size > 0 else None
+
+    with open_db(db_connection_string, max_dataset_size=max_dataset_size) as db, \
+            QuaPyLab(args.name, db, args.quantifier_cache_size) as main_app, \
+            BackgroundProcessor(db_connection_string, pool_size, initializer=setup_workers,
+                                initargs=[str(args.svmperf_dir)], preload=args.preload_workers,
+                                max_tasks_per_worker=args.worker_max_jobs or None,
+                                max_worker_rss=args.worker_max_rss * 1024 * 1024 or None,
+                                scheduling_policy=args.scheduling_policy, job_timeout=args.job_timeout or None,
+                                max_job_memory=args.job_max_memory * 1024 * 1024 or None) as bp:
         cherrypy.server.socket_host = args.host
         cherrypy.server.socket_port = args.port
+        cherrypy.server.thread_pool = args.server_threads
+        if max_dataset_size is not None:
+            # oversized uploads are rejected while the request body is being read
+            cherrypy.server.max_request_body_size = max_dataset_size + 1024 * 1024
 
         conf_main_app = {
             '/': {
@@ -53,6 +144,8 @@ def main():
                 'tools.sessions.on': True,
                 'tools.auth.on': True,
                 'tools.auth.require': [any_of(logged_in(), redirect(args.main_app_path + 'login'))],
+                'tools.request_metrics.on': True,
+                'tools.request_metrics.histogram': main_app.request_latency,
             },
             '/login': {
                 'error_page.default': jsonify_error,
@@ -69,7 +162,10 @@ def main():
         signal_handler.subscribe()
 
         enable_controller_service()
+        enable_request_metrics()
 
+        db.add_job_listener(bp.wake)
+        main_app.add_metrics_collector(bp.collect_metrics)
         bp.start()
         cherrypy.engine.subscribe('stop', bp.stop)
 
@@ -1,22 +1,52 @@
 import datetime
+import importlib
 import logging
 import multiprocessing
+import os
+import queue
+import resource
 import signal
+import socket
+import sys
+import threading
+import time
 import traceback
 from contextlib import redirect_stderr, redirect_stdout
 from functools import partial
-from multiprocessing import BoundedSemaphore, Process
+from multiprocessing import BoundedSemaphore, Process, Queue, Value
 from multiprocessing.pool import Pool
-from time import sleep
 
 import cherrypy
+import shortuuid
 
 __author__ = 'Andrea Esuli'
 
-from quapylab.db.filedb import FileDB
-from quapylab.db.quapydb import QuaPyDB
+from quapylab.db import open_db
+from quapylab.db.quapydb import QuaPyDB, JobStatus, JOB_LEASE_DURATION, COMPLETED_JOB_STATUSES
+from quapylab.db.scheduling import Scheduler, FAIR_POLICY
+from quapylab.util import datetime_from_filename
+from quapylab.util.metrics import Counter, Gauge, Histogram
+from quapylab.util.resources import current_rss, start_job_accounting, stop_job_accounting
 
-LOOP_WAIT = 1  # second
+# jobs created by this application wake up the processor, polling only catches the ones created by other processes
+POLL_WAIT = 30  # seconds
+# running jobs are checked for cancellation requests, timeouts and dead workers at this interval
+MONITOR_INTERVAL = 1  # seconds
+# the result of a job may still be on its way when its worker is found to have exited
+DEAD_WORKER_GRACE = 5  # seconds
+# leases on running jobs are renewed, and expired leases of other processors are looked for, at this interval
+LEASE_RENEW_INTERVAL = JOB_LEASE_DURATION / 4
+
+# jobs reference their function by name, the module defining it, which imports the machine learning libraries, is
+# imported only by the workers that run it
+JOB_FUNCTION_MODULES = {
+    'train_quantifier': 'quapylab.services.experiments',
+    'render_report': 'quapylab.services.experiments',
+    'quantify_file': 'quapylab.services.experiments',
+}
+
+
+JOB_TIME_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400)  # seconds
 
 
 def setup_background_processor_log(**kwargs):
@@ -25,16 +55,98 @@ def setup_background_processor_log(**kwargs):
 
 
 class JobError:
-    def __init__(self, name, exception, tb):
+    def __init__(self, name, exception, tb, status=JobStatus.error):
         self.name = name
         self.e = str(exception)
         self.tb = tb
+        self.status = status
 
     def __str__(self):
         return f'{self.__class__.__name__}(\'{self.name}\', \'{self.e}\')\n{self.tb}'
 
 
 process_db: QuaPyDB = None
+# workers report on this queue the jobs they start, so that the processor can stop them
+process_started_queue = None
+process_max_job_memory = None
+process_metrics = None
+
+
+class ProcessorMetrics:
+    # updated by the processor and by its workers, and exported by the application, values are in shared memory
+    def __init__(self):
+        self.job_wait = Histogram('quapylab_job_wait_seconds', 'Time from the creation of a job to its start',
+                                  JOB_TIME_BUCKETS, shared_keys=[()])
+        self.job_run = Histogram('quapylab_job_run_seconds', 'Running time of the jobs, by final status',
+                                 JOB_TIME_BUCKETS, ['status'],
+                                 shared_keys=[(status.value,) for status in COMPLETED_JOB_STATUSES])
+        self.feature_cache = Counter('quapylab_feature_cache_requests_total',
+                                     'Feature matrices requested to the feature cache, by result', ['result'],
+                                     shared_keys=[('hit',), ('miss',)])
+
+
+def count_feature_cache_request(hit):
+    # counted only for the jobs run by a processor
+    if process_metrics is not None:
+        process_metrics.feature_cache.inc(result='hit' if hit else 'miss')
+
+
+class NonDaemonProcess(Process):
+    # pool workers are daemonic by default, which prevents jobs from running their own process pools
+    @property
+    def daemon(self):
+        return False
+
+    @daemon.setter
+    def daemon(self, value):
+        pass
+
+
+class RecyclingQueue:
+    # worker side view of the task queue of a pool, it returns the stop sentinel in place of the next task once
+    # the worker has run max_tasks tasks or its memory has grown over max_rss, the pool then replaces the worker
+    def __init__(self, queue, max_tasks, max_rss, recycled):
+        self._queue = queue
+        self._max_tasks = max_tasks
+        self._max_rss = max_rss
+        self._recycled = recycled
+        self._tasks = 0
+
+    def __getattr__(self, name):
+        return getattr(self._queue, name)
+
+    def get(self):
+        if self._tasks > 0:
+            rss = current_rss()
+            if (self._max_tasks is not None and self._tasks >= self._max_tasks) or \
+                    (self._max_rss is not None and rss > self._max_rss):
+                with self._recycled.get_lock():
+                    self._recycled.value += 1
+                    recycled = self._recycled.value
+                cherrypy.log(f'BackgroundProcessor: recycling {multiprocessing.current_process().name} after '
+                             f'{self._tasks} jobs, RSS {rss / 1024 ** 2:.0f} MB ({recycled} workers recycled)',
+                             severity=logging.INFO)
+                return None
+        task = self._queue.get()
+        if task is not None:
+            self._tasks += 1
+        return task
+
+
+def recycling_worker(target, max_tasks, max_rss, recycled, inqueue, *args, **kwargs):
+    return target(RecyclingQueue(inqueue, max_tasks, max_rss, recycled), *args, **kwargs)
+
+
+class JobPool(Pool):
+    def __init__(self, *args, max_tasks_per_worker=None, max_worker_rss=None, recycled=None, **kwargs):
+        # set before the pool starts its workers
+        self._recycling = (max_tasks_per_worker, max_worker_rss, recycled if recycled is not None else Value('i', 0))
+        super().__init__(*args, **kwargs)
+
+    def Process(self, ctx, *args, **kwds):
+        if self._recycling[0] is not None or self._recycling[1] is not None:
+            kwds['target'] = partial(recycling_worker, kwds['target'], *self._recycling)
+        return NonDaemonProcess(*args, **kwds)
 
 
 def job_function(f):
@@ -43,81 +155,336 @@ def job_function(f):
     for arg_name in must_have:
         if arg_name not in covars:
             raise AttributeError(f'Function must have a {arg_name} argument')
+    if JOB_FUNCTION_MODULES.get(f.__name__) != f.__module__:
+        raise AttributeError(f'Function {f.__name__} must be registered in JOB_FUNCTION_MODULES')
     return f
 
 
+def get_job_function(function):
+    if callable(function):
+        # job created when functions were stored instead of their names
+        return function
+    if function not in JOB_FUNCTION_MODULES:
+        raise ValueError(f'Unknown job function {function}')
+    return getattr(importlib.import_module(JOB_FUNCTION_MODULES[function]), function)
+
+
+def preload_job_functions():
+    # loaded once by the processor, so that the pool workers forked from it start with them already imported
+    import matplotlib
+    matplotlib.use('Agg')
+    for module in sorted(set(JOB_FUNCTION_MODULES.values())):
+        importlib.import_module(module)
+
+
 def job_launcher(job_id, f, **kwargs):
     global process_db
+    process_started_queue.put((job_id, os.getpid()))
     log_stream = process_db.get_job_log_stream(job_id)
+    memory_limits = resource.getrlimit(resource.RLIMIT_AS)
     with redirect_stderr(log_stream), redirect_stdout(log_stream):
         print(f'Start of job: {job_id} ({datetime.datetime.now().isoformat()})')
+        start_job_accounting()
         try:
+                if process_max_job_memory is not None:
+                    # allocations over the limit raise MemoryError; the limit is per process, each of the processes
+                    # started by the job inherits it
+                    resource.setrlimit(resource.RLIMIT_AS, (process_max_job_memory, memory_limits[1]))
                 kwargs['job_id'] = job_id
                 kwargs['db'] = process_db
-                f(**kwargs)
+                get_job_function(f)(**kwargs)
+        except MemoryError as e:
+            log_stream.write(f'Out of memory in job: {job_id}\n{traceback.format_exc()}')
+            return JobError(job_id, e, traceback.format_exc(), JobStatus.out_of_memory)
         except Exception as e:
             log_stream.write(f'Error in job: {job_id}\n{e}\n{traceback.format_exc()}')
             return JobError(job_id, e, traceback.format_exc())
         finally:
+            shutdown_job_workers()
+            if process_max_job_memory is not None:
+                resource.setrlimit(resource.RLIMIT_AS, memory_limits)
+            stats = stop_job_accounting()
+            peak_rss = f'{stats["peak_rss"] / 1024 ** 2:.0f} MB' if stats['peak_rss'] is not None else 'n/a'
+            print(f'Wall time {stats["wall_time"]:.1f}s, CPU time {stats["cpu_time"]:.1f}s, peak RSS {peak_rss}')
+            try:
+                process_db.set_job_stats(job_id, stats)
+            except Exception:
+                log_stream.write(f'Cannot save the stats of job: {job_id}\n{traceback.format_exc()}')
             print(f'End of job: {job_id} ({datetime.datetime.now().isoformat()})')
             log_stream.flush()
             log_stream.close()
 
-def bp_pool_initializer(db_connection_string, initializer, *initargs):
+def shutdown_job_workers():
+    # joblib keeps its workers for reuse, they would outlive the job, together with the memory limit they inherited
+    if 'joblib' in sys.modules:
+        from joblib.externals.loky import get_reusable_executor
+        get_reusable_executor().shutdown(wait=True)
+
+
+def bp_pool_initializer(db_connection_string, started_queue, max_job_memory, metrics, initializer, *initargs):
     cherrypy.log(f'BackgroundProcessor: adding {multiprocessing.current_process().name} to pool', severity=logging.INFO)
-    global process_db
-    process_db = FileDB(db_connection_string)
+    global process_db, process_started_queue, process_max_job_memory, process_metrics
+    process_db = open_db(db_connection_string)
+    process_started_queue = started_queue
+    process_max_job_memory = max_job_memory
+    process_metrics = metrics
+    # the worker leads its own process group, so that it can be killed together with the processes started by a job
+    os.setpgrp()
     signal.signal(signal.SIGINT, signal.SIG_IGN)
     if initializer is not None:
         initializer(*initargs)
 
 
+def discard_task(pool, result):
+    # the result of a task whose worker has been killed never arrives, the pool would wait for it forever on join;
+    # Pool has no public way to forget a task, its private _cache of pending results is used, where it exists
+    cache = getattr(pool, '_cache', None)
+    if cache is not None:
+        cache.pop(result._job, None)
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def processor_identity():
+    # processors sharing a data directory are told apart by host and process, and by a random part, since process
+    # ids are reused
+    return f'{socket.gethostname()}:{os.getpid()}:{shortuuid.uuid()}'
+
+
+def is_processor_alive(identity):
+    host, pid, _ = identity.rsplit(':', 2)
+    if host != socket.gethostname():
+        # processors on other hosts are known to be dead only when their leases expire
+        return True
+    try:
+        return _process_exists(int(pid))
+    except ValueError:
+        return True
+
+
+class RunningJob:
+    def __init__(self):
+        self.result = None
+        self.pid = None
+        self.claimed = time.monotonic()
+        self.started = None
+        self.exited = None
+
+
 class BackgroundProcessor(Process):
-    def __init__(self, db_connection_string, pool_size, initializer=None, initargs=None):
+    def __init__(self, db_connection_string, pool_size, initializer=None, initargs=None, preload=True,
+                 max_tasks_per_worker=None, max_worker_rss=None, scheduling_policy=FAIR_POLICY, job_timeout=None,
+                 max_job_memory=None):
         Process.__init__(self)
         self._stop_event = multiprocessing.Event()
+        self._wake_event = multiprocessing.Event()
         self._pool_size = pool_size
         self._db_connection_string = db_connection_string
-        self._initializer = partial(bp_pool_initializer, db_connection_string, initializer)
+        self._started_queue = Queue()
+        self._metrics = ProcessorMetrics()
+        self._initializer = partial(bp_pool_initializer, db_connection_string, self._started_queue, max_job_memory,
+                                    self._metrics, initializer)
         if initargs is None:
             initargs = []
         self._initargs = initargs
         self._running = False
         self._semaphore = BoundedSemaphore(self._pool_size)
+        self._preload = preload
+        self._max_tasks_per_worker = max_tasks_per_worker
+        self._max_worker_rss = max_worker_rss
+        self._recycled = Value('i', 0)
+        self._scheduler = Scheduler(scheduling_policy)
+        self._job_timeout = job_timeout
+        self._jobs = dict()
+        self._jobs_lock = threading.Lock()
+        self._owner = None
+        self._lease_time = 0
 
     def run(self):
-        with FileDB(self._db_connection_string) as db, \
-                Pool(processes=self._pool_size, initializer=self._initializer, initargs=self._initargs) as pool:
-            cherrypy.log('BackgroundProcessor: started', severity=logging.INFO)
+        if self._preload:
+            start = time.perf_counter()
+            preload_job_functions()
+            cherrypy.log(f'BackgroundProcessor: preloaded job functions in {time.perf_counter() - start:.1f}s',
+                         severity=logging.INFO)
+        with open_db(self._db_connection_string) as db, \
+                JobPool(processes=self._pool_size, initializer=self._initializer, initargs=self._initargs,
+                        max_tasks_per_worker=self._max_tasks_per_worker, max_worker_rss=self._max_worker_rss,
+                        recycled=self._recycled) as pool:
+            self._owner = processor_identity()
+            self._requeue_expired_jobs(db)
+            self._lease_time = time.monotonic()
+            cherrypy.log(f'BackgroundProcessor: started as {self._owner}', severity=logging.INFO)
+            poll_time = 0
             while not self._stop_event.is_set():
-                try:
-                    job_id, function, kwargs = db.pop_pending_job()
-                except Exception as e:
-                    cherrypy.log(
-                        f'Error fetching next job \nException: {e}',
-                        severity=logging.ERROR)
-                    job_id = None
-                if job_id is None:
-                    try:
-                        sleep(LOOP_WAIT)
-                    finally:
+                self._check_jobs(db, pool)
+                if self._wake_event.is_set():
+                    self._wake_event.clear()
+                    poll_time = 0
+                if time.monotonic() >= poll_time:
+                    # the timeout lets running jobs be checked while all the slots are taken
+                    if not self._semaphore.acquire(timeout=MONITOR_INTERVAL):
+                        continue
+                    if self._start_next_job(db, pool):
                         continue
-                self._semaphore.acquire()
-                try:
-                    cherrypy.log(f'Starting {job_id}: {function} ({kwargs})', severity=logging.INFO)
-                    pool.apply_async(partial(job_launcher, job_id, function), kwds=kwargs,
-                                     callback=partial(self._release, db, job_id, True),
-                                     error_callback=partial(self._release, db, job_id, False))
-                except Exception as e:
                     self._semaphore.release()
-                    cherrypy.log(f'Error on job {job_id}:\nException: ' + str(e),
-                                 severity=logging.ERROR)
+                    poll_time = time.monotonic() + POLL_WAIT
+                self._wake_event.wait(MONITOR_INTERVAL)
             pool.close()
+            # the jobs still running are monitored, and their leases renewed, until they complete
+            while len(self._jobs) > 0:
+                self._check_jobs(db, pool)
+                time.sleep(MONITOR_INTERVAL)
             pool.join()
-            cherrypy.log('BackgroundProcessor: stopped', severity=logging.INFO)
+            cherrypy.log(f'BackgroundProcessor: stopped, {self._recycled.value} workers recycled',
+                         severity=logging.INFO)
+
+    def _start_next_job(self, db, pool):
+        try:
+            job_id, function, kwargs = db.pop_pending_job(self._scheduler, self._owner)
+        except Exception as e:
+            cherrypy.log(
+                f'Error fetching next job \nException: {e}',
+                severity=logging.ERROR)
+            return False
+        if job_id is None:
+            return False
+        job = RunningJob()
+        try:
+            created = datetime_from_filename(db.get_job_info(job_id)['created']).timestamp()
+            self._metrics.job_wait.observe(max(0.0, time.time() - created))
+        except Exception:
+            # the job is run anyway, it is just not measured
+            pass
+        with self._jobs_lock:
+            self._jobs[job_id] = job
+        try:
+            cherrypy.log(f'Starting {job_id}: {function} ({kwargs})', severity=logging.INFO)
+            job.result = pool.apply_async(partial(job_launcher, job_id, function), kwds=kwargs,
+                                          callback=partial(self._release, db, job_id, True),
+                                          error_callback=partial(self._release, db, job_id, False))
+        except Exception as e:
+            with self._jobs_lock:
+                self._jobs.pop(job_id, None)
+            self._semaphore.release()
+            cherrypy.log(f'Error on job {job_id}:\nException: ' + str(e),
+                         severity=logging.ERROR)
+        return True
+
+    def _requeue_expired_jobs(self, db):
+        try:
+            requeued = db.requeue_expired_jobs(is_processor_alive)
+        except Exception as e:
+            cherrypy.log(f'Error requeuing expired jobs \nException: {e}', severity=logging.ERROR)
+            return
+        for job_id in requeued:
+            cherrypy.log(f'Requeued {job_id}, its lease has expired', severity=logging.WARNING)
+
+    def _renew_leases(self, db, pool):
+        with self._jobs_lock:
+            job_ids = set(self._jobs)
+        try:
+            renewed = db.renew_job_leases(self._owner, job_ids)
+        except Exception as e:
+            cherrypy.log(f'Error renewing job leases \nException: {e}', severity=logging.ERROR)
+            return
+        for job_id in job_ids - renewed:
+            # requeued by another processor, which considered this one dead, the job is going to run again
+            cherrypy.log(f'Lost the lease on {job_id}', severity=logging.WARNING)
+            self._terminate(db, pool, job_id, None)
+
+    def _check_jobs(self, db, pool):
+        if time.monotonic() - self._lease_time > LEASE_RENEW_INTERVAL:
+            self._lease_time = time.monotonic()
+            self._renew_leases(db, pool)
+            self._requeue_expired_jobs(db)
+        while True:
+            try:
+                job_id, pid = self._started_queue.get_nowait()
+            except queue.Empty:
+                break
+            with self._jobs_lock:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job.pid = pid
+                    job.started = time.monotonic()
+        with self._jobs_lock:
+            started_jobs = [(job_id, job) for job_id, job in self._jobs.items() if job.pid is not None]
+        if len(started_jobs) == 0:
+            return
+        try:
+            cancel_requests = db.get_cancel_requests()
+        except Exception as e:
+            cherrypy.log(f'Error fetching cancel requests \nException: {e}', severity=logging.ERROR)
+            cancel_requests = set()
+        now = time.monotonic()
+        for job_id, job in started_jobs:
+            if job_id in cancel_requests:
+                self._terminate(db, pool, job_id, JobStatus.cancelled)
+            elif self._job_timeout is not None and now - job.started > self._job_timeout:
+                self._terminate(db, pool, job_id, JobStatus.timeout)
+            elif not _process_exists(job.pid):
+                # killed by something else, e.g., the kernel out of memory killer
+                if job.exited is None:
+                    job.exited = now
+                elif now - job.exited > DEAD_WORKER_GRACE:
+                    self._terminate(db, pool, job_id, JobStatus.error, kill=False)
+
+    def _terminate(self, db, pool, job_id, status, kill=True):
+        with self._jobs_lock:
+            job = self._jobs.pop(job_id, None)
+        if job is None:
+            # completed meanwhile
+            return
+        try:
+            if kill and job.pid is not None:
+                try:
+                    os.killpg(job.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            discard_task(pool, job.result)
+            if status is not None:
+                cherrypy.log(f'Stopped {job_id}: {status.value}', severity=logging.WARNING)
+                self._observe_run_time(job, status)
+                db.set_job_completed(job_id, status, self._owner)
+        except Exception as e:
+            cherrypy.log(f'Error stopping job {job_id}:\nException: {e}', severity=logging.ERROR)
+        finally:
+            self._semaphore.release()
+
+    def _observe_run_time(self, job, status):
+        # a short job can complete before its start is reported
+        started = job.started if job.started is not None else job.claimed
+        self._metrics.job_run.observe(time.monotonic() - started, status=status.value)
+
+    def wake(self):
+        self._wake_event.set()
+
+    def collect_metrics(self):
+        # read by the application process, the semaphore and the counters are shared with the processor
+        slots = Gauge('quapylab_pool_slots', 'Slots of the pool of workers running jobs, by state', ['state'])
+        try:
+            free = self._semaphore.get_value()
+        except NotImplementedError:
+            # not available on macOS
+            free = None
+        if free is not None:
+            # a slot is also taken for a moment while the processor looks for the next job to start
+            slots.set(self._pool_size - free, state='busy')
+            slots.set(free, state='free')
+        recycled = Counter('quapylab_workers_recycled_total', 'Pool workers replaced after too many jobs or too '
+                                                              'much memory')
+        recycled.inc(self._recycled.value)
+        return [slots, recycled, self._metrics.job_wait, self._metrics.job_run, self._metrics.feature_cache]
 
     def stop(self):
         self._stop_event.set()
+        self._wake_event.set()
         cherrypy.log('BackgroundProcessor: stopping')
         self.join()
 
@@ -129,13 +496,23 @@ class BackgroundProcessor(Process):
         return False
 
     def _release(self, db, job_id, success, return_value=None):
+        with self._jobs_lock:
+            job = self._jobs.pop(job_id, None)
+        if job is None:
+            # stopped by the processor, which has already released its slot
+            return
         try:
-            if not success or isinstance(return_value, JobError):
+            if isinstance(return_value, JobError):
+                cherrypy.log(str(return_value), severity=logging.ERROR)
+                status = return_value.status
+            elif not success:
                 cherrypy.log(str(return_value), severity=logging.ERROR)
-                db.set_job_failed(job_id)
+                status = JobStatus.error
             else:
                 cherrypy.log(f'Completed {job_id}', severity=logging.INFO)
-                db.set_job_done(job_id)
+                status = JobStatus.done
+            self._observe_run_time(job, status)
+            db.set_job_completed(job_id, status, self._owner)
             if hasattr(return_value, 're_raise'):
                 return_value.re_raise()
         finally:
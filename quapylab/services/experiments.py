@@ -1,18 +1,23 @@
-import os
+import json
+import time
 
+import numpy as np
+import pandas as pd
 import quapy as qp
-from quapy.classification.calibration import VSCalibration
 from quapy.data import LabelledCollection
-from quapy.method.aggregative import EMQ, PACC, CC, ACC, PCC, HDy
-from quapy.method.meta import Ensemble
-from quapy.protocol import APP
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegressionCV
 from sklearn.preprocessing import LabelEncoder
-from sklearn.svm import LinearSVC
 
 from quapylab.db.quapydb import QuaPyDB, get_label_column_name, get_text_column_name, get_data_column_names
-from quapylab.services.background_processor import job_function
+from quapylab.services.background_processor import job_function, count_feature_cache_request
+from quapylab.services.feature_cache import FeatureCache
+from quapylab.services.reports import save_results, load_results, report_path, PLOT_SUFFIXES
+from quapylab.services.quantification import TrainedQuantifier, ChunkedQuantification
+from quapylab.services.plans import DEFAULT_PLAN
+from quapylab.services.training import PARAMETER_GRIDS, plan_methods, train_methods
+from quapylab.services.vectorization import StreamingTfidfVectorizer
+from quapylab.util import environ
+from quapylab.util.resources import phase
 
 try:
     from quapy.classification.neural import LSTMnet, CNNnet
@@ -20,95 +25,197 @@ except ModuleNotFoundError:
     LSTMnet = "Torch is not installed"
     CNNnet = "Torch is not installed"
 
-# TODO is it corrects to have these here?
-qp.environ["SAMPLE_SIZE"] = 100
-qp.environ["N_JOBS"] = os.cpu_count()//2
+QUANTIFY_CHUNK_SIZE = 10000  # rows
+VECTORIZE_CHUNK_SIZE = 10000  # rows
 
 
-@job_function
-def train_quantifier(db: QuaPyDB, job_id, name, overwrite=False, verbose=True):
-    df = db.get_dataset(name)
-
-    label_column_name = get_label_column_name(df)
-
-    y = df[label_column_name].to_list()
-
-    # TODO I need to encode labels due to
-    #  RecalibratedProbabilisticClassifierBase.fit_cv, calibration.py, line 79
-    #  Should it be changed to work with string labels?
-    y = LabelEncoder().fit_transform(y)
-    # TODO currently not saving the label encoder. I'm waiting to see if it is required or not.
-
-    text_column_name = get_text_column_name(df)
-
-    if text_column_name is not None:
-        X = df[text_column_name]
+def vectorize_out_of_core(db, name, text_column_name, vectorizer, feature_cache, cache_key):
+    # the text is read in chunks, once to learn the idf and once to write the matrix to the feature cache, from which
+    # it is memory-mapped, so that only a chunk of text and of its features is in memory at any time
+    def documents():
+        for chunk in db.get_dataset_chunks(name, [text_column_name], VECTORIZE_CHUNK_SIZE):
+            yield chunk[text_column_name]
 
-        vectorizer = TfidfVectorizer()
-        X = vectorizer.fit_transform(X)
-    else:
-        data_column_names = get_data_column_names(df)
-        X = df[data_column_names].to_numpy()
+    if vectorizer.use_idf:
+        for chunk in documents():
+            vectorizer.partial_fit(chunk)
+    feature_cache.put_chunks(cache_key, vectorizer, (vectorizer.transform(chunk) for chunk in documents()),
+                             vectorizer.n_features)
+    return feature_cache.get(cache_key)
 
-    all_data = LabelledCollection(X, y)
-
-    train, test = all_data.split_stratified(train_prop=0.75)
-
-    def models():
-        yield 'CC_SVM', CC(LinearSVC())
-        yield 'ACC_SVM', ACC(LinearSVC())
-        yield 'PCC_SVM', PCC(LinearSVC())
-        yield 'PACC_SVM', PACC(LinearSVC())
-        yield 'EMQ_SVM', EMQ(LinearSVC())
-        yield 'EMQ_LR', EMQ(VSCalibration(LogisticRegressionCV()))
-        yield 'HDy_LR', HDy(VSCalibration(LogisticRegressionCV()))
-        yield 'CC_LR', CC(VSCalibration(LogisticRegressionCV()))
-        yield 'Ensemble_PACC_LR', Ensemble(PACC(LogisticRegressionCV()), size=30, policy='ave')
-
-    quantifiers, method_names, true_prevs, estim_prevs, tr_prevs = [], [], [], [], []
-
-    for method_name, model in models():
-        model.fit(train)
-        quantifiers.append(model)
-        true_prev, estim_prev = qp.evaluation.prediction(model, APP(test, repeats=100, random_state=0))
 
+@job_function
+def train_quantifier(db: QuaPyDB, job_id, name, overwrite=False, verbose=True, n_jobs=None, model_selection=False,
+                     param_grids=None, plan=DEFAULT_PLAN, budget=None):
+    # plan is the name of a training plan or a list of method names, budget the seconds available to train methods
+    methods = plan_methods(plan)
+
+    with phase('load dataset'):
+        column_names = db.get_dataset_column_names(name)
+
+        label_column_name = get_label_column_name(column_names)
+        text_column_name = get_text_column_name(column_names)
+
+        if text_column_name is not None:
+            data_column_names = None
+            df = db.get_dataset(name, [label_column_name])
+        else:
+            data_column_names = get_data_column_names(column_names)
+            df = db.get_dataset(name, [label_column_name] + data_column_names)
+
+        y = df[label_column_name].to_list()
+
+        # TODO I need to encode labels due to
+        #  RecalibratedProbabilisticClassifierBase.fit_cv, calibration.py, line 79
+        #  Should it be changed to work with string labels?
+        label_encoder = LabelEncoder()
+        y = label_encoder.fit_transform(y)
+
+    with phase('vectorize'):
+        if text_column_name is not None:
+            streaming_rows = environ['STREAMING_TEXT_ROWS']
+            if streaming_rows and db.get_dataset_row_count(name) >= streaming_rows:
+                vectorizer = StreamingTfidfVectorizer(use_idf=environ['STREAMING_IDF'])
+            else:
+                vectorizer = TfidfVectorizer()
+            feature_cache = FeatureCache(db.get_cache_dir(), environ['FEATURE_CACHE_SIZE'])
+            cache_key = feature_cache.key(db.get_dataset_hash(name, [text_column_name]), vectorizer)
+            cached = feature_cache.get(cache_key)
+            count_feature_cache_request(cached is not None)
+            if cached is None and isinstance(vectorizer, StreamingTfidfVectorizer):
+                print(f'Vectorizing {text_column_name} in chunks of {VECTORIZE_CHUNK_SIZE} rows')
+                vectorizer, X = vectorize_out_of_core(db, name, text_column_name, vectorizer, feature_cache, cache_key)
+            elif cached is None:
+                X = db.get_dataset(name, [text_column_name])[text_column_name]
+                X = vectorizer.fit_transform(X)
+                feature_cache.put(cache_key, vectorizer, X)
+            else:
+                print(f'Using cached features for {text_column_name}')
+                vectorizer, X = cached
+        else:
+            vectorizer = None
+            X = df[data_column_names].to_numpy()
+
+    with phase('split'):
+        all_data = LabelledCollection(X, y)
+
+        train, test = all_data.split_stratified(train_prop=0.75)
+
+    method_names, true_prevs, estim_prevs, tr_prevs = [], [], [], []
+
+    if n_jobs is None:
+        n_jobs = environ['N_JOBS'] if environ['N_JOBS'] is not None else qp.environ['N_JOBS']
+
+    if model_selection and param_grids is None:
+        param_grids = environ['PARAMETER_GRIDS'] if environ['PARAMETER_GRIDS'] is not None else PARAMETER_GRIDS
+
+    # the best quantifier is saved as soon as it is trained, so that one is available if training is stopped
+    best = {'method_name': None, 'score': float('inf'), 'saved': False}
+
+    def save_best(results):
+        best_model = None
+        for method_name, model, true_prev, estim_prev in results:
+            score = qp.error.mrae(true_prev, estim_prev)
+            if score < best['score']:
+                best_model = model
+                best.update(method_name=method_name, score=score)
+        if best_model is not None:
+            with phase('save quantifier'):
+                trained_quantifier = TrainedQuantifier(best_model, best['method_name'], label_encoder.classes_,
+                                                       text_column_name, data_column_names, vectorizer)
+                db.set_quantifier(name, trained_quantifier, overwrite or best['saved'])
+            best['saved'] = True
+            print(f'Saved {best["method_name"]}, the best so far')
+
+    results = train_methods(methods, train, test, n_jobs, param_grids if model_selection else None, budget, save_best)
+
+    for method_name, _, true_prev, estim_prev in results:
+        print(f'Trained {method_name}')
         method_names.append(method_name)
         true_prevs.append(true_prev)
         estim_prevs.append(estim_prev)
         tr_prevs.append(train.prevalence())
 
-    qp.plot.binary_diagonal(method_names, true_prevs, estim_prevs, train_prev=tr_prevs[0],
-                            savepath=db.get_report_dir() / f'{name}_bin_diag.png')
-
-    qp.plot.binary_bias_global(method_names, true_prevs, estim_prevs,
-                               savepath=db.get_report_dir() / f'{name}_bin_bias.png')
-
-    qp.plot.error_by_drift(method_names, true_prevs, estim_prevs, tr_prevs,
-                           error_name='ae', n_bins=10, savepath=db.get_report_dir() / f'{name}_err_drift.png')
-
-    qp.plot.brokenbar_supremacy_by_drift(method_names, true_prevs, estim_prevs, tr_prevs, savepath=db.get_report_dir() / f'{name}_brokenbar_supremacy.png')
-
-    best_i = -1
-    best_score = float('inf')
     scores = []
-    for i, (method_name, true_prev, estim_prev) in enumerate(zip(method_names, true_prevs, estim_prevs)):
+    for method_name, true_prev, estim_prev in zip(method_names, true_prevs, estim_prevs):
         scores.append([qp.error.mrae(true_prev, estim_prev), qp.error.mae(true_prev, estim_prev),
                        qp.error.mkld(true_prev, estim_prev)])
-        if scores[i][0] < best_score:
-            best_i = i
-            best_score = scores[i][0]
+    best_i = method_names.index(best['method_name'])
+
+    with phase('save results'):
+        save_results(db.get_report_dir(), name, method_names, true_prevs, estim_prevs, tr_prevs, scores, best_i)
 
-    db.set_quantifier(name, quantifiers[best_i], overwrite)
 
-    with open(db.get_report_dir() / f'{name}_report.html', mode='tw', encoding='utf-8') as outputfile:
+@job_function
+def render_report(db: QuaPyDB, job_id, name):
+    results = load_results(db.get_report_dir(), name)
+    method_names = results['method_names']
+    true_prevs = [np.asarray(true_prev) for true_prev in results['true_prevs']]
+    estim_prevs = [np.asarray(estim_prev) for estim_prev in results['estim_prevs']]
+    tr_prevs = [np.asarray(tr_prev) for tr_prev in results['tr_prevs']]
+    scores = results['scores']
+    best_i = results['best_i']
+
+    bin_diag, bin_bias, err_drift, brokenbar_supremacy = [db.get_report_dir() / f'{name}{suffix}' for suffix in
+                                                          PLOT_SUFFIXES]
+    with phase('plot binary diagonal'):
+        qp.plot.binary_diagonal(method_names, true_prevs, estim_prevs, train_prev=tr_prevs[0], savepath=bin_diag)
+
+    with phase('plot binary bias'):
+        qp.plot.binary_bias_global(method_names, true_prevs, estim_prevs, savepath=bin_bias)
+
+    with phase('plot error by drift'):
+        qp.plot.error_by_drift(method_names, true_prevs, estim_prevs, tr_prevs,
+                               error_name='ae', n_bins=10, savepath=err_drift)
+
+    with phase('plot supremacy by drift'):
+        qp.plot.brokenbar_supremacy_by_drift(method_names, true_prevs, estim_prevs, tr_prevs,
+                                             savepath=brokenbar_supremacy)
+
+    # the table is written last and atomically, its presence marks the report as rendered
+    tmp_report = report_path(db.get_report_dir(), name).with_suffix('.tmp')
+    with open(tmp_report, mode='tw', encoding='utf-8') as outputfile:
         print('<table>', file=outputfile)
         print('<thead><tr><th>Dataset</th><th>Method</th><th>Best</th><th>MRAE</th><th>MAE</th><th>MKLD</th></tr></thead>',
               file=outputfile)
         print('<tbody>', file=outputfile)
-        for i, (method_name, true_prev, estim_prev, (mrae, mae, mkld)) in enumerate(
-                zip(method_names, true_prevs, estim_prevs, scores)):
+        for i, (method_name, (mrae, mae, mkld)) in enumerate(zip(method_names, scores)):
             print(
                 f'<tr><td>{name}</td><td>{method_name}</td><td>{"*" if i == best_i else ""}</td><td>{mrae:.3g}</td><td>{mae:.3g}</td><td>{mkld:.3g}</td></tr>',
                 file=outputfile)
         print('<tbody>', file=outputfile)
         print('<tfoot></tfoot>', file=outputfile)
+
+    tmp_report.replace(report_path(db.get_report_dir(), name))
+    print(f'Rendered report for {name}')
+
+
+@job_function
+def quantify_file(db: QuaPyDB, job_id, name, path, output_path=None, chunk_size=QUANTIFY_CHUNK_SIZE):
+    trained_quantifier = db.get_quantifier(name)
+    if not isinstance(trained_quantifier, TrainedQuantifier):
+        raise ValueError(f'The quantifier for dataset {name} has been trained by an older version, train it again')
+    if output_path is None:
+        output_path = db.get_report_dir() / f'{name}_{job_id}_prevalences.json'
+
+    quantification = ChunkedQuantification(trained_quantifier, db.get_cache_dir() / f'{job_id}.outputs')
+    if not quantification.exact:
+        print(f'{trained_quantifier.method_name} is not aggregative, '
+              f'prevalences are averaged over chunks of {chunk_size} rows')
+    start = time.perf_counter()
+    try:
+        for chunk in pd.read_csv(path, chunksize=chunk_size, usecols=trained_quantifier.column_names):
+            quantification.add(chunk)
+            elapsed = time.perf_counter() - start
+            print(f'Processed {quantification.rows} rows ({quantification.rows / elapsed:.0f} rows/s)', flush=True)
+        prevalences = quantification.prevalences()
+    finally:
+        quantification.close()
+        (db.get_cache_dir() / f'{job_id}.outputs').unlink(missing_ok=True)
+
+    elapsed = time.perf_counter() - start
+    print(f'Quantified {quantification.rows} rows in {elapsed:.1f}s ({quantification.rows / elapsed:.0f} rows/s)')
+    print(f'Prevalences: {prevalences}')
+    with open(output_path, mode='wt', encoding='utf-8') as outputfile:
+        json.dump({'name': name, 'path': str(path), 'method': trained_quantifier.method_name,
+                   'rows': quantification.rows, 'prevalences': prevalences}, outputfile)
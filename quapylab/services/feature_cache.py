@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import shutil
+import struct
+from pathlib import Path
+
+import dill
+import numpy as np
+import shortuuid
+from scipy.sparse import csr_matrix
+
+VECTORIZER_FILENAME = 'vectorizer.pkl'
+SHAPE_FILENAME = 'shape.json'
+CSR_ARRAYS = ['data', 'indices', 'indptr']
+
+# room for the header of the .npy file of any 1-d array, which is written when the length of the array is known
+NPY_HEADER_SIZE = 128  # bytes
+INDPTR_BLOCK_SIZE = 1 << 20  # values
+
+
+def _entry_size(path):
+    return sum(filename.stat().st_size for filename in path.iterdir())
+
+
+class _NpyAppender:
+    # writes a 1-d array to a .npy file by appending values to it, without holding the array in memory
+    def __init__(self, path, dtype):
+        self._file = open(path, mode='wb')
+        self._dtype = np.dtype(dtype)
+        self.length = 0
+        self._file.write(b' ' * NPY_HEADER_SIZE)
+
+    def append(self, values):
+        values = np.ascontiguousarray(values, dtype=self._dtype)
+        self._file.write(values.tobytes())
+        self.length += len(values)
+
+    def close(self):
+        header = repr({'descr': np.lib.format.dtype_to_descr(self._dtype), 'fortran_order': False,
+                       'shape': (self.length,)}).encode('latin1')
+        prefix = np.lib.format.magic(1, 0)
+        # the header is padded with spaces, ends with a newline, and is preceded by its length as little endian uint16
+        header_length = NPY_HEADER_SIZE - len(prefix) - 2
+        header = header.ljust(header_length - 1) + b'\n'
+        self._file.seek(0)
+        self._file.write(prefix + struct.pack('<H', header_length) + header)
+        self._file.close()
+
+
+class CSRWriter:
+    # builds a CSR matrix on disk, in the format of the feature cache, by appending chunks of rows to it
+    def __init__(self, path, n_features):
+        self._path = Path(path)
+        self._n_features = n_features
+        self._data = _NpyAppender(self._path / 'data.npy', np.float64)
+        self._indices = _NpyAppender(self._path / 'indices.npy', np.int32)
+        self._indptr_path = self._path / 'indptr.npy.tmp'
+        self._indptr = _NpyAppender(self._indptr_path, np.int64)
+        self._indptr.append([0])
+        self._closed = False
+        self.rows = 0
+        self.nnz = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    @property
+    def shape(self):
+        return self.rows, self._n_features
+
+    def append(self, X):
+        X = csr_matrix(X)
+        self._data.append(X.data)
+        self._indices.append(X.indices)
+        self._indptr.append(X.indptr[1:].astype(np.int64) + self.nnz)
+        self.rows += X.shape[0]
+        self.nnz += X.nnz
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for appender in [self._data, self._indices, self._indptr]:
+            appender.close()
+        if self.nnz < 2 ** 31:
+            # as scipy would otherwise copy the indices to int64 to match indptr
+            indptr = np.load(self._indptr_path, mmap_mode='r')
+            appender = _NpyAppender(self._path / 'indptr.npy', np.int32)
+            for start in range(0, len(indptr), INDPTR_BLOCK_SIZE):
+                appender.append(indptr[start:start + INDPTR_BLOCK_SIZE])
+            appender.close()
+            del indptr
+            self._indptr_path.unlink()
+        else:
+            self._indptr_path.replace(self._path / 'indptr.npy')
+
+
+class FeatureCache:
+    def __init__(self, path, max_size):
+        self._path = Path(path) / 'features'
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._max_size = max_size
+
+    def key(self, content_hash, vectorizer):
+        config = repr(sorted((name, repr(value)) for name, value in vectorizer.get_params().items()))
+        return hashlib.sha256(f'{content_hash}\n{type(vectorizer).__name__}\n{config}'.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        entry = self._path / key
+        try:
+            with open(entry / SHAPE_FILENAME, mode='rt', encoding='utf-8') as inputfile:
+                shape = tuple(json.load(inputfile))
+            with open(entry / VECTORIZER_FILENAME, mode='rb') as inputfile:
+                vectorizer = dill.load(inputfile)
+            # copy-on-write mapping, pages are shared and read from disk only when accessed
+            arrays = [np.load(entry / f'{name}.npy', mmap_mode='c') for name in CSR_ARRAYS]
+        except FileNotFoundError:
+            return None
+        os.utime(entry)
+        return vectorizer, csr_matrix(tuple(arrays), shape=shape, copy=False)
+
+    def put(self, key, vectorizer, X):
+        X = csr_matrix(X)
+
+        def write(tmp_entry):
+            for name in CSR_ARRAYS:
+                np.save(tmp_entry / f'{name}.npy', getattr(X, name))
+            return X.shape
+
+        self._store(key, vectorizer, write)
+
+    def put_chunks(self, key, vectorizer, chunks, n_features):
+        # chunks yields the matrices of consecutive rows, which are written as they are produced, the vectorizer is
+        # stored after all the chunks have been consumed
+        def write(tmp_entry):
+            with CSRWriter(tmp_entry, n_features) as writer:
+                for X in chunks:
+                    writer.append(X)
+            return writer.shape
+
+        self._store(key, vectorizer, write)
+
+    def _store(self, key, vectorizer, write):
+        entry = self._path / key
+        tmp_entry = self._path / f'.{key}.{shortuuid.uuid()}.tmp'
+        tmp_entry.mkdir()
+        try:
+            shape = write(tmp_entry)
+            with open(tmp_entry / SHAPE_FILENAME, mode='wt', encoding='utf-8') as outputfile:
+                json.dump(list(shape), outputfile)
+            with open(tmp_entry / VECTORIZER_FILENAME, mode='wb') as outputfile:
+                dill.dump(vectorizer, outputfile)
+            tmp_entry.rename(entry)
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            if not entry.exists():
+                raise
+        except BaseException:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            raise
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        entries = list()
+        for entry in self._path.iterdir():
+            if entry.name.startswith('.'):
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, _entry_size(entry), entry))
+            except FileNotFoundError:
+                continue
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda item: item[0]):
+            if total_size <= self._max_size:
+                break
+            if entry.name == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
@@ -0,0 +1,34 @@
+# training plans select the methods trained on a dataset, a custom plan is a list of method names; this module does not
+# import the machine learning libraries, so that the web application can list and check plans
+FAST_PLAN = 'fast'
+STANDARD_PLAN = 'standard'
+THOROUGH_PLAN = 'thorough'
+CUSTOM_PLAN = 'custom'
+
+PLANS = {
+    # methods on a linear SVM, fitted once
+    FAST_PLAN: ['CC_SVM', 'ACC_SVM', 'PCC_SVM', 'PACC_SVM', 'EMQ_SVM'],
+    # adds the methods on a cross-validated logistic regression
+    STANDARD_PLAN: ['CC_SVM', 'ACC_SVM', 'PCC_SVM', 'PACC_SVM', 'EMQ_SVM', 'EMQ_LR', 'HDy_LR', 'CC_LR'],
+    # adds the ensemble, which takes longer than all the others
+    THOROUGH_PLAN: ['CC_SVM', 'ACC_SVM', 'PCC_SVM', 'PACC_SVM', 'EMQ_SVM', 'EMQ_LR', 'HDy_LR', 'CC_LR',
+                    'Ensemble_PACC_LR'],
+}
+# all the methods, as trained before plans were introduced
+DEFAULT_PLAN = THOROUGH_PLAN
+
+METHOD_NAMES = PLANS[THOROUGH_PLAN]
+
+
+def plan_method_names(plan):
+    if isinstance(plan, str):
+        if plan not in PLANS:
+            raise ValueError(f'Unknown training plan {plan}, available: {", ".join(PLANS)}')
+        return PLANS[plan]
+    names = list(dict.fromkeys(plan))
+    if len(names) == 0:
+        raise ValueError('A custom training plan must list at least one method')
+    unknown = [name for name in names if name not in METHOD_NAMES]
+    if len(unknown) > 0:
+        raise ValueError(f'Unknown methods {", ".join(unknown)}, available: {", ".join(METHOD_NAMES)}')
+    return names
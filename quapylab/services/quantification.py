@@ -0,0 +1,190 @@
+import numpy as np
+
+# how the classifier outputs on chunks of data are combined before aggregating them
+LABEL_COUNTS = 'counts'
+POSTERIORS_SUM = 'sum'
+HISTOGRAMS = 'histograms'
+OUTPUTS = 'outputs'
+CHUNK_ESTIMATES = 'estimates'
+
+# rows of the spilled outputs read at a time by the aggregations that go through them
+AGGREGATION_CHUNK_ROWS = 100000
+
+
+def _accumulation(quantifier):
+    # CC and ACC depend only on the counts of predicted labels, PCC and PACC only on the mean posterior, HDy only on
+    # the histograms of the posteriors, other aggregative methods need all the outputs, which are spilled to disk,
+    # other quantifiers can only be applied to each chunk
+    from quapy.method.aggregative import AggregativeQuantifier, ACC, CC, HDy, PACC, PCC
+
+    if isinstance(quantifier, (CC, ACC)):
+        return LABEL_COUNTS
+    if isinstance(quantifier, (PCC, PACC)):
+        return POSTERIORS_SUM
+    if isinstance(quantifier, HDy):
+        return HISTOGRAMS
+    if isinstance(quantifier, AggregativeQuantifier):
+        return OUTPUTS
+    return CHUNK_ESTIMATES
+
+
+def _hdy_aggregate(quantifier, histograms):
+    # as HDy.aggregate, on the histograms of the positive posteriors, for each number of bins, counted chunk by chunk
+    import quapy.functional as F
+
+    prev_estimations = list()
+    for bins in quantifier.bins:
+        counts = histograms[bins]
+        # as the density computed by np.histogram
+        Px_test = counts / np.diff(np.linspace(0, 1, bins + 1)) / counts.sum()
+        prev_selected, min_dist = None, None
+        for prev in F.prevalence_linspace(n_prevalences=101, repeats=1, smooth_limits_epsilon=0.0):
+            Px_train = prev * quantifier.Pxy1_density[bins] + (1 - prev) * quantifier.Pxy0_density[bins]
+            hdy = F.HellingerDistance(Px_train, Px_test)
+            if prev_selected is None or hdy < min_dist:
+                prev_selected, min_dist = prev, hdy
+        prev_estimations.append(prev_selected)
+    return F.as_binary_prevalence(np.median(prev_estimations))
+
+
+def _emq_aggregate(quantifier, outputs):
+    # as EMQ.aggregate, each iteration going through the posteriors in chunks, so that no array as large as them
+    # is allocated
+    import quapy as qp
+    from quapy.method.aggregative import EMQ
+
+    Ptr = np.copy(quantifier.train_prevalence)
+    qs = np.copy(Ptr)
+    s, converged = 0, False
+    qs_prev_ = None
+    while not converged and s < EMQ.MAX_ITER:
+        ps_sum = np.zeros(len(qs), dtype=float)
+        for start in range(0, len(outputs), AGGREGATION_CHUNK_ROWS):
+            ps_unnormalized = (qs / Ptr) * np.asarray(outputs[start:start + AGGREGATION_CHUNK_ROWS])
+            ps_sum += (ps_unnormalized / ps_unnormalized.sum(axis=1, keepdims=True)).sum(axis=0)
+        qs = ps_sum / len(outputs)
+        if qs_prev_ is not None and qp.error.mae(qs, qs_prev_) < EMQ.EPSILON and s > 10:
+            converged = True
+        qs_prev_ = qs
+        s += 1
+    if not converged:
+        print('[warning] the method has reached the maximum number of iterations; it might have not converged')
+    return qs
+
+
+class TrainedQuantifier:
+    # a quantifier together with what is needed to apply it to new rows of data
+    def __init__(self, quantifier, method_name, classes, text_column_name=None, data_column_names=None,
+                 vectorizer=None):
+        self.quantifier = quantifier
+        self.method_name = method_name
+        self.classes = list(classes)
+        self.text_column_name = text_column_name
+        self.data_column_names = data_column_names
+        self.vectorizer = vectorizer
+
+    def __str__(self):
+        return str(self.quantifier)
+
+    @property
+    def column_names(self):
+        if self.text_column_name is not None:
+            return [self.text_column_name]
+        return list(self.data_column_names)
+
+    def transform(self, df):
+        if self.text_column_name is not None:
+            return self.vectorizer.transform(df[self.text_column_name].fillna('').astype(str))
+        return df[self.data_column_names].to_numpy(dtype=float)
+
+    def prevalences_to_dict(self, prevalences):
+        return {str(label): float(prevalence) for label, prevalence in zip(self.classes, prevalences)}
+
+    def quantify(self, df):
+        return self.prevalences_to_dict(self.quantifier.quantify(self.transform(df)))
+
+
+class ChunkedQuantification:
+    # applies a trained quantifier to data that is read in chunks, memory depends on the chunk size and not on the
+    # total size of the data, outputs that must be kept are spilled to outputs_path; EMQ goes through them in chunks at
+    # every iteration, the aggregative methods other than the ones in _accumulation are applied to all of them, and
+    # take memory proportional to the rows
+    def __init__(self, trained_quantifier, outputs_path):
+        self._trained_quantifier = trained_quantifier
+        self._quantifier = trained_quantifier.quantifier
+        self._accumulation = _accumulation(self._quantifier)
+        self._outputs_path = outputs_path
+        self._outputs_file = None
+        self._outputs_dtype = None
+        self._outputs_shape = None
+        self._accumulator = None
+        self.rows = 0
+
+    @property
+    def exact(self):
+        return self._accumulation != CHUNK_ESTIMATES
+
+    def add(self, df):
+        if len(df) == 0:
+            return
+        X = self._trained_quantifier.transform(df)
+        if self._accumulation == LABEL_COUNTS:
+            predictions = self._quantifier.classify(X)
+            counts = (np.asarray(predictions)[:, np.newaxis] == np.asarray(self._quantifier.classes_)).sum(axis=0)
+            self._accumulate(counts)
+        elif self._accumulation == POSTERIORS_SUM:
+            self._accumulate(np.asarray(self._quantifier.classify(X)).sum(axis=0))
+        elif self._accumulation == HISTOGRAMS:
+            Px = np.asarray(self._quantifier.classify(X))[:, self._quantifier.pos_label]
+            if self._accumulator is None:
+                self._accumulator = {bins: np.zeros(bins, dtype=np.int64) for bins in self._quantifier.bins}
+            for bins, counts in self._accumulator.items():
+                counts += np.histogram(Px, bins=bins, range=(0, 1))[0]
+        elif self._accumulation == OUTPUTS:
+            outputs = np.asarray(self._quantifier.classify(X))
+            if self._outputs_file is None:
+                self._outputs_file = open(self._outputs_path, mode='wb')
+                self._outputs_dtype = outputs.dtype
+                self._outputs_shape = outputs.shape[1:]
+            self._outputs_file.write(np.ascontiguousarray(outputs, dtype=self._outputs_dtype).tobytes())
+        else:
+            self._accumulate(np.asarray(self._quantifier.quantify(X)) * len(df))
+        self.rows += len(df)
+
+    def _accumulate(self, values):
+        if self._accumulator is None:
+            self._accumulator = np.zeros(len(values), dtype=float)
+        self._accumulator += values
+
+    def prevalences(self):
+        if self.rows == 0:
+            raise ValueError('No rows to quantify')
+        if self._accumulation == LABEL_COUNTS:
+            prevalences = self._accumulator / self.rows
+            from quapy.method.aggregative import ACC
+
+            if isinstance(self._quantifier, ACC):
+                prevalences = ACC.solve_adjustment(self._quantifier.Pte_cond_estim_, prevalences)
+        elif self._accumulation == POSTERIORS_SUM:
+            # the aggregation of PCC and PACC on the mean posterior is the same as on all the posteriors
+            prevalences = self._quantifier.aggregate((self._accumulator / self.rows)[np.newaxis, :])
+        elif self._accumulation == HISTOGRAMS:
+            prevalences = _hdy_aggregate(self._quantifier, self._accumulator)
+        elif self._accumulation == OUTPUTS:
+            from quapy.method.aggregative import EMQ
+
+            self._outputs_file.close()
+            outputs = np.memmap(self._outputs_path, dtype=self._outputs_dtype, mode='r',
+                                shape=(self.rows, *self._outputs_shape))
+            if isinstance(self._quantifier, EMQ):
+                prevalences = _emq_aggregate(self._quantifier, outputs)
+            else:
+                prevalences = self._quantifier.aggregate(outputs)
+            del outputs
+        else:
+            prevalences = self._accumulator / self.rows
+        return self._trained_quantifier.prevalences_to_dict(prevalences)
+
+    def close(self):
+        if self._outputs_file is not None:
+            self._outputs_file.close()
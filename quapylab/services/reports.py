@@ -0,0 +1,49 @@
+import json
+
+# evaluation results are saved by training, the report is rendered from them only when it is first requested
+RESULTS_SUFFIX = '_results.json'
+REPORT_SUFFIX = '_report.html'
+PLOT_SUFFIXES = ['_bin_diag.png', '_bin_bias.png', '_err_drift.png', '_brokenbar_supremacy.png']
+
+
+def results_path(report_dir, name):
+    return report_dir / f'{name}{RESULTS_SUFFIX}'
+
+
+def report_path(report_dir, name):
+    return report_dir / f'{name}{REPORT_SUFFIX}'
+
+
+def save_results(report_dir, name, method_names, true_prevs, estim_prevs, tr_prevs, scores, best_i):
+    results = {'method_names': method_names,
+               'true_prevs': [true_prev.tolist() for true_prev in true_prevs],
+               'estim_prevs': [estim_prev.tolist() for estim_prev in estim_prevs],
+               'tr_prevs': [tr_prev.tolist() for tr_prev in tr_prevs],
+               'scores': scores,
+               'best_i': best_i}
+    tmp_path = results_path(report_dir, name).with_suffix('.tmp')
+    with open(tmp_path, mode='wt', encoding='utf-8') as outputfile:
+        json.dump(results, outputfile)
+    tmp_path.replace(results_path(report_dir, name))
+
+
+def load_results(report_dir, name):
+    with open(results_path(report_dir, name), mode='rt', encoding='utf-8') as inputfile:
+        return json.load(inputfile)
+
+
+def results_version(report_dir, name):
+    try:
+        return results_path(report_dir, name).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def report_is_rendered(report_dir, name):
+    # the html table is written last, a report is current if it is not older than the results it is rendered from
+    try:
+        rendered = report_path(report_dir, name).stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+    version = results_version(report_dir, name)
+    return version is None or rendered >= version
@@ -0,0 +1,424 @@
+import math
+import os
+import time
+
+import numpy as np
+import quapy as qp
+from joblib import Parallel, delayed, effective_n_jobs
+from quapy.classification.calibration import VSCalibration
+from quapy.method.aggregative import EMQ, PACC, CC, ACC, PCC, HDy, AggregativeSoftQuantifier
+from quapy.method.meta import Ensemble
+from quapy.protocol import APP
+from scipy.sparse import issparse
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.linear_model import LogisticRegressionCV
+from sklearn.model_selection import ParameterGrid
+from sklearn.svm import LinearSVC
+
+from quapylab.services.plans import plan_method_names
+from quapylab.util.resources import record_phase, timed
+
+# set here, as the workers fitting and evaluating the methods import this module and not experiments
+qp.environ["SAMPLE_SIZE"] = 100
+qp.environ["N_JOBS"] = max(1, os.cpu_count() // 2)
+
+# fraction of the training set used by the adjusted methods to estimate their correction, as in QuaPy defaults
+VALIDATION_SPLIT = 0.4
+
+# fraction of the training set on which the hyperparameters of the methods are evaluated, when they are searched
+SELECTION_SPLIT = 0.3
+
+# base classifiers shared by the aggregative quantifiers, QuaPy calibrates non probabilistic classifiers this way,
+# the parameters are the ones of the SVM or LR
+CLASSIFIERS = {
+    'SVM': lambda **params: LinearSVC(**params),
+    'SVM_calibrated': lambda **params: CalibratedClassifierCV(LinearSVC(**params), cv=5),
+    'LR': lambda **params: VSCalibration(LogisticRegressionCV(**params)),
+}
+
+# relative cost of fitting the base classifiers, in units of a LinearSVC fit, as measured on a small dataset
+CLASSIFIER_COSTS = {
+    'SVM': 1,
+    'SVM_calibrated': 5,
+    'LR': 70,
+}
+
+# initial estimate of the seconds a cost unit takes for each MB of training data, until training times are measured,
+# the minimum accounts for the evaluation on APP samples, whose cost does not depend on the size of the dataset
+COST_UNIT_SECONDS_PER_MB = 0.15
+COST_UNIT_MIN_SECONDS = 0.03
+
+# share of the budget that the selection of hyperparameters can use
+SELECTION_BUDGET_SHARE = 0.5
+
+# parameters of the base classifier have the classifier__ prefix, as in QuaPy GridSearchQ, the others are passed to
+# the quantifier
+CLASSIFIER_PREFIX = 'classifier__'
+
+# the classifier is fitted on the full training set, or on the training part of the validation split
+FULL_TRAIN = 'train'
+VALIDATION_TRAIN = 'validation'
+
+
+class Method:
+    # cost is the one of fitting and evaluating the quantifier, in cost units, the base classifier excluded
+    def __init__(self, name, quantifier, classifier=None, validation=False, cost=20):
+        self.name = name
+        self.quantifier = quantifier
+        self.classifier = classifier
+        self.validation = validation
+        self.cost = cost
+
+    @property
+    def shared(self):
+        return self.classifier is not None
+
+    def create(self, classifier=None, **params):
+        if self.shared:
+            return self.quantifier(classifier, **params)
+        return self.quantifier(**params)
+
+
+METHODS = [
+    Method('CC_SVM', CC, 'SVM'),
+    Method('ACC_SVM', ACC, 'SVM', validation=True, cost=500),
+    Method('PCC_SVM', PCC, 'SVM_calibrated'),
+    Method('PACC_SVM', PACC, 'SVM_calibrated', validation=True, cost=500),
+    Method('EMQ_SVM', EMQ, 'SVM_calibrated', cost=80),
+    Method('EMQ_LR', EMQ, 'LR', cost=100),
+    Method('HDy_LR', HDy, 'LR', validation=True, cost=2500),
+    Method('CC_LR', CC, 'LR'),
+    Method('Ensemble_PACC_LR',
+           lambda **params: Ensemble(PACC(LogisticRegressionCV()), **{'size': 30, 'policy': 'ave', **params}),
+           cost=17000),
+]
+
+
+def plan_methods(plan):
+    methods = {method.name: method for method in METHODS}
+    return [methods[name] for name in plan_method_names(plan)]
+
+# hyperparameters searched for each method, when model selection is requested, LogisticRegressionCV already selects
+# its C by cross-validation
+PARAMETER_GRIDS = {
+    **{name: {'classifier__C': [0.01, 0.1, 1, 10, 100]} for name in
+       ['CC_SVM', 'ACC_SVM', 'PCC_SVM', 'PACC_SVM', 'EMQ_SVM']},
+    **{name: {'classifier__class_weight': [None, 'balanced']} for name in ['EMQ_LR', 'HDy_LR', 'CC_LR']},
+}
+
+# successive halving: the candidates of a method are evaluated on APP with few repeats, and only the best
+# 1/HALVING_FACTOR of them are evaluated again with HALVING_FACTOR times the repeats, the last round, on at most
+# HALVING_FACTOR candidates, with EVALUATION_REPEATS / HALVING_FACTOR
+EVALUATION_REPEATS = 100
+HALVING_FACTOR = 3
+MIN_SELECTION_REPEATS = 10
+
+
+def format_params(params):
+    return ', '.join(f'{name}={value}' for name, value in params.items())
+
+
+class Candidate:
+    # a method with a setting of its hyperparameters
+    def __init__(self, method, params=None):
+        self.method = method
+        self.params = dict() if params is None else dict(params)
+
+    @property
+    def name(self):
+        return self.method.name
+
+    @property
+    def shared(self):
+        return self.method.shared
+
+    @property
+    def validation(self):
+        return self.method.validation
+
+    @property
+    def description(self):
+        return f'{self.name} ({format_params(self.params)})' if len(self.params) > 0 else self.name
+
+    @property
+    def classifier_params(self):
+        return {name[len(CLASSIFIER_PREFIX):]: value for name, value in self.params.items() if
+                name.startswith(CLASSIFIER_PREFIX)}
+
+    @property
+    def classifier_fit(self):
+        # the candidates with the same classifier_fit share the fitted classifier
+        return (self.method.classifier, VALIDATION_TRAIN if self.validation else FULL_TRAIN,
+                format_params(self.classifier_params))
+
+    def cost(self, classifiers=()):
+        # classifiers are the fitted ones, which cost nothing more
+        if self.shared and self.classifier_fit not in classifiers:
+            return self.method.cost + CLASSIFIER_COSTS[self.method.classifier]
+        return self.method.cost
+
+    def create(self, classifier=None):
+        if self.shared:
+            return self.method.create(classifier, **{name: value for name, value in self.params.items() if
+                                                     not name.startswith(CLASSIFIER_PREFIX)})
+        return self.method.create(**self.params)
+
+
+def training_size(data):
+    instances = data.instances
+    if issparse(instances):
+        return instances.data.nbytes + instances.indices.nbytes + instances.indptr.nbytes
+    return np.asarray(instances).nbytes
+
+
+class Budget:
+    # wall clock seconds available for training, None for no limit; the seconds a cost unit takes are first estimated
+    # from the size of the training set, then from the measured training times
+    def __init__(self, seconds, train):
+        self.seconds = seconds
+        self.unit_seconds = max(COST_UNIT_MIN_SECONDS, training_size(train) / 1024 ** 2 * COST_UNIT_SECONDS_PER_MB)
+        self._start = time.perf_counter()
+        self._measured_units = 0.0
+        self._measured_seconds = 0.0
+
+    @property
+    def limited(self):
+        return self.seconds is not None
+
+    def spent(self):
+        return time.perf_counter() - self._start
+
+    def remaining(self):
+        if not self.limited:
+            return float('inf')
+        return self.seconds - self.spent()
+
+    def estimate(self, units):
+        return units * self.unit_seconds
+
+    def measure(self, units, seconds):
+        # seconds are the ones a task took in its worker, so that the start-up of the workers is not accounted
+        self._measured_units += units
+        self._measured_seconds += seconds
+        if self._measured_units > 0:
+            self.unit_seconds = self._measured_seconds / self._measured_units
+
+
+def parallel_units(costs, workers):
+    # the cost of running tasks together, as bound by the longest task and by the number of workers
+    return max(max(costs, default=0), sum(costs) / workers)
+
+
+def evaluate(model, test, repeats=EVALUATION_REPEATS):
+    return qp.evaluation.prediction(model, APP(test, repeats=repeats, random_state=0))
+
+
+def precompute_outputs(classifier, instances):
+    predictions = classifier.predict(instances)
+    posteriors = classifier.predict_proba(instances) if hasattr(classifier, 'predict_proba') else None
+    return predictions, posteriors
+
+
+def evaluate_on_outputs(model, outputs, test, repeats=EVALUATION_REPEATS):
+    # the same APP samples of test are drawn as row indices, and each sample is evaluated by applying the aggregation
+    # to the rows of the precomputed outputs, without classifying the instances again
+    predictions, posteriors = outputs
+    protocol = APP(test, repeats=repeats, random_state=0)
+    with qp.util.temp_seed(protocol.random_state):
+        indexes = protocol.samples_parameters()
+    soft = isinstance(model, AggregativeSoftQuantifier)
+    true_prevs = [qp.functional.prevalence_from_labels(test.labels[index], test.classes_) for index in indexes]
+    estim_prevs = [model.aggregate(posteriors[index] if soft else predictions[index]) for index in indexes]
+    return np.asarray(true_prevs), np.asarray(estim_prevs)
+
+
+def fit_classifier(classifier_fit, params, data, test):
+    classifier_name, _, _ = classifier_fit
+    classifier = CLASSIFIERS[classifier_name](**params)
+    classifier.fit(*data.Xy)
+    return classifier_fit, classifier, precompute_outputs(classifier, test.instances)
+
+
+def fit_and_evaluate(candidate, train, test, repeats):
+    model = candidate.create()
+    model.fit(train)
+    return model, *evaluate(model, test, repeats)
+
+
+def fit_aggregation_and_evaluate(candidate, classifier, outputs, train, validation_train, validation, test, repeats):
+    model = candidate.create(classifier)
+    if candidate.validation:
+        model.fit(validation_train, fit_classifier=False, val_split=validation)
+    else:
+        model.fit(train, fit_classifier=False)
+    return model, *evaluate_on_outputs(model, outputs, test, repeats)
+
+
+def evaluate_fitted(model, outputs, test, repeats):
+    if outputs is None:
+        return evaluate(model, test, repeats)
+    return evaluate_on_outputs(model, outputs, test, repeats)
+
+
+# each base classifier is fitted once and its outputs on the test set computed once, and shared by all the
+# aggregative candidates using it, which then fit and evaluate only their aggregation stage; returns
+# (model, outputs, true_prevs, estim_prevs) in the order of candidates, outputs are None for the non aggregative ones
+# classifiers maps classifier_fit to the (classifier, outputs) already fitted on train and test, and is updated
+# the time taken by each classifier and candidate is recorded as a phase of the job, and measured by budget, when
+# given, on the costs scaled by cost_share, the share of the training set used
+def fit_candidates(parallel, candidates, train, test, repeats, phase_prefix='', classifiers=None, budget=None,
+                   cost_share=1.0):
+    validation_train, validation = train.split_stratified(train_prop=1 - VALIDATION_SPLIT, random_state=0)
+    data = {FULL_TRAIN: train, VALIDATION_TRAIN: validation_train}
+    if classifiers is None:
+        classifiers = dict()
+
+    classifier_params = {candidate.classifier_fit: candidate.classifier_params for candidate in candidates if
+                         candidate.shared and candidate.classifier_fit not in classifiers}
+    classifier_fits = list(classifier_params)
+    single = [i for i, candidate in enumerate(candidates) if not candidate.shared]
+    shared = [i for i, candidate in enumerate(candidates) if candidate.shared]
+
+    results = parallel(
+        [delayed(timed)(fit_classifier, classifier_fit, classifier_params[classifier_fit], data[classifier_fit[1]],
+                        test) for classifier_fit in classifier_fits] +
+        [delayed(timed)(fit_and_evaluate, candidates[i], train, test, repeats[i]) for i in single])
+    for (classifier_fit, _, _), *timing in results[:len(classifier_fits)]:
+        name, split, params = classifier_fit
+        record_phase(f'{phase_prefix}fit classifier {name} ({", ".join(filter(None, [split, params]))})', *timing)
+        if budget is not None:
+            budget.measure(cost_share * CLASSIFIER_COSTS[name], timing[0])
+    classifiers.update({classifier_fit: (classifier, outputs) for (classifier_fit, classifier, outputs), *_ in
+                        results[:len(classifier_fits)]})
+    fitted = dict()
+    for i, ((model, true_prevs, estim_prevs), *timing) in zip(single, results[len(classifier_fits):]):
+        record_phase(f'{phase_prefix}fit and evaluate {candidates[i].description}', *timing)
+        if budget is not None:
+            budget.measure(cost_share * candidates[i].method.cost, timing[0])
+        fitted[i] = model, None, true_prevs, estim_prevs
+
+    shared_results = parallel(
+        delayed(timed)(fit_aggregation_and_evaluate, candidates[i], *classifiers[candidates[i].classifier_fit], train,
+                       validation_train, validation, test, repeats[i]) for i in shared)
+    for i, ((model, true_prevs, estim_prevs), *timing) in zip(shared, shared_results):
+        record_phase(f'{phase_prefix}fit and evaluate {candidates[i].description}', *timing)
+        if budget is not None:
+            budget.measure(cost_share * candidates[i].method.cost, timing[0])
+        fitted[i] = model, classifiers[candidates[i].classifier_fit][1], true_prevs, estim_prevs
+
+    return [fitted[i] for i in range(len(candidates))]
+
+
+def halving_repeats(candidates):
+    # repeats of each round, e.g., [11, 33] for 5 candidates and [33] for up to 3
+    rounds = 1
+    while candidates > HALVING_FACTOR:
+        candidates = math.ceil(candidates / HALVING_FACTOR)
+        rounds += 1
+    return [max(MIN_SELECTION_REPEATS, EVALUATION_REPEATS // HALVING_FACTOR ** (rounds - i)) for i in range(rounds)]
+
+
+# the candidates of every method are fitted on a part of the training set and evaluated, by MRAE, on APP samples of
+# the rest, all the methods advance their successive halving together, so that every round is run in parallel;
+# returns the best parameters for each method with a grid
+# with a limited budget, the selection is skipped if its first round is estimated to take more than
+# SELECTION_BUDGET_SHARE of it, and stops, keeping the best candidates so far, when that share is used
+def select_params(parallel, methods, train, param_grids, budget, workers):
+    search_train, search_test = train.split_stratified(train_prop=1 - SELECTION_SPLIT, random_state=0)
+    searches = dict()
+    for method in methods:
+        candidates = [Candidate(method, params) for params in ParameterGrid(param_grids.get(method.name, dict()))]
+        if len(candidates) > 1:
+            searches[method.name] = candidates, halving_repeats(len(candidates))
+    if len(searches) == 0:
+        return dict()
+
+    candidates = [candidate for method_candidates, _ in searches.values() for candidate in method_candidates]
+    selection_seconds = SELECTION_BUDGET_SHARE * budget.remaining()
+    classifier_costs = {candidate.classifier_fit: CLASSIFIER_COSTS[candidate.method.classifier] for candidate in
+                        candidates if candidate.shared}
+    units = (1 - SELECTION_SPLIT) * parallel_units(
+        list(classifier_costs.values()) + [candidate.cost(classifier_costs) for candidate in candidates], workers)
+    if budget.estimate(units) > selection_seconds:
+        print(f'Skipped the selection of hyperparameters, estimated {budget.estimate(units):.0f}s with '
+              f'{selection_seconds:.0f}s for it')
+        return dict()
+    print(f'Selecting hyperparameters among {len(candidates)} candidates of {len(searches)} methods')
+    results = fit_candidates(parallel, candidates, search_train, search_test,
+                             [searches[candidate.name][1][0] for candidate in candidates], 'select: ',
+                             budget=budget, cost_share=1 - SELECTION_SPLIT)
+    # for each method, the surviving (candidate, model, outputs, score)
+    survivors = {name: list() for name in searches}
+    for candidate, (model, outputs, true_prevs, estim_prevs) in zip(candidates, results):
+        survivors[candidate.name].append((candidate, model, outputs, qp.error.mrae(true_prevs, estim_prevs)))
+
+    rounds = max(len(repeats) for _, repeats in searches.values())
+    for round_index in range(1, rounds):
+        if budget.limited and budget.spent() > selection_seconds:
+            print(f'Stopped the selection of hyperparameters after {round_index} rounds, out of budget')
+            break
+        evaluations = list()
+        for name, (_, repeats) in searches.items():
+            if round_index < len(repeats):
+                best = sorted(survivors[name], key=lambda survivor: survivor[3])
+                survivors[name] = best[:math.ceil(len(best) / HALVING_FACTOR)]
+                evaluations.extend((survivor, repeats[round_index]) for survivor in survivors[name])
+        print(f'Selection round {round_index + 1}: {len(evaluations)} candidates')
+        results = parallel(delayed(timed)(evaluate_fitted, model, outputs, search_test, repeats) for
+                           (_, model, outputs, _), repeats in evaluations)
+        for ((candidate, model, outputs, _), repeats), ((true_prevs, estim_prevs), *timing) in zip(evaluations,
+                                                                                                  results):
+            record_phase(f'select: evaluate {candidate.description} on {repeats} repeats', *timing)
+            survivors[candidate.name] = [survivor if survivor[0] is not candidate else
+                                         (candidate, model, outputs, qp.error.mrae(true_prevs, estim_prevs))
+                                         for survivor in survivors[candidate.name]]
+
+    selected = dict()
+    for name, method_survivors in survivors.items():
+        candidate, _, _, score = min(method_survivors, key=lambda survivor: survivor[3])
+        print(f'Selected {candidate.description}, MRAE {score:.4g}')
+        selected[name] = candidate.params
+    return selected
+
+
+# when param_grids is given, the hyperparameters of the methods are first selected on the training set, the
+# selected candidates are then trained on the training set and evaluated on the test set; returns
+# (name, model, true_prevs, estim_prevs) in the order of methods
+# with a budget, in seconds, the methods are trained in batches, as many as the workers, cheapest first, and the ones
+# estimated not to finish in the remaining time are skipped, the first one is always trained; on_results is called
+# with the results of each batch
+def train_methods(methods, train, test, n_jobs, param_grids=None, budget=None, on_results=None):
+    budget = Budget(budget, train)
+    workers = effective_n_jobs(n_jobs)
+    # arrays larger than max_nbytes are shared with the workers as copy-on-write memory-mapped files
+    with Parallel(n_jobs=n_jobs, backend='loky', max_nbytes='1M', mmap_mode='c') as parallel:
+        selected = dict()
+        if param_grids is not None:
+            selected = select_params(parallel, methods, train, param_grids, budget, workers)
+        pending = sorted((Candidate(method, selected.get(method.name)) for method in methods),
+                         key=lambda candidate: candidate.cost())
+        batch_size = workers if budget.limited else len(pending)
+        classifiers = dict()
+        results = dict()
+        while len(pending) > 0:
+            batch = list()
+            while len(pending) > 0 and len(batch) < batch_size:
+                candidate = pending.pop(0)
+                seconds = budget.estimate(candidate.cost(classifiers))
+                if len(results) + len(batch) > 0 and seconds > budget.remaining():
+                    print(f'Skipped {candidate.name}, estimated {seconds:.0f}s with '
+                          f'{max(0.0, budget.remaining()):.0f}s left')
+                    continue
+                batch.append(candidate)
+            if len(batch) == 0:
+                break
+            batch_results = fit_candidates(parallel, batch, train, test, [EVALUATION_REPEATS] * len(batch),
+                                           classifiers=classifiers, budget=budget)
+            batch_results = [(candidate.name, model, true_prevs, estim_prevs) for
+                             candidate, (model, _, true_prevs, estim_prevs) in zip(batch, batch_results)]
+            results.update({result[0]: result for result in batch_results})
+            if on_results is not None:
+                on_results(batch_results)
+    classifier_fits = dict.fromkeys((name, split) for name, split, _ in classifiers)
+    print(f'Fitted classifiers: {", ".join(f"{name} ({split})" for name, split in classifier_fits)}')
+    return [results[method.name] for method in methods if method.name in results]
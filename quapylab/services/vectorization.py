@@ -0,0 +1,41 @@
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+HASHING_FEATURES = 2 ** 20
+
+
+class StreamingTfidfVectorizer:
+    # words are hashed to a fixed number of features, so that no vocabulary is kept, and weighted as by the defaults of
+    # TfidfVectorizer; the idf is learnt by partial_fit, one chunk of documents at a time
+    def __init__(self, n_features=HASHING_FEATURES, use_idf=True):
+        self.n_features = n_features
+        self.use_idf = use_idf
+        self._hashing = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None)
+        self._document_frequency = np.zeros(n_features, dtype=np.int64) if use_idf else None
+        self._documents = 0
+        self._idf = None
+
+    def get_params(self, deep=True):
+        return {'n_features': self.n_features, 'use_idf': self.use_idf}
+
+    def partial_fit(self, documents):
+        if self.use_idf:
+            counts = self._hashing.transform(documents)
+            self._document_frequency += np.bincount(counts.indices, minlength=self.n_features)
+            self._documents += counts.shape[0]
+            self._idf = None
+        return self
+
+    @property
+    def idf_(self):
+        if self._idf is None and self.use_idf:
+            # smoothed as if a document contained every word once
+            self._idf = np.log((1 + self._documents) / (1 + self._document_frequency)) + 1
+        return self._idf
+
+    def transform(self, documents):
+        X = self._hashing.transform(documents)
+        if self.use_idf:
+            X.data *= self.idf_[X.indices]
+        return normalize(X, copy=False)
@@ -1,6 +1,14 @@
 import datetime
 from pathlib import Path
 
+environ = {
+    'FEATURE_CACHE_SIZE': 10 * 1024 ** 3,  # bytes
+    'PARAMETER_GRIDS': None,  # hyperparameters searched for each method, None = the default ones
+    'STREAMING_TEXT_ROWS': 1000000,  # text datasets with at least these rows are vectorized out of core, 0 = never
+    'STREAMING_IDF': True,  # whether out of core vectorization weights features by idf
+    'N_JOBS': None,  # parallel processes used by a training job, None = the N_JOBS of quapy
+}
+
 
 def get_quapylab_home():
     home = Path.home() / 'quapylab_data'
@@ -11,4 +19,8 @@ def datetime_now_to_filename():
     job_id = str(datetime.datetime.now())
     job_id = job_id[:job_id.rfind(".")]
     job_id = job_id.replace(' ', '_')
-    return job_id.replace(':', '-')
\ No newline at end of file
+    return job_id.replace(':', '-')
+
+
+def datetime_from_filename(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d_%H-%M-%S')
\ No newline at end of file
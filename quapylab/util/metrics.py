@@ -0,0 +1,162 @@
+import math
+import multiprocessing
+import threading
+from bisect import bisect_left
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+def _escape(value, quote=True):
+    value = str(value).replace('\\', '\\\\').replace('\n', '\\n')
+    return value.replace('"', '\\"') if quote else value
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if len(pairs) == 0:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Values:
+    # the values of a metric for each combination of its label values, metrics updated by other processes keep them
+    # in shared memory, which requires all the combinations to be known when the metric is created
+    def __init__(self, width, shared_keys=None):
+        self._width = width
+        if shared_keys is None:
+            self._index = None
+            self._values = dict()
+            self._lock = threading.Lock()
+        else:
+            self._index = {tuple(str(value) for value in key): i for i, key in enumerate(shared_keys)}
+            self._values = multiprocessing.Array('d', len(self._index) * width, lock=True)
+            self._lock = self._values.get_lock()
+
+    def _row(self, key):
+        if self._index is None:
+            return self._values.setdefault(key, [0.0] * self._width), 0
+        if key not in self._index:
+            raise KeyError(f'Unknown label values {key}')
+        return self._values.get_obj(), self._index[key] * self._width
+
+    def add(self, key, increments):
+        with self._lock:
+            values, base = self._row(key)
+            for position, amount in increments:
+                values[base + position] += amount
+
+    def set(self, key, position, value):
+        with self._lock:
+            values, base = self._row(key)
+            values[base + position] = value
+
+    def items(self):
+        with self._lock:
+            if self._index is None:
+                return sorted((key, list(values)) for key, values in self._values.items())
+            values = self._values.get_obj()
+            return [(key, list(values[i * self._width:(i + 1) * self._width])) for key, i in self._index.items()]
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), shared_keys=None, width=1):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = _Values(width, shared_keys)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'Metric {self.name} has labels ({", ".join(self.labelnames)}), got '
+                             f'({", ".join(labels)})')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self, key, values):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(values[0])}']
+
+    def render(self):
+        lines = [f'# HELP {self.name} {_escape(self.documentation, quote=False)}', f'# TYPE {self.name} {self.type}']
+        for key, values in self._values.items():
+            lines.extend(self._samples(key, values))
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError(f'Counter {self.name} can only be increased')
+        self._values.add(self._key(labels), [(0, amount)])
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self._values.set(self._key(labels), 0, value)
+
+    def inc(self, amount=1, **labels):
+        self._values.add(self._key(labels), [(0, amount)])
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS, labelnames=(), shared_keys=None):
+        self.buckets = sorted(float(bucket) for bucket in buckets)
+        if len(self.buckets) == 0 or not math.isinf(self.buckets[-1]):
+            self.buckets.append(math.inf)
+        # a count for each bucket, and the sum of the observed values
+        super().__init__(name, documentation, labelnames, shared_keys, len(self.buckets) + 1)
+
+    def observe(self, value, **labels):
+        self._values.add(self._key(labels), [(bisect_left(self.buckets, value), 1), (len(self.buckets), value)])
+
+    def _samples(self, key, values):
+        samples = list()
+        cumulative = 0
+        for bucket, count in zip(self.buckets, values):
+            cumulative += count
+            samples.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", _format_value(bucket))])} '
+                           f'{_format_value(cumulative)}')
+        labels = _format_labels(self.labelnames, key)
+        samples.append(f'{self.name}_sum{labels} {_format_value(values[-1])}')
+        samples.append(f'{self.name}_count{labels} {_format_value(cumulative)}')
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = list()
+        self._collectors = list()
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        # a collector returns a list of metrics, read when the registry is rendered
+        self._collectors.append(collector)
+
+    def render(self):
+        metrics = list(self._metrics)
+        for collector in self._collectors:
+            metrics.extend(collector())
+        lines = list()
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,108 @@
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+
+def current_rss():
+    # resident set size of this process, in bytes
+    try:
+        with open('/proc/self/statm', mode='rt') as inputfile:
+            return int(inputfile.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # no procfs, the peak is the best available approximation
+        return peak_rss()
+
+
+def peak_rss():
+    # peak resident set size of this process, in bytes, since it started or since the last reset_peak_rss
+    try:
+        with open('/proc/self/status', mode='rt') as inputfile:
+            for line in inputfile:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    # only Linux allows to reset the peak, elsewhere it remains the peak of the whole life of the process
+    try:
+        with open('/proc/self/clear_refs', mode='wt') as outputfile:
+            outputfile.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def cpu_time():
+    # user and system time of this process, in seconds; the time of the joblib workers is accounted by the phases they
+    # run, counting their time as child processes too would count it twice, or for the wrong job, as they are reused
+    rusage = resource.getrusage(resource.RUSAGE_SELF)
+    return rusage.ru_utime + rusage.ru_stime
+
+
+class JobAccounting:
+    # resources used by a job, and the time spent in each phase of it
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._start_cpu = cpu_time()
+        # time spent by the phases run by other processes, e.g., joblib workers
+        self._external_cpu = 0.0
+        self._peak_rss_reset = reset_peak_rss()
+        self.phases = list()
+
+    def add_phase(self, name, wall_time, phase_cpu_time=None, external=False):
+        self.phases.append({'name': name, 'wall_time': wall_time, 'cpu_time': phase_cpu_time, 'external': external})
+        if external and phase_cpu_time is not None:
+            self._external_cpu += phase_cpu_time
+
+    def stats(self):
+        return {'wall_time': time.perf_counter() - self._start,
+                'cpu_time': cpu_time() - self._start_cpu + self._external_cpu,
+                'peak_rss': peak_rss() if self._peak_rss_reset else None,
+                'phases': self.phases}
+
+
+_job_accounting = None
+
+
+def start_job_accounting():
+    global _job_accounting
+    _job_accounting = JobAccounting()
+    return _job_accounting
+
+
+def stop_job_accounting():
+    global _job_accounting
+    job_accounting, _job_accounting = _job_accounting, None
+    return job_accounting.stats() if job_accounting is not None else None
+
+
+def record_phase(name, wall_time, phase_cpu_time=None, pid=None):
+    # pid is the process that has run the phase, when it has not been run by the job process
+    if _job_accounting is not None:
+        _job_accounting.add_phase(name, wall_time, phase_cpu_time, pid is not None and pid != os.getpid())
+
+
+@contextmanager
+def phase(name):
+    # phases are recorded only when run by a job, functions can use this also when called directly
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start, time.process_time() - start_cpu)
+
+
+def timed(f, *args, **kwargs):
+    # runs f, possibly in another process, returning its result together with the time it took and the process
+    # that ran it, to be passed to record_phase
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    result = f(*args, **kwargs)
+    return result, time.perf_counter() - start, time.process_time() - start_cpu, os.getpid()
@@ -0,0 +1,37 @@
+import time
+
+import cherrypy
+
+
+def _handler_name(request):
+    if request.config.get('tools.staticdir.on', False):
+        return 'static'
+    callable_ = getattr(request.handler, 'callable', None)
+    return getattr(callable_, '__name__', 'other')
+
+
+class RequestMetricsTool(cherrypy.Tool):
+    # measures the time from the start of a request to the end of its response, streamed ones included, and observes
+    # it in the histogram set in config, labelled by the name of the handler
+    def __init__(self):
+        super().__init__('on_start_resource', self._start, priority=10)
+
+    def _setup(self):
+        super()._setup()
+        cherrypy.request.hooks.attach('on_end_request', self._end, **self._merged_args())
+
+    def _start(self, histogram=None):
+        # the handler is named before other tools, e.g., encode, wrap it
+        cherrypy.request.metrics_handler = _handler_name(cherrypy.request)
+        cherrypy.request.metrics_start = time.perf_counter()
+
+    def _end(self, histogram=None):
+        request = cherrypy.request
+        start = getattr(request, 'metrics_start', None)
+        if histogram is None or start is None:
+            return
+        histogram.observe(time.perf_counter() - start, handler=request.metrics_handler)
+
+
+def enable_request_metrics():
+    cherrypy.tools.request_metrics = RequestMetricsTool()
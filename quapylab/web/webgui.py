@@ -1,23 +1,59 @@
 import os
+import time
 
 import cherrypy
 from mako.lookup import TemplateLookup
 
 import quapylab
-from quapylab.db.quapydb import QuaPyDB, JobStatus
-from quapylab.services.experiments import train_quantifier
+from quapylab.db.filedb import check_name
+from quapylab.db.quapydb import QuaPyDB, JobStatus, COMPLETED_JOB_STATUSES
+from quapylab.services.plans import PLANS, DEFAULT_PLAN, CUSTOM_PLAN, METHOD_NAMES, plan_method_names
+from quapylab.services.quantification import TrainedQuantifier
+from quapylab.services.reports import report_is_rendered, results_version
+from quapylab.util.lru import LRUCache
+from quapylab.util.metrics import Registry, Counter, Gauge, Histogram, CONTENT_TYPE
 from quapylab.web import media
 from quapylab.web.auth import USER_SESSION_KEY
 
+LOG_POLL_INTERVAL = 0.5  # seconds
+LOG_KEEPALIVE_INTERVAL = 15  # seconds
+# a log stream holds a server thread, it is closed after a while and the client reconnects from the last event id
+LOG_STREAM_DURATION = 60  # seconds
+LOG_RECONNECT_DELAY = 3  # seconds
+REPORT_RETRY_INTERVAL = 300  # seconds
+# rendering a report is quick and someone is waiting for it
+REPORT_PRIORITY = 1
+
+
+def parse_log_offset(value):
+    # offsets past the end of the log are read from its start, as the log of a job run again
+    try:
+        offset = int(value)
+    except (TypeError, ValueError):
+        offset = -1
+    if offset < 0:
+        raise cherrypy.HTTPError(400, f'Invalid log offset {value}')
+    return offset
+
 
 class QuaPyLab:
-    def __init__(self, name, db: QuaPyDB):
+    def __init__(self, name, db: QuaPyDB, quantifier_cache_size=8):
         self._name = name
         self._db = db
+        self._quantifier_cache = LRUCache(quantifier_cache_size)
+        self._report_requests = dict()
+        self._metrics = Registry()
+        self._request_latency = self._metrics.register(
+            Histogram('quapylab_http_request_duration_seconds', 'Time to serve HTTP requests, by handler',
+                      labelnames=['handler']))
+        self._metrics.add_collector(self._collect_metrics)
         self._media_dir = media.__path__[0]
         self._template_data = {'name': self._name,
                                'version': self.version(),
                                'db': self._db,
+                               'plans': list(PLANS) + [CUSTOM_PLAN],
+                               'default_plan': DEFAULT_PLAN,
+                               'method_names': METHOD_NAMES,
                                }
         self._lookup = TemplateLookup(os.path.join(self._media_dir, 'template'), input_encoding='utf-8',
                                       output_encoding='utf-8')
@@ -39,6 +75,9 @@ class QuaPyLab:
                  'tools.staticdir.dir': self._db.get_report_dir(),
                  'tools.auth.on': False,
                  },
+            '/metrics':
+                {'tools.auth.on': False,
+                 },
         }
 
     def __enter__(self):
@@ -47,6 +86,31 @@ class QuaPyLab:
     def __exit__(self, exc_type, exc_value, traceback):
         return False
 
+    @property
+    def request_latency(self):
+        # observed by the request_metrics tool
+        return self._request_latency
+
+    def add_metrics_collector(self, collector):
+        self._metrics.add_collector(collector)
+
+    def _collect_metrics(self):
+        jobs = Gauge('quapylab_jobs', 'Jobs in each status', ['status'])
+        for status, count in self._db.get_job_status_counts().items():
+            jobs.set(count, status=status.value)
+        cache_requests = Counter('quapylab_quantifier_cache_requests_total',
+                                 'Quantifiers requested to the cache of loaded quantifiers, by result', ['result'])
+        cache_requests.inc(self._quantifier_cache.hits, result='hit')
+        cache_requests.inc(self._quantifier_cache.misses, result='miss')
+        cache_size = Gauge('quapylab_quantifier_cache_size', 'Quantifiers kept loaded in the cache')
+        cache_size.set(len(self._quantifier_cache))
+        return [jobs, cache_requests, cache_size]
+
+    @cherrypy.expose
+    def metrics(self):
+        cherrypy.response.headers['Content-Type'] = CONTENT_TYPE
+        return self._metrics.render()
+
     @property
     def session_data(self):
         return {'username': cherrypy.request.login, 'mount_dir': cherrypy.request.app.script_name}
@@ -89,12 +153,29 @@ class QuaPyLab:
         return template.render(**{**self._template_data, **self.session_data})
 
     @cherrypy.expose
-    def upload_dataset(self, name, file, overwrite=False):
+    def upload_dataset(self, name, file, overwrite=False, priority=0, model_selection=False, plan=DEFAULT_PLAN,
+                       methods=None, budget=None):
         if isinstance(overwrite, str):
             if overwrite.lower() == 'false':
                 overwrite = False
+        if isinstance(model_selection, str):
+            model_selection = model_selection.lower() not in ['false', '0', '']
+        # a custom plan lists its methods, separated by commas
+        if plan == CUSTOM_PLAN:
+            plan = [method.strip() for method in (methods or '').split(',') if method.strip()]
+        try:
+            plan_method_names(plan)
+            # seconds, empty or zero for no limit
+            budget = float(budget) if budget else None
+            priority = int(priority)
+        except ValueError as e:
+            raise cherrypy.HTTPError(400, str(e))
+        if budget is not None and budget <= 0:
+            budget = None
         self._db.set_dataset_from_file(name, file, overwrite)
-        self._db.create_job(train_quantifier, {'name': name, 'overwrite': overwrite})
+        self._db.create_job('train_quantifier', {'name': name, 'overwrite': overwrite,
+                                                 'model_selection': model_selection, 'plan': plan, 'budget': budget},
+                            priority, cherrypy.request.login)
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
@@ -118,13 +199,84 @@ class QuaPyLab:
             page_size = int(page_size)
         except (ValueError, TypeError):
             page_size = 0
-        dataset_names = self._db.get_dataset_names()[page * page_size:(page + 1) * page_size]
-        return [self._db.get_dataset_info(dataset_name) for dataset_name in dataset_names]
+        dataset_infos, _ = self._db.get_dataset_list(page, page_size)
+        return dataset_infos
+
+    def _get_trained_quantifier(self, name):
+        try:
+            version = self._db.get_quantifier_version(name)
+        except ValueError as e:
+            raise cherrypy.HTTPError(400, str(e))
+        if version is None:
+            raise cherrypy.HTTPError(404, f'No quantifier for dataset {name}')
+        quantifier = self._quantifier_cache.get(name, version)
+        if quantifier is None:
+            quantifier = self._db.get_quantifier(name)
+            if quantifier is None:
+                # deleted meanwhile
+                raise cherrypy.HTTPError(404, f'No quantifier for dataset {name}')
+            if not isinstance(quantifier, TrainedQuantifier):
+                raise cherrypy.HTTPError(409, f'The quantifier for dataset {name} has been trained by an older '
+                                              f'version, train it again to use it')
+            self._quantifier_cache.put(name, quantifier, version)
+        return quantifier
+
+    @cherrypy.expose
+    @cherrypy.tools.json_in(force=False)
+    @cherrypy.tools.json_out()
+    def quantify(self, name=None, file=None):
+        import pandas as pd
+
+        request_json = getattr(cherrypy.request, 'json', None)
+        if request_json is not None:
+            name = request_json.get('name', name)
+            df = pd.DataFrame(request_json.get('rows', list()))
+        elif file is not None:
+            df = pd.read_csv(file.file)
+        else:
+            raise cherrypy.HTTPError(400, 'Data must be sent either as JSON rows or as a CSV file')
+        if name is None:
+            raise cherrypy.HTTPError(400, 'Missing quantifier name')
+        if len(df) == 0:
+            raise cherrypy.HTTPError(400, 'No rows to quantify')
+        quantifier = self._get_trained_quantifier(name)
+        try:
+            prevalences = quantifier.quantify(df)
+        except KeyError as e:
+            raise cherrypy.HTTPError(400, f'Missing column {e}')
+        return {'name': name, 'size': len(df), 'prevalences': prevalences}
 
     @cherrypy.expose
     def report(self, name):
+        self._check_report_name(name)
+        rendered = report_is_rendered(self._db.get_report_dir(), name)
+        if not rendered:
+            self._request_report(name)
         template = self._lookup.get_template('report.html')
-        return template.render(**{**self._template_data, **self.session_data, **{'name': name}})
+        # the version makes browsers reload the plots of a report rendered again
+        version = results_version(self._db.get_report_dir(), name)
+        return template.render(**{**self._template_data, **self.session_data,
+                                  **{'name': name, 'rendered': rendered, 'version': version or ''}})
+
+    def _check_report_name(self, name):
+        # the name is a part of the paths of the report files
+        try:
+            check_name(name)
+        except ValueError as e:
+            raise cherrypy.HTTPError(400, str(e))
+
+    def _request_report(self, name):
+        # reports are rendered by a job the first time they are requested, a request is repeated only if the results
+        # have changed or the previous one has not produced the report in a while
+        self._check_report_name(name)
+        version = results_version(self._db.get_report_dir(), name)
+        if version is None:
+            raise cherrypy.HTTPError(404, f'No report for dataset {name}')
+        requested_version, requested_time = self._report_requests.get(name, (None, None))
+        if requested_version == version and time.monotonic() - requested_time < REPORT_RETRY_INTERVAL:
+            return
+        self._report_requests[name] = (version, time.monotonic())
+        self._db.create_job('render_report', {'name': name}, REPORT_PRIORITY, cherrypy.request.login)
 
     @cherrypy.expose
     def jobs(self):
@@ -147,22 +299,18 @@ class QuaPyLab:
             page_size = int(page_size)
         except (ValueError, TypeError):
             page_size = 0
-        job_ids = self._db.get_job_ids()[page * page_size:(page + 1) * page_size]
-        return [self._db.get_job_info(job_id) for job_id in job_ids]
+        return self._db.get_job_list(page, page_size)
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
     def delete_jobs_done(self):
-        for job_id in self._db.get_job_ids():
-            if self._db.get_job_info(job_id)['status'] == JobStatus.done.value:
-                self._db.delete_job(job_id)
+        self._db.delete_jobs(JobStatus.done)
         return 'ok'
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
     def delete_jobs_all(self):
-        for job_id in self._db.get_job_ids():
-            self._db.delete_job(job_id)
+        self._db.delete_jobs()
         return 'ok'
 
     @cherrypy.expose
@@ -179,8 +327,62 @@ class QuaPyLab:
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
-    def get_job_log(self, job_id):
-        return self._db.get_job_log_content(job_id)
+    def cancel_job(self, job_id):
+        try:
+            self._db.cancel_job(job_id)
+        except ValueError as e:
+            raise cherrypy.HTTPError(409, str(e))
+        return 'ok'
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def get_job_log(self, job_id, offset=0):
+        content, offset = self._db.get_job_log_content(job_id, parse_log_offset(offset))
+        return {'content': content, 'offset': offset}
+
+    def _job_completed(self, job_id):
+        try:
+            status = self._db.get_job_info(job_id)['status']
+        except (KeyError, StopIteration):
+            # the job has been deleted
+            return True
+        return status in [completed_status.value for completed_status in COMPLETED_JOB_STATUSES]
+
+    def _log_events(self, job_id, offset):
+        start = last_event = time.monotonic()
+        yield f'retry: {LOG_RECONNECT_DELAY * 1000}\n\n'
+        while time.monotonic() - start < LOG_STREAM_DURATION:
+            # the status is checked before reading, so that the lines written before completion are all sent
+            completed = self._job_completed(job_id)
+            content, next_offset = self._db.get_job_log_content(job_id, offset)
+            if next_offset < offset:
+                yield 'event: reset\ndata: \n\n'
+            offset = next_offset
+            if content:
+                data = ''.join(f'data: {line}\n' for line in content.split('\n')[:-1])
+                yield f'id: {offset}\n{data}\n'
+                last_event = time.monotonic()
+            elif completed:
+                yield 'event: end\ndata: \n\n'
+                return
+            elif time.monotonic() - last_event > LOG_KEEPALIVE_INTERVAL:
+                # detects clients that have gone away
+                yield ': keepalive\n\n'
+                last_event = time.monotonic()
+            else:
+                time.sleep(LOG_POLL_INTERVAL)
+
+    @cherrypy.expose
+    def stream_job_log(self, job_id, offset=0):
+        # Server-Sent Events stream of the lines of the log, a reconnecting client resumes from the last event id
+        offset = parse_log_offset(cherrypy.request.headers.get('Last-Event-ID', offset))
+        cherrypy.response.headers['Content-Type'] = 'text/event-stream'
+        cherrypy.response.headers['Cache-Control'] = 'no-cache'
+        return self._log_events(job_id, offset)
+
+    # the session is only read to check the login, locking it would block the other requests of the user for as long
+    # as the stream is open
+    stream_job_log._cp_config = {'response.stream': True, 'tools.sessions.locking': 'explicit'}
 
     @cherrypy.expose
     def about(self):
@@ -0,0 +1,27 @@
+import datetime
+
+import pytest
+
+from quapylab.db import open_db, filedb, sqlitedb
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def db(request, tmp_path):
+    prefix = 'sqlite://' if request.param == 'sqlite' else ''
+    with open_db(f'{prefix}{tmp_path / "db"}') as db:
+        yield db
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # job ids and times advance by one second at each call, starting a minute ago, so that jobs are ordered by
+    # creation and none of them has aged
+    now = [datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(minutes=1)]
+
+    def datetime_now_to_filename():
+        now[0] += datetime.timedelta(seconds=1)
+        return now[0].strftime('%Y-%m-%d_%H-%M-%S')
+
+    for module in [filedb, sqlitedb]:
+        monkeypatch.setattr(module, 'datetime_now_to_filename', datetime_now_to_filename)
+
@@ -0,0 +1,19 @@
+import io
+from types import SimpleNamespace
+
+
+def upload(db, name, content):
+    db.set_dataset_from_file(name, SimpleNamespace(file=io.BytesIO(content.encode('utf-8'))), False)
+
+
+def create_job(db, name, priority=0, username=None):
+    db.create_job('train_quantifier', {'name': name}, priority, username)
+
+
+def pop_all(db, scheduler=None):
+    names = list()
+    while True:
+        job_id, _, kwargs = db.pop_pending_job(scheduler)
+        if job_id is None:
+            return names
+        names.append(kwargs['name'])
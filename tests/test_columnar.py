@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from quapylab.db import filedb
+from quapylab.db.columnar import ColumnarReader, ColumnarWriter, write_dataframe, NUMERIC_KIND, STRING_KIND
+from quapylab.db.filedb import FileDB
+from tests.helpers import upload
+
+
+def write_chunks(path, chunks):
+    with ColumnarWriter(path) as writer:
+        for chunk in chunks:
+            writer.append(chunk)
+    return ColumnarReader(path)
+
+
+def kinds(reader):
+    return [(column['kind'], column['dtype']) for column in reader._columns]
+
+
+def test_numeric_promotion(tmp_path):
+    reader = write_chunks(tmp_path / 'a', [pd.DataFrame({'x': [True, False]}), pd.DataFrame({'x': [3, 4]}),
+                                           pd.DataFrame({'x': [0.5, np.nan]})])
+    assert kinds(reader) == [(NUMERIC_KIND, 'float64')]
+    np.testing.assert_array_equal(reader.read_column('x'), [1, 0, 3, 4, 0.5, np.nan])
+
+
+def test_numeric_column_with_strings_in_a_later_chunk(tmp_path):
+    reader = write_chunks(tmp_path / 'a', [pd.DataFrame({'x': [1, 2]}), pd.DataFrame({'x': [np.nan, 2.5]}),
+                                           pd.DataFrame({'x': ['a', 'b']}), pd.DataFrame({'x': [5, 6]})])
+    assert kinds(reader) == [(STRING_KIND, None)]
+    assert reader.read_column('x').tolist() == ['1.0', '2.0', '', '2.5', 'a', 'b', '5', '6']
+
+
+def test_null_column_with_strings_in_a_later_chunk(tmp_path):
+    reader = write_chunks(tmp_path / 'a', [pd.DataFrame({'x': [np.nan, np.nan]}), pd.DataFrame({'x': ['a', 'b']})])
+    assert kinds(reader) == [(STRING_KIND, None)]
+    assert reader.read_column('x').tolist() == ['', '', 'a', 'b']
+
+
+def test_converted_column_hash(tmp_path):
+    # a column converted to strings has the hash of the same strings written at once
+    reader = write_chunks(tmp_path / 'a', [pd.DataFrame({'x': [1, 2]}), pd.DataFrame({'x': ['a']})])
+    write_dataframe(tmp_path / 'b', pd.DataFrame({'x': ['1', '2', 'a']}))
+    assert reader.column_hash('x') == ColumnarReader(tmp_path / 'b').column_hash('x')
+
+
+def test_rows_slice(tmp_path):
+    reader = write_chunks(tmp_path / 'a', [pd.DataFrame({'x': ['a', 'bb'], 'y': [1, 2]}),
+                                           pd.DataFrame({'x': ['ccc', ''], 'y': [3, 4]})])
+    df = reader.read(rows=slice(1, 3))
+    assert df['x'].tolist() == ['bb', 'ccc']
+    assert df['y'].tolist() == [2, 3]
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(filedb, 'DATASET_CHUNK_SIZE', 3)
+
+
+def test_mixed_label_column_across_chunks(tmp_path, small_chunks):
+    db = FileDB(tmp_path / 'db')
+    labels = [0, 1, 0, 1, 'pos', 'neg', 1]
+    upload(db, 'mixed', 'label,x\n' + ''.join(f'{label},{i}\n' for i, label in enumerate(labels)))
+    df = db.get_dataset('mixed')
+    assert df['label'].tolist() == [str(label) for label in labels]
+    assert df['x'].tolist() == list(range(len(labels)))
+
+
+def test_data_column_with_strings_in_a_later_chunk(tmp_path, small_chunks):
+    db = FileDB(tmp_path / 'db')
+    with pytest.raises(ValueError, match='not numeric'):
+        upload(db, 'bad', 'label,x\n' + ''.join(f'{i % 2},{i}\n' for i in range(5)) + '1,oops\n')
+    assert db.get_dataset_count() == 0
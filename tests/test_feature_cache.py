@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix, random as sparse_random, vstack
+
+pytest.importorskip('sklearn')
+
+from quapylab.services.feature_cache import FeatureCache, _entry_size
+from quapylab.services.vectorization import StreamingTfidfVectorizer
+
+
+def matrix(seed, rows=50):
+    return csr_matrix(sparse_random(rows, 100, density=0.1, random_state=seed, dtype=np.float64))
+
+
+@pytest.fixture
+def vectorizer():
+    return StreamingTfidfVectorizer(n_features=100)
+
+
+def test_get_missing(tmp_path):
+    assert FeatureCache(tmp_path, 1 << 30).get('missing') is None
+
+
+def test_put_and_get(tmp_path, vectorizer):
+    cache = FeatureCache(tmp_path, 1 << 30)
+    key = cache.key('hash', vectorizer)
+    X = matrix(0)
+    cache.put(key, vectorizer, X)
+    cached_vectorizer, cached_X = cache.get(key)
+    assert cached_vectorizer.get_params() == vectorizer.get_params()
+    assert (cached_X != X).nnz == 0
+
+
+def test_put_chunks(tmp_path, vectorizer):
+    cache = FeatureCache(tmp_path, 1 << 30)
+    chunks = [matrix(seed, rows) for seed, rows in enumerate([10, 0, 25, 1])]
+    cache.put_chunks('chunked', vectorizer, iter(chunks), 100)
+    _, cached_X = cache.get('chunked')
+    assert cached_X.shape == (36, 100)
+    assert (cached_X != vstack(chunks)).nnz == 0
+
+
+def test_key(tmp_path, vectorizer):
+    cache = FeatureCache(tmp_path, 1 << 30)
+    assert cache.key('hash', vectorizer) == cache.key('hash', StreamingTfidfVectorizer(n_features=100))
+    assert cache.key('hash', vectorizer) != cache.key('other', vectorizer)
+    assert cache.key('hash', vectorizer) != cache.key('hash', StreamingTfidfVectorizer(n_features=100, use_idf=False))
+
+
+def test_least_recently_used_are_evicted(tmp_path, vectorizer):
+    probe = FeatureCache(tmp_path / 'probe', 1 << 30)
+    probe.put('probe', vectorizer, matrix(0))
+    entry_size = _entry_size(tmp_path / 'probe' / 'features' / 'probe')
+    # room for two entries
+    cache = FeatureCache(tmp_path, entry_size * 2 + entry_size // 2)
+    cache.put('a', vectorizer, matrix(1))
+    cache.put('b', vectorizer, matrix(2))
+    entries = tmp_path / 'features'
+    os.utime(entries / 'a', (1000, 1000))
+    os.utime(entries / 'b', (2000, 2000))
+    # reading an entry makes it the most recently used
+    assert cache.get('a') is not None
+    cache.put('c', vectorizer, matrix(3))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+
+def test_entry_larger_than_the_cache_is_kept(tmp_path, vectorizer):
+    cache = FeatureCache(tmp_path, 1)
+    cache.put('a', vectorizer, matrix(1))
+    cache.put('b', vectorizer, matrix(2))
+    assert cache.get('a') is None
+    assert cache.get('b') is not None
@@ -0,0 +1,127 @@
+import pytest
+
+from quapylab.db import filedb, sqlitedb
+from quapylab.db.quapydb import JobStatus
+from tests.helpers import create_job
+
+
+def only_job_id(db):
+    job_ids = db.get_job_ids()
+    assert len(job_ids) == 1
+    return job_ids[0]
+
+
+def status(db, job_id):
+    return db.get_job_info(job_id)['status']
+
+
+@pytest.fixture
+def expired_leases(monkeypatch):
+    # leases expire as soon as they are taken
+    for module in [filedb, sqlitedb]:
+        monkeypatch.setattr(module, 'JOB_LEASE_DURATION', -1)
+
+
+def test_lifecycle(db, clock):
+    create_job(db, 'data', priority=2, username='alice')
+    job_id = only_job_id(db)
+    info = db.get_job_info(job_id)
+    assert (info['status'], info['function'], info['dataset'], info['priority'], info['username']) == \
+           ('pending', 'train_quantifier', 'data', 2, 'alice')
+    assert info['started'] == 'n/a' and info['completed'] == 'n/a'
+
+    popped_id, function, kwargs = db.pop_pending_job(owner='p1')
+    assert (popped_id, function, kwargs) == (job_id, 'train_quantifier', {'name': 'data'})
+    assert status(db, job_id) == 'running'
+    assert db.pop_pending_job(owner='p2') == (None, None, None)
+
+    db.set_job_stats(job_id, {'wall_time': 1.5})
+    db.set_job_completed(job_id, JobStatus.done, owner='p1')
+    info = db.get_job_info(job_id)
+    assert info['status'] == 'done' and info['completed'] != 'n/a'
+    assert info['stats'] == {'wall_time': 1.5}
+    assert db.get_job_status_counts()[JobStatus.done] == 1
+
+    db.rerun_job(job_id)
+    info = db.get_job_info(job_id)
+    assert info['status'] == 'pending' and info['stats'] is None
+
+    db.delete_job(job_id)
+    assert db.get_job_ids() == [] and db.get_job_count() == 0
+
+
+def test_leases(db, clock):
+    create_job(db, 'data')
+    job_id, _, _ = db.pop_pending_job(owner='p1')
+    assert db.renew_job_leases('p1', [job_id]) == {job_id}
+    assert db.renew_job_leases('p2', [job_id]) == set()
+    # a live owner with a valid lease keeps its job
+    assert db.requeue_expired_jobs(lambda owner: True) == []
+    assert status(db, job_id) == 'running'
+
+
+def test_requeue_dead_owner(db, clock):
+    create_job(db, 'data')
+    job_id, _, _ = db.pop_pending_job(owner='p1')
+    assert db.requeue_expired_jobs(lambda owner: owner != 'p1') == [job_id]
+    assert status(db, job_id) == 'pending'
+    # the former owner has lost the job, its completion is ignored
+    assert db.renew_job_leases('p1', [job_id]) == set()
+    db.set_job_completed(job_id, JobStatus.done, owner='p1')
+    assert status(db, job_id) == 'pending'
+
+    assert db.pop_pending_job(owner='p2')[0] == job_id
+    db.set_job_completed(job_id, JobStatus.error, owner='p2')
+    assert status(db, job_id) == 'error'
+
+
+def test_requeue_expired_lease(db, clock, expired_leases):
+    create_job(db, 'data')
+    job_id, _, _ = db.pop_pending_job(owner='p1')
+    assert db.requeue_expired_jobs() == [job_id]
+    assert status(db, job_id) == 'pending'
+    assert db.requeue_expired_jobs() == []
+
+
+def test_cancel(db, clock):
+    create_job(db, 'pending')
+    create_job(db, 'running')
+    create_job(db, 'done')
+    pending_id, running_id, done_id = db.get_job_ids()
+    db.pop_pending_job()
+    db.pop_pending_job()
+    db.pop_pending_job()
+    db.rerun_job(pending_id)
+    db.set_job_done(done_id)
+
+    db.cancel_job(pending_id)
+    assert status(db, pending_id) == 'cancelled'
+    db.cancel_job(running_id)
+    assert status(db, running_id) == 'running'
+    assert running_id in db.get_cancel_requests()
+    with pytest.raises(ValueError):
+        db.cancel_job(done_id)
+
+    db.set_job_completed(running_id, JobStatus.cancelled)
+    assert running_id not in db.get_cancel_requests()
+    db.delete_jobs(JobStatus.cancelled)
+    assert db.get_job_ids() == [done_id]
+
+
+def test_log(db, clock):
+    create_job(db, 'data')
+    job_id = only_job_id(db)
+    assert db.get_job_log_content(job_id) == ('', 0)
+    with db.get_job_log_stream(job_id) as log:
+        log.write('first\nsecond\nthi')
+        log.flush()
+        content, offset = db.get_job_log_content(job_id)
+        assert (content, offset) == ('first\nsecond\n', 13)
+        # incomplete lines are returned once complete
+        assert db.get_job_log_content(job_id, offset) == ('', 13)
+        log.write('rd\n')
+    assert db.get_job_log_content(job_id, offset) == ('third\n', 19)
+    # an offset past the end of a log rewritten by a rerun reads it from the start
+    with db.get_job_log_stream(job_id) as log:
+        log.write('new\n')
+    assert db.get_job_log_content(job_id, 19) == ('new\n', 4)
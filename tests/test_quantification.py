@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('quapy')
+
+from quapy.data import LabelledCollection
+from sklearn.datasets import make_classification
+
+from quapylab.services import quantification
+from quapylab.services.quantification import TrainedQuantifier, ChunkedQuantification, CHUNK_ESTIMATES
+from quapylab.services.training import CLASSIFIERS, METHODS, Candidate
+
+CHUNK_ROWS = 70
+
+
+@pytest.fixture(scope='module')
+def data():
+    X, y = make_classification(900, 10, random_state=0)
+    columns = [f'f{i}' for i in range(X.shape[1])]
+    train = LabelledCollection(X[:600], y[:600])
+    test = pd.DataFrame(X[600:], columns=columns)
+    return train, test, columns
+
+
+@pytest.mark.parametrize('method', [method for method in METHODS if method.shared], ids=lambda method: method.name)
+def test_chunked_quantification(method, data, tmp_path, monkeypatch):
+    # aggregations running through the outputs in chunks are checked on chunks smaller than the data too
+    monkeypatch.setattr(quantification, 'AGGREGATION_CHUNK_ROWS', 50)
+    train, test, columns = data
+    model = Candidate(method).create(CLASSIFIERS[method.classifier]())
+    model.fit(train)
+    trained_quantifier = TrainedQuantifier(model, method.name, train.classes_, data_column_names=columns)
+    chunked = ChunkedQuantification(trained_quantifier, tmp_path / 'outputs')
+    try:
+        for start in range(0, len(test), CHUNK_ROWS):
+            chunked.add(test[start:start + CHUNK_ROWS])
+        prevalences = chunked.prevalences()
+    finally:
+        chunked.close()
+    assert chunked.exact and chunked.rows == len(test)
+    expected = trained_quantifier.quantify(test)
+    assert prevalences.keys() == expected.keys()
+    np.testing.assert_allclose(list(prevalences.values()), list(expected.values()), atol=1e-6)
+
+
+def test_chunk_estimates(data, tmp_path):
+    # non aggregative quantifiers are applied to each chunk, and the estimates weighted by the rows of the chunks
+    class Constant:
+        def quantify(self, X):
+            return np.asarray([len(X) % 2, 1 - len(X) % 2])
+
+    train, test, columns = data
+    trained_quantifier = TrainedQuantifier(Constant(), 'constant', train.classes_, data_column_names=columns)
+    chunked = ChunkedQuantification(trained_quantifier, tmp_path / 'outputs')
+    assert chunked._accumulation == CHUNK_ESTIMATES and not chunked.exact
+    chunked.add(test[:3])
+    chunked.add(test[3:5])
+    assert chunked.prevalences() == {'0': 0.6, '1': 0.4}
+    with pytest.raises(ValueError):
+        ChunkedQuantification(trained_quantifier, tmp_path / 'empty').prevalences()
@@ -0,0 +1,95 @@
+import datetime
+
+import pytest
+
+from quapylab.db.scheduling import Scheduler, FIFO_POLICY, PRIORITY_POLICY, SJF_POLICY, FAIR_POLICY, AGING_INTERVAL
+from tests.helpers import create_job, pop_all, upload
+
+NOW = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+
+def job(job_id, seconds_ago=0, priority=0, username=None, dataset=None):
+    created = (NOW - datetime.timedelta(seconds=seconds_ago)).strftime('%Y-%m-%d_%H-%M-%S')
+    return {'job_id': f'{created}.{job_id}', 'created': created, 'priority': priority, 'username': username,
+            'dataset': dataset}
+
+
+def ordered_ids(policy, pending, running=(), sizes=None):
+    cost = (lambda job_info: sizes[job_info['dataset']]) if sizes is not None else None
+    return [job_info['job_id'].split('.')[1] for job_info in Scheduler(policy).order(pending, running, cost, NOW)]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        Scheduler('lifo')
+
+
+def test_fifo():
+    pending = [job('b', 10, priority=5), job('a', 20), job('c', 5)]
+    assert ordered_ids(FIFO_POLICY, pending) == ['a', 'b', 'c']
+
+
+def test_priority():
+    pending = [job('a', 30), job('b', 20, priority=2), job('c', 10, priority=2)]
+    assert ordered_ids(PRIORITY_POLICY, pending) == ['b', 'c', 'a']
+
+
+def test_priority_aging():
+    # a job waiting for three aging intervals overtakes a newer one with two more levels of priority
+    pending = [job('new', 0, priority=2), job('old', 3 * AGING_INTERVAL)]
+    assert ordered_ids(PRIORITY_POLICY, pending) == ['old', 'new']
+
+
+def test_sjf():
+    sizes = {'small': 10, 'large': 1000}
+    pending = [job('a', 30, dataset='large'), job('b', 20, dataset='small'), job('c', 10, priority=1, dataset='large')]
+    assert ordered_ids(SJF_POLICY, pending, sizes=sizes) == ['c', 'b', 'a']
+
+
+def test_sjf_aging():
+    # the cost of a waiting job is halved at every aging interval, without raising its priority past the other one
+    sizes = {'small': 10, 'large': 1000}
+    pending = [job('large', AGING_INTERVAL * 7 + 1, priority=-7, dataset='large'), job('small', 0, dataset='small')]
+    assert ordered_ids(SJF_POLICY, pending, sizes=sizes) == ['large', 'small']
+
+
+def test_fair():
+    sizes = {'small': 10, 'large': 1000}
+    pending = [job('a', 30, username='alice', dataset='small'), job('b', 20, username='bob', dataset='large')]
+    running = [job('r', 60, username='alice')]
+    assert ordered_ids(FAIR_POLICY, pending, running, sizes) == ['b', 'a']
+    assert ordered_ids(FAIR_POLICY, pending, (), sizes) == ['a', 'b']
+
+
+def test_pop_fifo(db, clock):
+    for name in ['first', 'second', 'third']:
+        create_job(db, name, priority=len(name))
+    assert pop_all(db) == ['first', 'second', 'third']
+
+
+def test_pop_priority(db, clock):
+    create_job(db, 'low')
+    create_job(db, 'high', priority=3)
+    create_job(db, 'medium', priority=1)
+    assert pop_all(db, Scheduler(PRIORITY_POLICY)) == ['high', 'medium', 'low']
+
+
+def test_pop_sjf(db, clock):
+    upload(db, 'large', 'label,x\n' + ''.join(f'{i % 2},{i}\n' for i in range(100)))
+    upload(db, 'small', 'label,x\n0,1\n1,2\n')
+    create_job(db, 'large')
+    create_job(db, 'small')
+    create_job(db, 'missing')
+    assert pop_all(db, Scheduler(SJF_POLICY)) == ['missing', 'small', 'large']
+
+
+def test_pop_fair(db, clock):
+    create_job(db, 'alice_1', username='alice')
+    create_job(db, 'alice_2', username='alice')
+    create_job(db, 'bob_1', username='bob')
+    scheduler = Scheduler(FAIR_POLICY)
+    # alice_1 is running when the next job is chosen
+    assert db.pop_pending_job(scheduler)[2]['name'] == 'alice_1'
+    assert db.pop_pending_job(scheduler)[2]['name'] == 'bob_1'
+    assert db.pop_pending_job(scheduler)[2]['name'] == 'alice_2'
+    assert db.pop_pending_job(scheduler) == (None, None, None)
@@ -0,0 +1,58 @@
+import math
+
+import pytest
+
+pytest.importorskip('quapy')
+
+from joblib import Parallel
+from quapy.data import LabelledCollection
+from sklearn.datasets import make_classification
+
+from quapylab.services.training import (Budget, EVALUATION_REPEATS, HALVING_FACTOR, MIN_SELECTION_REPEATS,
+                                        halving_repeats, plan_methods, select_params)
+
+
+@pytest.mark.parametrize('candidates, expected', [(1, [33]), (3, [33]), (4, [11, 33]), (9, [11, 33]),
+                                                  (10, [10, 11, 33]), (28, [10, 10, 11, 33])])
+def test_halving_repeats(candidates, expected):
+    assert halving_repeats(candidates) == expected
+
+
+@pytest.mark.parametrize('candidates', range(1, 100))
+def test_halving_schedule(candidates):
+    repeats = halving_repeats(candidates)
+    # one round for each division of the candidates, until HALVING_FACTOR remain
+    survivors = candidates
+    for _ in repeats[1:]:
+        survivors = math.ceil(survivors / HALVING_FACTOR)
+    assert survivors <= HALVING_FACTOR
+    assert repeats == sorted(repeats)
+    assert repeats[0] >= MIN_SELECTION_REPEATS
+    assert repeats[-1] == EVALUATION_REPEATS // HALVING_FACTOR
+
+
+@pytest.fixture(scope='module')
+def train():
+    X, y = make_classification(600, 10, random_state=0)
+    return LabelledCollection(X, y)
+
+
+GRIDS = {'CC_SVM': {'classifier__C': [0.01, 0.1, 1, 10, 100]}, 'PACC_SVM': {'classifier__C': [0.1, 1]},
+         'EMQ_SVM': {'classifier__C': [1]}}
+
+
+def test_select_params(train):
+    methods = plan_methods(['CC_SVM', 'PACC_SVM', 'EMQ_SVM', 'HDy_LR'])
+    with Parallel(n_jobs=1) as parallel:
+        selected = select_params(parallel, methods, train, GRIDS, Budget(None, train), 1)
+    # methods with a single candidate, or without a grid, are not searched
+    assert selected.keys() == {'CC_SVM', 'PACC_SVM'}
+    for name, params in selected.items():
+        assert params['classifier__C'] in GRIDS[name]['classifier__C']
+
+
+def test_select_params_out_of_budget(train, capsys):
+    methods = plan_methods(['CC_SVM'])
+    with Parallel(n_jobs=1) as parallel:
+        assert select_params(parallel, methods, train, GRIDS, Budget(1e-6, train), 1) == dict()
+    assert 'Skipped the selection' in capsys.readouterr().out